@@ -14,6 +14,8 @@ class COMMAND:
     CMD_START = "Start"
     CMD_STOP = "Stop"
     CMD_MODE ="CMD_MODE"
+    CMD_SUBSCRIBE = "CMD_SUBSCRIBE"
+    CMD_STATS = "CMD_STATS"
     def __init__(self):
         pass
         #self.intervalChar
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import importlib.util
+import os
+import struct
+
+# Handshake line sent on the command port to switch the connection to binary frames.
+# The server repeats it, followed by '#<port>' when it accepts drive setpoints over UDP.
+PROTOCOL_HANDSHAKE = "CMD_PROTOCOL#1"
+# Latest-value-wins setpoints that may be sent over the UDP drive channel
+DRIVE_COMMANDS = ("CMD_MOTOR", "CMD_M_MOTOR", "CMD_CAR_ROTATE")
+
+# Every frame starts with a 1-byte opcode and a 16-bit sequence number, followed by fixed int16 arguments
+HEADER = struct.Struct('<BH')
+TEXT_LENGTH = struct.Struct('<H')
+OP_TEXT = 0xFF
+
+def load_opcodes():
+    """Load the binary command set from the server's opcodes.py, the one definition shared with the car."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Server', 'opcodes.py')
+    # Loaded by path under its own name; putting Code/Server on sys.path would shadow client modules such as Command
+    spec = importlib.util.spec_from_file_location('server_opcodes', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.OPCODES
+
+# Command -> (opcode, number of int16 arguments)
+OPCODES = {command: (opcode, count) for opcode, (command, count) in load_opcodes().items()}
+FRAME_STRUCTS = {command: struct.Struct('<BH' + 'h' * count) for command, (opcode, count) in OPCODES.items()}
+# Mode names the buttons send, with the values the server maps them to
+WORDS = {'one': 0, 'two': 1, 'three': 3, 'four': 2}
+
+def encode_text(message, sequence):
+    payload = message.strip().encode('utf-8')
+    return HEADER.pack(OP_TEXT, sequence & 0xFFFF) + TEXT_LENGTH.pack(len(payload)) + payload
+
+def encode(message, sequence):
+    """Encode one 'CMD_XXX#a#b...' command as a binary frame, or as a text frame if it has no binary layout."""
+    fields = message.strip().split('#')
+    layout = OPCODES.get(fields[0])
+    if layout is None:
+        return encode_text(message, sequence)
+    opcode, count = layout
+    try:
+        values = [WORDS[x] if x in WORDS else int(round(float(x))) for x in fields[1:] if x != '']
+    except ValueError:
+        return encode_text(message, sequence)
+    if len(values) != count or any(v < -32768 or v > 32767 for v in values):
+        return encode_text(message, sequence)
+    return FRAME_STRUCTS[fields[0]].pack(opcode, sequence & 0xFFFF, *values)
+
+def parse_ack(reply):
+    """Return (binary, udp_port) from the server's handshake reply."""
+    fields = reply.strip().split('#')
+    if '#'.join(fields[:2]) != PROTOCOL_HANDSHAKE:
+        return False, None
+    return True, int(fields[2]) if len(fields) > 2 and fields[2].isdigit() else None
+
+def is_stop(message):
+    """Check whether a drive command sets every argument to zero."""
+    return all(x in ('', '0') for x in message.strip().split('#')[1:])
+
+if __name__ == '__main__':
+    print(encode("CMD_M_MOTOR#45#1500#0#0\n", 1), encode("CMD_MODE#one\n", 2), encode("CMD_CLOSE\n", 3))
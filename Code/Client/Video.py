@@ -9,6 +9,7 @@ import struct
 from PIL import Image
 from multiprocessing import Process
 from Command import COMMAND as cmd
+import Protocol
 
 class VideoStreaming:
     def __init__(self):
@@ -17,15 +18,22 @@ class VideoStreaming:
         self.connect_Flag=False
         self.face_x=0
         self.face_y=0
+        self.binary_Request=True
+        self.binary_Flag=False
+        self.sequence=0
+        self.udp_Request=True
+        self.udp_Address=None
     def StartTcpClient(self,IP):
         self.client_socket1 = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.client_socket2 = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     def StopTcpcClient(self):
         try:
             self.client_socket.shutdown(2)
             self.client_socket1.shutdown(2)
             self.client_socket.close()
             self.client_socket1.close()
+            self.client_socket2.close()
         except:
             pass
 
@@ -79,7 +87,43 @@ class VideoStreaming:
                   
     def sendData(self,s):
         if self.connect_Flag:
-            self.client_socket1.send(s.encode('utf-8'))
+            if self.binary_Flag:
+                # A button may send several commands in one string
+                for line in s.split('\n'):
+                    if line.strip():
+                        self.sequence=(self.sequence+1)&0xFFFF
+                        frame=Protocol.encode(line,self.sequence)
+                        if self.udp_Address is not None and line.split('#')[0] in Protocol.DRIVE_COMMANDS:
+                            # Setpoints skip TCP head-of-line blocking; a stop also goes over TCP so it cannot be lost
+                            self.client_socket2.sendto(frame,self.udp_Address)
+                            if Protocol.is_stop(line):
+                                self.client_socket1.send(frame)
+                        else:
+                            self.client_socket1.send(frame)
+            else:
+                self.client_socket1.send(s.encode('utf-8'))
+
+    def negotiate_protocol(self,ip):
+        # Ask the server for binary command frames; servers that do not answer keep the text protocol
+        self.binary_Flag=False
+        self.udp_Address=None
+        reply=b''
+        try:
+            self.client_socket1.settimeout(1)
+            self.client_socket1.send((Protocol.PROTOCOL_HANDSHAKE+'\n').encode('utf-8'))
+            while not reply.endswith(b'\n'):
+                data=self.client_socket1.recv(1)
+                if not data:
+                    break
+                reply+=data
+        except Exception:
+            pass
+        finally:
+            self.client_socket1.settimeout(None)
+        self.binary_Flag,udp_port=Protocol.parse_ack(reply.decode('utf-8','replace'))
+        if self.udp_Request and udp_port is not None:
+            self.udp_Address=(ip,udp_port)
+        print ("Command protocol: "+("binary" if self.binary_Flag else "text")+(", drive over UDP" if self.udp_Address else ""))
 
     def recvData(self):
         data=""
@@ -92,6 +136,8 @@ class VideoStreaming:
     def socket1_connect(self,ip):
         try:
             self.client_socket1.connect((ip, 5000))
+            if self.binary_Request:
+                self.negotiate_protocol(ip)
             self.connect_Flag=True
             print ("Connection Successful !")
         except Exception as e:
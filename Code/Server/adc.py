@@ -1,30 +1,46 @@
-import smbus  # Import the smbus module for I2C communication
+from i2c_bus import get_bus  # Import the shared I2C bus handle
+import statistics  # Import the statistics module for medians without numpy
 import time  # Import the time module for sleep functionality
 from parameter import ParameterManager  # Import the ParameterManager class from the parameter module
+from scheduler import FixedRateLoop  # Import the fixed-rate loop that paces the sampler
+from stats import registry  # Import the shared stats registry
+try:
+    import numpy  # Ring buffers are numpy arrays when it is installed
+except ImportError:
+    numpy = None  # Ring buffers are lists without it
 
 class ADC:
-    def __init__(self):
+    def __init__(self, retries: int = 8):
         """Initialize the ADC class."""
         self.I2C_ADDRESS = 0x48                                               # Set the I2C address of the ADC
         self.ADS7830_COMMAND = 0x84                                           # Set the command byte for ADS7830
         self.parameter_manager = ParameterManager()                           # Create an instance of ParameterManager
         self.pcb_version = self.parameter_manager.get_pcb_version()           # Get the PCB version
         self.adc_voltage_coefficient = 3.3 if self.pcb_version == 1 else 5.2  # Set the ADC voltage coefficient based on the PCB version
-        self.i2c_bus = smbus.SMBus(1)                                         # Initialize the I2C bus
+        self.i2c_bus = get_bus(1)                                             # Share the I2C bus with the PCA9685
+        self.retries = retries                                                # Read pairs tried for a stable byte before settling for their median
+        self.noise = registry.counter('adc.noise')                            # Read pairs that disagreed
+        self.unstable = registry.counter('adc.unstable')                      # Reads that ran out of retries
 
     def _read_stable_byte(self) -> int:
-        """Read a stable byte from the ADC."""
-        while True:
+        """Read a stable byte from the ADC, trying at most `retries` pairs of reads."""
+        values = []
+        for _ in range(self.retries):
             value1 = self.i2c_bus.read_byte(self.I2C_ADDRESS)                 # Read the first byte from the ADC
             value2 = self.i2c_bus.read_byte(self.I2C_ADDRESS)                 # Read the second byte from the ADC
             if value1 == value2:
                 return value1                                                 # Return the value if both reads are the same
+            self.noise.increment()                                            # Count the disagreement and try again
+            values += [value1, value2]
+        self.unstable.increment()                                             # Too noisy to settle: use the median of every read
+        return sorted(values)[len(values) // 2]
 
     def read_adc(self, channel: int) -> float:
         """Read the ADC value for the specified channel using ADS7830."""
         command_set = self.ADS7830_COMMAND | ((((channel << 2) | (channel >> 1)) & 0x07) << 4)  # Calculate the command set for the specified channel
-        self.i2c_bus.write_byte(self.I2C_ADDRESS, command_set)                # Write the command set to the ADC
-        value = self._read_stable_byte()                                      # Read a stable byte from the ADC
+        with self.i2c_bus.transaction():                                      # Keep other devices off the bus between command and reads
+            self.i2c_bus.write_byte(self.I2C_ADDRESS, command_set)            # Write the command set to the ADC
+            value = self._read_stable_byte()                                  # Read a stable byte from the ADC
         voltage = value / 255.0 * self.adc_voltage_coefficient                # Convert the ADC value to voltage
         return round(voltage, 2)                                              # Return the voltage rounded to 2 decimal places
 
@@ -39,8 +55,98 @@ class ADC:
                 pass                                                          # Ignore any OSError exceptions
 
     def close_i2c(self) -> None:
-        """Close the I2C bus."""
-        self.i2c_bus.close()                                                  # Close the I2C bus
+        """Release the I2C bus."""
+        self.i2c_bus.close()                                                  # Close the I2C bus once no device uses it
+
+class ADCSampler:
+    def __init__(self, adc: ADC, channels: tuple = (0, 1, 2), rate: float = 60, size: int = 32, alpha: float = 0.2):
+        """Read the ADC channels in turn, rate reads per second, into ring buffers; filtered reads never touch the bus."""
+        self.adc = adc
+        self.channels = tuple(channels)
+        self.rows = {channel: row for row, channel in enumerate(self.channels)}  # Ring buffer row of each channel
+        self.rate = rate
+        self.size = size                                                      # Samples kept per channel
+        self.alpha = alpha                                                    # Weight of the newest sample in the EMA
+        self.max_age = 3 * len(self.channels) / rate                          # A channel is stale after missing three turns
+        self.next = 0                                                         # Index of the channel read next
+        self.count = [0] * len(self.channels)                                 # Samples written per channel, overwritten ones included
+        self.smoothed = [None] * len(self.channels)                           # EMA per channel
+        if numpy is not None:
+            self.values = numpy.zeros((len(self.channels), size))
+            self.timestamps = numpy.zeros((len(self.channels), size))
+        else:
+            self.values = [[0.0] * size for _ in self.channels]
+            self.timestamps = [[0.0] * size for _ in self.channels]
+        self.errors = registry.counter('adc.errors')                          # Reads that failed on the bus
+        self.loop = FixedRateLoop('adc')
+
+    def start(self) -> None:
+        """Start sampling."""
+        self.loop.start()
+        self.loop.set_step(self.step, self.rate, 'adc')
+
+    def stop(self) -> None:
+        """Stop sampling; the buffered samples stay readable but go stale."""
+        self.loop.stop()
+
+    def step(self) -> None:
+        """Read the next channel into its ring buffer."""
+        row = self.next
+        self.next = (row + 1) % len(self.channels)
+        try:
+            value = self.adc.read_adc(self.channels[row])
+        except OSError as e:
+            self.errors.increment()
+            print(f"Error reading ADC channel {self.channels[row]}: {e}")
+            return
+        index = self.count[row] % self.size
+        self.values[row][index] = value
+        self.timestamps[row][index] = time.monotonic()
+        smoothed = self.smoothed[row]
+        self.smoothed[row] = value if smoothed is None else smoothed + self.alpha * (value - smoothed)
+        self.count[row] += 1                                                  # Last, so readers never see a half written sample
+
+    def fresh(self, row: int, max_age: float = None) -> bool:
+        count = self.count[row]
+        if count == 0:
+            return False
+        age = time.monotonic() - self.timestamps[row][(count - 1) % self.size]
+        return age <= (max_age if max_age is not None else self.max_age)
+
+    def window(self, channel: int, samples: int = None) -> list:
+        """Get up to `samples` newest voltages of a channel, oldest first (default: all buffered)."""
+        row = self.rows[channel]
+        count = self.count[row]
+        samples = min(count, self.size, samples if samples is not None else self.size)
+        return [float(self.values[row][index % self.size]) for index in range(count - samples, count)]
+
+    def latest(self, channel: int, max_age: float = None) -> float:
+        """Get the newest voltage of a channel, or None if it is older than max_age (default: three turns)."""
+        row = self.rows[channel]
+        if not self.fresh(row, max_age):
+            return None
+        return float(self.values[row][(self.count[row] - 1) % self.size])
+
+    def median(self, channel: int, samples: int = 5, max_age: float = None) -> float:
+        """Get the median of the newest samples of a channel, or None if it is stale."""
+        if not self.fresh(self.rows[channel], max_age):
+            return None
+        window = self.window(channel, samples)
+        return round(float(numpy.median(window)) if numpy is not None else statistics.median(window), 2)
+
+    def ema(self, channel: int, max_age: float = None) -> float:
+        """Get the exponential moving average of a channel, or None if it is stale."""
+        row = self.rows[channel]
+        if not self.fresh(row, max_age):
+            return None
+        return round(self.smoothed[row], 2)
+
+    def get_stats(self) -> dict:
+        """Get the samples per channel, the noise, unstable and error counts, and the loop headroom."""
+        loop = self.loop.get_stats()
+        return {'samples': dict(zip(self.channels, self.count)), 'noise': self.adc.noise.get(),
+                'unstable': self.adc.unstable.get(), 'errors': self.errors.get(), 'overruns': loop['overruns'],
+                'headroom': loop['headroom']}
 
 if __name__ == '__main__':
     print('Program is starting ... ')                                        # Print a message indicating the start of the program
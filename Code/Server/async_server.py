@@ -0,0 +1,242 @@
+import asyncio  # Import the asyncio module for the event loop
+import struct   # Import the struct module for the video frame header
+from tcp_server import get_interface_ip  # Import the helper that reads the wlan0 address
+from protocol import ProtocolFramer, PROTOCOL_ACK  # Import the framer that negotiates text or binary commands
+from stats import registry  # Import the process-wide statistics registry
+
+FRAME_HEADER = struct.Struct('<I')  # Little-endian length prefixed to every video frame
+
+class AsyncTCPServer:
+    def __init__(self, name: str = 'async', max_queued: int = 0):
+        """Initialize the AsyncTCPServer class."""
+        self.name = name             # Name prefixed to this server's statistics, e.g. 'command' or 'video'
+        self.server = None           # The asyncio server object
+        self.client_writers = {}     # Stream writer of each connected client, keyed by client address
+        self.max_queued = max_queued # Most batches waiting for the consumer, 0 for no limit
+        self.message_queue = None    # Queue of (client_address, [messages]) batches, created on the running loop
+        self.protocol_ack = PROTOCOL_ACK  # Reply to a binary protocol handshake
+        # Called with the client address when it completes the handshake, and with the newest sequence number of its binary frames
+        self.on_session = None
+        self.on_sequence = None
+        self.max_clients = 1         # Maximum number of clients allowed
+        self.active_connections = 0  # Current number of active connections
+        # Throughput counters, shared with the process-wide stats registry like TCPServer's
+        self.received_bytes = registry.counter(name + '.rx_bytes')
+        self.received_messages = registry.counter(name + '.rx_messages')
+        self.sent_bytes = registry.counter(name + '.tx_bytes')
+        self.sent_messages = registry.counter(name + '.tx_messages')
+        registry.gauge(name + '.clients', lambda: self.active_connections)
+
+    async def start(self, ip: str, port: int, max_clients: int = 1, listen_count: int = 1) -> None:
+        """Start listening on the given address."""
+        self.max_clients = max_clients
+        # When a bounded queue is full, put() suspends the client's reader, so TCP flow control pushes back on it alone
+        self.message_queue = asyncio.Queue(self.max_queued)
+        registry.gauge(self.name + '.queue', self.message_queue.qsize)
+        self.server = await asyncio.start_server(self.handle_client, ip, port, backlog=listen_count, reuse_address=True)
+        print(f"Server started, listening on {ip}:{self.server.sockets[0].getsockname()[1]}")
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Receive messages from one client until it disconnects."""
+        client_address = writer.get_extra_info('peername')
+        if self.active_connections >= self.max_clients:
+            print(f"Rejected connection from {client_address}, max connections ({self.max_clients}) reached.")
+            writer.close()
+            return
+        self.client_writers[client_address] = writer
+        self.active_connections += 1
+        print(f"New connection from {client_address}, {self.active_connections} active connections.")
+        # The same framer TCPServer uses: newline text until the client negotiates binary frames
+        framer = ProtocolFramer(self.protocol_ack)
+        try:
+            while True:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                self.received_bytes.increment(len(data))
+                messages = framer.feed(data)
+                if framer.reply is not None:
+                    # Acknowledge a protocol handshake before any reply to the commands that follow it
+                    await self._send(client_address, writer, framer.reply)
+                    framer.reply = None
+                    if self.on_session is not None:
+                        self.on_session(client_address)
+                if framer.binary and messages and self.on_sequence is not None:
+                    self.on_sequence(client_address, framer.framer.sequence)
+                if messages:
+                    await self.message_queue.put((client_address, messages))
+                    self.received_messages.increment(len(messages))
+        except (ConnectionError, OSError) as e:
+            print(f"Error receiving data from {client_address}: {e}")
+        finally:
+            print(client_address, "disconnected")
+            self.remove_client(client_address)
+
+    def remove_client(self, client_address: tuple) -> None:
+        """Remove a client from the server."""
+        writer = self.client_writers.pop(client_address, None)
+        if writer is not None:
+            writer.close()
+            self.active_connections -= 1
+
+    async def _send(self, client_address: tuple, writer: asyncio.StreamWriter, message) -> None:
+        """Write a message, bytes or a tuple of buffers such as a header and a frame, and wait until the buffer drains."""
+        try:
+            if isinstance(message, tuple):
+                writer.writelines(message)
+                self.sent_bytes.increment(sum(memoryview(part).nbytes for part in message))
+            else:
+                writer.write(message)
+                self.sent_bytes.increment(memoryview(message).nbytes)
+            self.sent_messages.increment()
+            await writer.drain()
+        except (ConnectionError, OSError) as e:
+            print(f"Error sending data to {client_address}: {e}")
+            self.remove_client(client_address)
+
+    async def send_to_all_client(self, message) -> None:
+        """Send a message to all connected clients concurrently."""
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        await asyncio.gather(*(self._send(addr, writer, message) for addr, writer in list(self.client_writers.items())))
+
+    async def send_to_client(self, client_address: tuple, message) -> None:
+        """Send a message to a specific client."""
+        writer = self.client_writers.get(client_address)
+        if writer is None:
+            print(f"Client at {client_address} not found.")
+            return
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        await self._send(client_address, writer, message)
+
+    async def close(self) -> None:
+        """Close the server and all client connections."""
+        if self.server is not None:
+            self.server.close()
+        for client_address in list(self.client_writers):
+            self.remove_client(client_address)
+        if self.server is not None:
+            await self.server.wait_closed()
+        print("Server stopped.")
+
+    def get_client_ips(self) -> list:
+        """Get a list of IP addresses of connected clients."""
+        return [addr[0] for addr in self.client_writers]
+
+    def get_client_addresses(self) -> list:
+        """Get a list of (ip, port) addresses of connected clients."""
+        return list(self.client_writers)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> tuple:
+        """Wait for the next (client_address, [messages]) batch."""
+        return await self.message_queue.get()
+
+class AsyncServer:
+    def __init__(self):
+        """Initialize the AsyncServer class."""
+        self.ip_address = self.get_interface_ip()   # Get the IP address of the network interface
+        self.command_server = AsyncTCPServer('async.command', 256)  # Initialize the command server with a bounded command queue
+        self.video_server = AsyncTCPServer('async.video')           # Initialize the video server
+
+    def get_interface_ip(self) -> str:
+        """Get the IP address of the wlan0 interface."""
+        try:
+            return get_interface_ip()
+        except Exception as e:
+            print(f"Error getting IP address: {e}")
+            return "127.0.0.1"  # Default to localhost if an error occurs
+
+    async def start_tcp_servers(self, command_port: int = 5000, video_port: int = 8000, max_clients: int = 1, listen_count: int = 1) -> None:
+        """Start the TCP servers on specified ports."""
+        try:
+            await self.command_server.start(self.ip_address, command_port, max_clients, listen_count)
+            await self.video_server.start(self.ip_address, video_port, max_clients, listen_count)
+        except Exception as e:
+            print(f"Error starting TCP servers: {e}")
+
+    async def stop_tcp_servers(self) -> None:
+        """Stop the TCP servers."""
+        try:
+            await self.command_server.close()
+            await self.video_server.close()
+        except Exception as e:
+            print(f"Error stopping TCP servers: {e}")
+
+    async def send_data_to_command_client(self, data, ip_address: tuple = None) -> None:
+        """Send data to the command server client(s)."""
+        if ip_address is not None:
+            await self.command_server.send_to_client(ip_address, data)
+        else:
+            await self.command_server.send_to_all_client(data)
+
+    async def send_data_to_video_client(self, data, ip_address: tuple = None) -> None:
+        """Send data to the video server client(s)."""
+        if ip_address is not None:
+            await self.video_server.send_to_client(ip_address, data)
+        else:
+            await self.video_server.send_to_all_client(data)
+
+    def read_data_from_command_server(self) -> AsyncTCPServer:
+        """Async iterator over (client_address, [messages]) received by the command server."""
+        return self.command_server
+
+    def read_data_from_video_server(self) -> AsyncTCPServer:
+        """Async iterator over (client_address, [messages]) received by the video server."""
+        return self.video_server
+
+    def is_command_server_connected(self) -> bool:
+        """Check if the command server has any active connections."""
+        return self.command_server.active_connections > 0
+
+    def is_video_server_connected(self) -> bool:
+        """Check if the video server has any active connections."""
+        return self.video_server.active_connections > 0
+
+    async def send_video_frame(self, frame: bytes) -> None:
+        """Send a length-prefixed frame to every viewer; header and frame are written as separate buffers, the frame is not copied."""
+        await self.video_server.send_to_all_client((FRAME_HEADER.pack(len(frame)), frame))
+
+    def get_command_server_client_ips(self) -> list:
+        """Get the list of client IP addresses connected to the command server."""
+        return self.command_server.get_client_ips()
+
+    def get_video_server_client_ips(self) -> list:
+        """Get the list of client IP addresses connected to the video server."""
+        return self.video_server.get_client_ips()
+
+def format_message(message) -> str:
+    """Turn a received message back into a text command line: text is kept, binary (command, parameters) tuples are joined."""
+    if isinstance(message, tuple):
+        command, parameters = message
+        return "#".join([command] + [str(x) for x in parameters]) + "\n"
+    return message + "\n"
+
+async def echo_messages(messages, send) -> None:
+    """Send every received message, text or binary, back to the client it came from."""
+    async for client_address, batch in messages:
+        for message in batch:
+            print(client_address, message)
+            await send(format_message(message), client_address)
+
+async def main() -> None:
+    server = AsyncServer()
+    await server.start_tcp_servers(5000, 8000)
+    try:
+        # Both echo tasks share one event loop instead of polling the queues
+        await asyncio.gather(
+            echo_messages(server.read_data_from_command_server(), server.send_data_to_command_client),
+            echo_messages(server.read_data_from_video_server(), server.send_data_to_video_client),
+        )
+    finally:
+        await server.stop_tcp_servers()
+
+if __name__ == '__main__':
+    print('Program is starting ... ')
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("Received interrupt signal, stopping server...")
@@ -0,0 +1,1070 @@
+import contextlib
+import io
+import select
+import selectors
+import socket
+import threading
+import time
+from tcp_server import TCPServer
+
+class LegacyTCPServer(TCPServer):
+    """The select()-based loop TCPServer used before the selectors event loop, kept for comparison."""
+    def event_loop(self):
+        while not self.stop_event.is_set():
+            readable, writable, exceptional = select.select([self.server_socket, self.stop_pipe_r] + list(self.client_sockets.keys()), [], [])
+            for s in readable:
+                if s == self.server_socket and self.active_connections < self.max_clients:
+                    client_socket, client_address = s.accept()
+                    client_socket.setblocking(0)
+                    self.client_sockets[client_socket] = client_address
+                    self.active_connections += 1
+                    print(f"New connection from {client_address}, {self.active_connections} active connections.")
+                elif s == self.server_socket and self.active_connections >= self.max_clients:
+                    client_socket, client_address = s.accept()
+                    client_socket.close()
+                    print(f"Rejected connection from {client_address}, max connections ({self.max_clients}) reached.")
+                elif s == self.stop_pipe_r:
+                    self.stop_event.set()
+                    break
+                else:
+                    try:
+                        data = s.recv(1024)
+                        if data:
+                            self.message_queue.put((self.client_sockets[s], data.decode('utf-8')))
+                        else:
+                            print(self.client_sockets[s], "disconnected")
+                            self.remove_client(s)
+                    except OSError:
+                        print(self.client_sockets[s], "disconnected")
+                        self.remove_client(s)
+
+    def send_to_socket(self, client_socket, data):
+        client_socket.sendall(data)
+
+    def remove_client(self, client_socket):
+        if client_socket in self.client_sockets:
+            del self.client_sockets[client_socket]
+            client_socket.close()
+            self.active_connections -= 1
+
+class MinimalTCPServer(TCPServer):
+    """The selectors event loop doing only the select() loop's per-connection work: no framer, outbound buffer or statistics."""
+    def handle_accept(self, server_socket, mask):
+        client_socket, client_address = server_socket.accept()
+        client_socket.setblocking(0)
+        self.client_sockets[client_socket] = client_address
+        self.selector.register(client_socket, selectors.EVENT_READ, self.handle_client)
+        self.active_connections += 1
+        print(f"New connection from {client_address}, {self.active_connections} active connections.")
+
+    def handle_client(self, client_socket, mask):
+        data = client_socket.recv(1024)
+        if data:
+            self.message_queue.put((self.client_sockets[client_socket], data.decode('utf-8')))
+        else:
+            print(self.client_sockets[client_socket], "disconnected")
+            del self.client_sockets[client_socket]
+            self.selector.unregister(client_socket)
+            client_socket.close()
+            self.active_connections -= 1
+
+def _start_quiet(server, max_clients):
+    # Start a server on an ephemeral loopback port and return the port
+    with contextlib.redirect_stdout(io.StringIO()):
+        server.start('127.0.0.1', 0, max_clients, 128)
+    return server.server_socket.getsockname()[1]
+
+def _close_quiet(server):
+    with contextlib.redirect_stdout(io.StringIO()):
+        server.close()
+
+def _drain(server, count, timeout=10.0):
+    # Wait until the server has queued the given number of messages
+    received = 0
+    deadline = time.monotonic() + timeout
+    while received < count and time.monotonic() < deadline:
+        try:
+            client_address, messages = server.message_queue.get(timeout=0.5)
+            # The legacy loop queues raw strings, the framed loop queues lists of complete messages
+            received += messages.count("\n") if isinstance(messages, str) else len(messages)
+        except Exception:
+            pass
+    return received
+
+def _connection_churn(server_class, connections=500):
+    # Connect, send one command and disconnect, waiting for delivery each time so the backlog never overflows
+    server = server_class()
+    port = _start_quiet(server, connections)
+    message = "CMD_MOTOR#0#0#0#0\n"
+    delivered = 0
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(connections):
+            client = socket.create_connection(('127.0.0.1', port))
+            client.sendall(message.encode('utf-8'))
+            client.close()
+            delivered += _drain(server, 1)
+    elapsed = time.perf_counter() - start
+    _close_quiet(server)
+    return connections / elapsed, delivered == connections
+
+def _message_throughput(server_class, clients=32, messages=2000):
+    server = server_class()
+    port = _start_quiet(server, clients)
+    message = "CMD_M_MOTOR#45#1500#0#0\n".encode('utf-8')
+    with contextlib.redirect_stdout(io.StringIO()):
+        sockets = [socket.create_connection(('127.0.0.1', port)) for _ in range(clients)]
+        time.sleep(0.2)
+    def sender(sock):
+        for _ in range(messages):
+            sock.sendall(message)
+    threads = [threading.Thread(target=sender, args=(sock,)) for sock in sockets]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    received = _drain(server, clients * messages)
+    elapsed = time.perf_counter() - start
+    for thread in threads:
+        thread.join()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for sock in sockets:
+            sock.close()
+    _close_quiet(server)
+    return clients * messages / elapsed, received == clients * messages
+
+def benchmark_TCPServer():
+    print("Connection churn (connections/s, best of 5):")
+    # The minimal server separates the cost of the event loop from the per-client framer, buffer and statistics
+    for name, server_class in (("select", LegacyTCPServer), ("selectors, loop only", MinimalTCPServer), ("selectors", TCPServer)):
+        rate, complete = max(_connection_churn(server_class) for _ in range(5))
+        print(f"  {name:<20} {rate:10.0f}  complete={complete}")
+    print("Message throughput with 32 clients (messages/s):")
+    for name, server_class in (("select", LegacyTCPServer), ("selectors", TCPServer)):
+        rate, complete = _message_throughput(server_class)
+        print(f"  {name:<20} {rate:10.0f}  complete={complete}")
+
+def _command_mix(count=10000):
+    # Realistic traffic: mostly drive and servo setpoints, some LED, mode and sensor requests
+    import random
+    random.seed(2)
+    commands = []
+    for _ in range(count):
+        kind = random.random()
+        if kind < 0.45:
+            commands.append(("CMD_M_MOTOR", [random.randint(-180, 180), random.randint(0, 4095), random.randint(-180, 180), random.randint(0, 4095)]))
+        elif kind < 0.70:
+            commands.append(("CMD_MOTOR", [random.randint(-4095, 4095) for _ in range(4)]))
+        elif kind < 0.85:
+            commands.append(("CMD_SERVO", [random.randint(0, 1), random.randint(0, 180)]))
+        elif kind < 0.93:
+            commands.append(("CMD_LED", [random.randint(0, 255), random.randint(0, 255), random.randint(0, 255), random.randint(0, 255)]))
+        elif kind < 0.97:
+            commands.append(("CMD_MODE", [random.randint(0, 3)]))
+        else:
+            commands.append(("CMD_POWER", []))
+    return commands
+
+def benchmark_Protocol():
+    from message import Message_Parse
+    from protocol import ProtocolFramer, PROTOCOL_ACK, encode_command
+    commands = _command_mix()
+    text_stream = "".join("#".join([command] + [str(x) for x in parameters]) + "\n" for command, parameters in commands).encode('utf-8')
+    binary_stream = b"".join(encode_command(command, parameters, sequence) for sequence, (command, parameters) in enumerate(commands))
+    print("Bytes on the wire for {} commands:".format(len(commands)))
+    print("  text   {:8d}  ({:.1f} bytes/command)".format(len(text_stream), len(text_stream) / len(commands)))
+    print("  binary {:8d}  ({:.1f} bytes/command)".format(len(binary_stream), len(binary_stream) / len(commands)))
+    chunks = 1024
+    def run(stream, handshake):
+        parse = Message_Parse()
+        framer = ProtocolFramer()
+        if handshake:
+            framer.feed(PROTOCOL_ACK)
+        start = time.perf_counter()
+        for position in range(0, len(stream), chunks):
+            for message in framer.feed(stream[position:position + chunks]):
+                parse.parse(message)
+        return time.perf_counter() - start
+    text_time = min(run(text_stream, False) for _ in range(5))
+    binary_time = min(run(binary_stream, True) for _ in range(5))
+    print("Frame and parse cost (us/command):")
+    print("  text   {:8.2f}".format(text_time / len(commands) * 1e6))
+    print("  binary {:8.2f}".format(binary_time / len(commands) * 1e6))
+
+def _video_send(mode, frame_size, frames=500, count_calls=False):
+    # Publish frames to one loopback viewer; returns the publishing thread's CPU us per frame,
+    # or socket send calls per frame and the largest allocation made while publishing one
+    import cProfile
+    import pstats
+    import struct
+    import tracemalloc
+    from tcp_server import OutboundQueue
+    server = TCPServer()
+    with contextlib.redirect_stdout(io.StringIO()):
+        server.start('127.0.0.1', 0, 1, 1, OutboundQueue.LATEST)
+        viewer = socket.create_connection(('127.0.0.1', server.server_socket.getsockname()[1]))
+        viewer.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 21)
+        time.sleep(0.1)
+    stream = viewer.makefile('rb')
+    # The viewer reads into buffers allocated up front, so the allocations traced are the publisher's
+    header = bytearray(4)
+    body = memoryview(bytearray(frame_size))
+    def reader():
+        for _ in range(frames):
+            stream.readinto(header)
+            length, = struct.unpack('<I', header)
+            stream.readinto(body[:length])
+    frame = bytes(frame_size)
+    thread = threading.Thread(target=reader)
+    thread.start()
+    # Only the publishing thread is timed, the viewer's reads would drown the difference
+    profile = cProfile.Profile()
+    cpu = 0.0
+    peak = 0
+    if count_calls:
+        tracemalloc.start()
+        profile.enable()
+    for _ in range(frames):
+        if count_calls:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        start = time.thread_time()
+        if mode == 'joined':
+            # The pre-user-008 path: header and frame copied into one message, one send
+            server.send_to_all_client(struct.pack('<I', len(frame)) + frame)
+        elif mode == 'two sends':
+            # Header and frame as two messages, two sends and no copy of the frame
+            server.send_to_all_client(struct.pack('<I', len(frame)))
+            server.send_to_all_client(frame)
+        else:
+            # Server.send_video_frame: one (header, frame) message, written with one sendmsg() and no copy
+            server.send_to_all_client((struct.pack('<I', len(frame)), frame))
+        cpu += time.thread_time() - start
+        if count_calls:
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+        time.sleep(0.0005)
+    profile.disable()
+    if count_calls:
+        tracemalloc.stop()
+    thread.join()
+    with contextlib.redirect_stdout(io.StringIO()):
+        viewer.close()
+        server.close()
+    if not count_calls:
+        return cpu / frames * 1e6
+    calls = sum(stat[1] for function, stat in pstats.Stats(profile).stats.items() if function[2] in (
+        "<method 'send' of '_socket.socket' objects>", "<method 'sendall' of '_socket.socket' objects>", "<method 'sendmsg' of '_socket.socket' objects>"))
+    return calls / frames, peak
+
+def benchmark_VideoSend():
+    # Typical JPEG sizes of the stream at 400x300 and 640x480
+    for label, frame_size in (("400x300", 18000), ("640x480", 45000)):
+        print("{} ({} byte frames):".format(label, frame_size))
+        for mode in ("joined", "two sends", "sendmsg"):
+            cpu = min(_video_send(mode, frame_size) for _ in range(5))
+            calls, peak = _video_send(mode, frame_size, count_calls=True)
+            print("  {:<10} {:8.1f} us CPU/frame  {:4.2f} send syscalls/frame  {:6d} bytes allocated/frame".format(mode, cpu, calls, peak))
+
+def _legacy_dispatch(command, parameters, calls):
+    # The if/elif chain threading_cmd_receive used, in its order, with the hardware calls counted instead of made
+    if command == "CMD_LED":
+        calls.append(parameters)
+    elif command == "CMD_LED_MOD":
+        calls.append(parameters)
+    else:
+        if command == "CMD_SONIC":
+            calls.append(None)
+        elif command == "CMD_LIGHT":
+            calls.append(None)
+        elif command == "CMD_LINE":
+            calls.append(None)
+        elif command == "CMD_POWER":
+            calls.append(None)
+        elif command == "CMD_STATS":
+            calls.append(None)
+        elif command == "CMD_SUBSCRIBE":
+            calls.append(parameters)
+        elif command == "CMD_BUZZER":
+            calls.append(parameters[0])
+        elif command == "CMD_SERVO":
+            data1 = str(parameters[0])
+            data2 = int(parameters[1])
+            calls.append((data1, data2))
+        elif command == "CMD_MOTOR":
+            duty = [int(parameters[i]) for i in range(4)]
+            calls.append(duty)
+        elif command == "CMD_M_MOTOR":
+            duty = [int(parameters[i]) for i in range(4)]
+            calls.append(duty)
+        elif command == "CMD_CAR_ROTATE":
+            duty = [int(parameters[i]) for i in range(4)]
+            calls.append(duty)
+        elif command == "CMD_MODE":
+            calls.append(parameters[0])
+
+def benchmark_Dispatch():
+    from dispatcher import Dispatcher, Argument
+    commands = _command_mix(50000)
+    calls = []
+    dispatcher = Dispatcher()
+    record = lambda client_address, *values: calls.append(values)
+    speed = lambda name: Argument(name, -4095, 4095)
+    angle = lambda name: Argument(name, -360, 360)
+    colour = lambda name: Argument(name, 0, 255)
+    # The same schemas main.py registers
+    dispatcher.register("CMD_LED", record, [colour('index'), colour('red'), colour('green'), colour('blue')])
+    dispatcher.register("CMD_LED_MOD", record, [Argument('mode', 0, 5)])
+    for command in ("CMD_SONIC", "CMD_LIGHT", "CMD_LINE", "CMD_POWER", "CMD_STATS"):
+        dispatcher.register(command, record)
+    dispatcher.register("CMD_SUBSCRIBE", record, [Argument('sensor', 0, 3), Argument('period_ms', 0, 60000), Argument('deadband', 0, 100000, default=0, required=False)])
+    dispatcher.register("CMD_BUZZER", record, [Argument('state', 0, 1)])
+    dispatcher.register("CMD_SERVO", record, [Argument('channel', 0, 7), Argument('angle', 0, 180)])
+    dispatcher.register("CMD_MOTOR", record, [speed('duty1'), speed('duty2'), speed('duty3'), speed('duty4')])
+    dispatcher.register("CMD_M_MOTOR", record, [angle('angle1'), speed('speed1'), angle('angle2'), speed('speed2')])
+    dispatcher.register("CMD_CAR_ROTATE", record, [angle('angle1'), speed('speed1'), angle('angle2'), speed('speed2')])
+    dispatcher.register("CMD_MODE", record, [Argument('mode', 0, 3)])
+    def run(dispatch):
+        calls.clear()
+        start = time.perf_counter()
+        for command, parameters in commands:
+            dispatch(command, parameters)
+        return time.perf_counter() - start
+    legacy = min(run(lambda command, parameters: _legacy_dispatch(command, parameters, calls)) for _ in range(5))
+    table = min(run(lambda command, parameters: dispatcher.dispatch(None, command, parameters)) for _ in range(5))
+    # Without validation and timing, to show what the schema checks cost on their own
+    lookup = min(run(lambda command, parameters: dispatcher.handlers[command].function(None, *parameters)) for _ in range(5))
+    print("Dispatch throughput for {} commands:".format(len(commands)))
+    print("  if/elif chain          {:10.0f} commands/s  {:5.2f} us/command".format(len(commands) / legacy, legacy / len(commands) * 1e6))
+    print("  dispatcher             {:10.0f} commands/s  {:5.2f} us/command".format(len(commands) / table, table / len(commands) * 1e6))
+    print("  dict lookup only       {:10.0f} commands/s  {:5.2f} us/command".format(len(commands) / lookup, lookup / len(commands) * 1e6))
+    # Commands at the end of the chain pay for every comparison before them; the table does not
+    for command, parameters in (("CMD_LED", [1, 2, 3, 4]), ("CMD_MODE", [0])):
+        legacy = min(run(lambda c, p: _legacy_dispatch(command, parameters, calls)) for _ in range(3))
+        table = min(run(lambda c, p: dispatcher.dispatch(None, command, parameters)) for _ in range(3))
+        print("  {:<14} chain {:5.2f} us  dispatcher {:5.2f} us".format(command, legacy / len(commands) * 1e6, table / len(commands) * 1e6))
+
+def _parse_text(message):
+    fields = message.split('#')
+    return fields[0], [int(x) for x in fields[1:]]
+
+def _legacy_command_loop(server, handler, running):
+    # The loop threading_cmd_receive used: poll qsize(), copy through a multiprocessing.Queue, sleep 1 ms when idle
+    import multiprocessing
+    queue_cmd = multiprocessing.Queue()
+    while running.is_set():
+        cmd_queue = server.message_queue
+        if cmd_queue.qsize() > 0:
+            client_address, messages = cmd_queue.get()
+            for msg in messages:
+                queue_cmd.put((client_address, msg))
+        while not queue_cmd.empty():
+            client_address, msg = queue_cmd.get()
+            handler(client_address, *_parse_text(msg))
+        if queue_cmd.empty():
+            time.sleep(0.001)
+
+def _command_latency(legacy, commands=1000, interval=0.005, idle_time=3.0):
+    # Returns (idle CPU percent, sorted send-to-handler latencies in seconds)
+    from pipeline import CommandPipeline
+    server = TCPServer('bench', 256)
+    _start_quiet(server, 1)
+    with contextlib.redirect_stdout(io.StringIO()):
+        client = socket.create_connection(('127.0.0.1', server.server_socket.getsockname()[1]))
+        time.sleep(0.5)
+    client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sent = {}
+    latencies = []
+    done = threading.Event()
+    def handler(client_address, command, parameters):
+        latencies.append(time.perf_counter() - sent[parameters[0]])
+        if len(latencies) == commands:
+            done.set()
+    running = threading.Event()
+    running.set()
+    if legacy:
+        consumer = threading.Thread(target=_legacy_command_loop, args=(server, handler, running), daemon=True)
+        consumer.start()
+    else:
+        # Every command drives a different setpoint, so none are coalesced away
+        pipeline = CommandPipeline(handler, _parse_text, lambda command, parameters: None)
+        pipeline.start(server.message_queue)
+    # Idle: connected, nothing arriving
+    start_cpu, start = time.process_time(), time.perf_counter()
+    time.sleep(idle_time)
+    idle_cpu = (time.process_time() - start_cpu) / (time.perf_counter() - start) * 100
+    for i in range(commands):
+        sent[i] = time.perf_counter()
+        client.sendall("CMD_MOTOR#{}#0#0#0\n".format(i).encode('utf-8'))
+        time.sleep(interval)
+    done.wait(10)
+    running.clear()
+    if not legacy:
+        pipeline.stop()
+    client.close()
+    _close_quiet(server)
+    return idle_cpu, sorted(latencies)
+
+def benchmark_CommandPipeline():
+    print("Command path, {} commands at 200 Hz over loopback:".format(1000))
+    for name, legacy in (("poll + multiprocessing.Queue", True), ("blocking pipeline", False)):
+        idle_cpu, latencies = _command_latency(legacy)
+        if not latencies:
+            print("  {:<30} no command reached the handler".format(name))
+            continue
+        percentile = lambda fraction: latencies[int(fraction * len(latencies))] * 1e6
+        print("  {:<30} idle CPU {:5.2f}%  latency p50 {:7.1f} us  p90 {:7.1f} us  p99 {:7.1f} us  max {:7.1f} us".format(
+            name, idle_cpu, percentile(0.5), percentile(0.9), percentile(0.99), latencies[-1] * 1e6))
+
+def _servo_flood(coalescing, messages=1000, interval=0.001, write_time=0.003):
+    # A slider sending one CMD_SERVO per input event, against servo writes that take a few ms
+    import queue
+    from pipeline import CommandPipeline
+    source = queue.Queue(256)
+    sent = {}
+    applied = []
+    def handler(client_address, command, parameters):
+        time.sleep(write_time)
+        applied.append((time.perf_counter(), parameters[1]))
+    parse = _parse_text
+    key = (lambda command, parameters: ('servo', parameters[0])) if coalescing else None
+    pipeline = CommandPipeline(handler, parse, key)
+    pipeline.start(source)
+    for i in range(messages):
+        sent[i] = time.perf_counter()
+        source.put((None, ["CMD_SERVO#0#{}".format(i)]))
+        time.sleep(interval)
+    last_sent = time.perf_counter()
+    while not applied or applied[-1][1] != messages - 1:
+        time.sleep(0.001)
+    pipeline.stop()
+    # Age of the position each write applied, and how long after the last input the servo got there
+    ages = sorted(applied_time - sent[position] for applied_time, position in applied)
+    return len(applied), ages[len(ages) // 2], ages[-1], applied[-1][0] - last_sent, pipeline.get_stats()
+
+def benchmark_Coalescing():
+    print("1000 CMD_SERVO at 1 kHz, 3 ms per servo write:")
+    for name, coalescing in (("every setpoint", False), ("coalesced", True)):
+        writes, median_age, max_age, settle, stats = _servo_flood(coalescing)
+        print("  {:<15} {:5d} writes  position age p50 {:7.1f} ms  max {:7.1f} ms  settled {:7.1f} ms after the last input  (coalesced {}, dropped {})".format(
+            name, writes, median_age * 1000, max_age * 1000, settle * 1000, stats['coalesced'], stats['dropped']))
+
+def benchmark_Parse():
+    import random
+    from message import Message_Parse, parse_command, parse_buffer
+    random.seed(4)
+    integer_lines = ["#".join([command] + [str(x) for x in parameters]) for command, parameters in _command_mix(20000)]
+    # Some clients send floats, trailing separators and the mode words
+    mixed_lines = []
+    for line in integer_lines:
+        kind = random.random()
+        if kind < 0.05:
+            line = random.choice(("CMD_MODE#one", "CMD_MODE#two", "CMD_MODE#three", "CMD_MODE#four"))
+        elif kind < 0.15:
+            line = line + "#"
+        elif kind < 0.25 and line.startswith("CMD_SERVO"):
+            line = line + ".5"
+        mixed_lines.append(line)
+    parser = Message_Parse()
+    # Both parsers must agree before their speed means anything
+    for line in mixed_lines:
+        parser.parse(line)
+        parsed = parse_command(line)
+        assert (parser.command_string, parser.int_parameter) == (parsed.command, list(parsed.parameters)), line
+    def run(function, lines):
+        start = time.perf_counter()
+        function(lines)
+        return (time.perf_counter() - start) / len(lines) * 1e6
+    def message_parse(lines):
+        parser = Message_Parse()
+        for line in lines:
+            parser.parse(line)
+    def message_parse_each(lines):
+        # What main.py had to do to stay safe on the network threads: a new parser per message
+        for line in lines:
+            parser = Message_Parse()
+            parser.parse(line)
+    def fast_parse(lines):
+        for line in lines:
+            parse_command(line)
+    def buffer_parse(lines):
+        # What one 4 KB read hands over: many lines in one buffer
+        data = ("\n".join(lines) + "\n").encode('utf-8')
+        for position in range(0, len(data), 4096):
+            end = data.rfind(b"\n", position, position + 4096) + 1 or len(data)
+            parse_buffer(data[position:end])
+    print("Parse cost (us/command), best of 7 interleaved runs:")
+    for name, lines in (("integer drive mix", integer_lines), ("floats, words, trailing #", mixed_lines)):
+        print("  " + name)
+        functions = (("Message_Parse.parse", message_parse), ("Message_Parse per msg", message_parse_each),
+                     ("parse_command", fast_parse), ("parse_buffer", buffer_parse))
+        best = {label: min(times) for label, times in zip([label for label, function in functions],
+                zip(*[[run(function, lines) for label, function in functions] for _ in range(7)]))}
+        for label, function in functions:
+            print("    {:<22} {:6.2f}".format(label, best[label]))
+
+def _legacy_mecanum(angle1, speed1, angle2, speed2):
+    # The inline mixing main.py and car.py used, clamped per wheel by Ordinary_Car.duty_range
+    import math
+    LX = -int((speed1 * math.sin(math.radians(angle1))))
+    LY = int(speed1 * math.cos(math.radians(angle1)))
+    RX = int(speed2 * math.sin(math.radians(angle2)))
+    duties = (LY + LX - RX, LY - LX - RX, LY - LX + RX, LY + LX + RX)
+    return tuple(max(-4095, min(4095, duty)) for duty in duties)
+
+def benchmark_Kinematics():
+    import math
+    import random
+    import kinematics
+    from kinematics import MecanumDrive
+    random.seed(5)
+    drive = MecanumDrive()
+    setpoints = [(random.randint(-360, 360), random.randint(-4095, 4095), random.randint(-360, 360), random.randint(-4095, 4095))
+                 for _ in range(20000)]
+    def run(function):
+        start = time.perf_counter()
+        function()
+        return (time.perf_counter() - start) / len(setpoints) * 1e6
+    cases = (("inline math.sin/cos", lambda: [_legacy_mecanum(*setpoint) for setpoint in setpoints]),
+             ("MecanumDrive.joystick", lambda: [drive.joystick(*setpoint) for setpoint in setpoints]),
+             ("MecanumDrive.solve_many", lambda: drive.solve_many(setpoints)))
+    times = [[run(function) for name, function in cases] for _ in range(7)]
+    print("Mecanum mixing (us/setpoint), best of 7 interleaved runs, numpy {}:".format("available" if kinematics.numpy is not None else "not installed"))
+    for (name, function), best in zip(cases, map(min, zip(*times))):
+        print("  {:<24} {:6.2f}".format(name, best))
+    # The motion the wheels produce, recovered from the duties, against the motion asked for
+    def direction(duties):
+        fl, bl, fr, br = duties
+        return math.atan2((fl + bl + fr + br) / 4, (fl - bl - fr + br) / 4), (fr + br - fl - bl) / 4
+    errors = {"clamped per wheel": [], "saturated together": []}
+    for setpoint in setpoints:
+        asked = drive.solve(-setpoint[1] * math.sin(math.radians(setpoint[0])), setpoint[1] * math.cos(math.radians(setpoint[0])),
+                            setpoint[3] * math.sin(math.radians(setpoint[2])))
+        if max(abs(duty) for duty in _legacy_mecanum(*setpoint)) < 4095 or not any(asked[:2]):
+            continue  # Only saturated setpoints that translate differ
+        heading = direction(asked)[0]
+        for name, duties in (("clamped per wheel", _legacy_mecanum(*setpoint)), ("saturated together", drive.joystick(*setpoint))):
+            error = abs(math.degrees(direction(duties)[0] - heading)) % 360
+            errors[name].append(min(error, 360 - error))
+    print("Heading error of saturated setpoints (degrees):")
+    for name, values in errors.items():
+        values.sort()
+        print("  {:<20} {} setpoints  p50 {:6.2f}  p90 {:6.2f}  max {:6.2f}".format(
+            name, len(values), values[len(values) // 2], values[int(len(values) * 0.9)], values[-1]))
+
+def _rotation(steps, period, write_time):
+    # A rotation task: each step is one motor write, then it waits for the next step
+    while True:
+        steps.append(time.perf_counter())
+        time.sleep(write_time)
+        yield period
+
+def _motion_run(runner_based, period=0.015, write_time=0.002, duration=0.6):
+    import threading
+    steps = []
+    if runner_based:
+        from scheduler import MotionTaskRunner
+        runner = MotionTaskRunner('benchmark.motion')
+        runner.start()
+        runner.start_task(_rotation(steps, period, write_time), 'rotate')
+    else:
+        # What main.py did: a raw thread that sleeps between steps, killed with stop_thread
+        from Thread import stop_thread
+        def mode_rotate():
+            for delay in _rotation(steps, period, write_time):
+                time.sleep(delay)
+        thread = threading.Thread(target=mode_rotate, daemon=True)
+        thread.start()
+    time.sleep(duration)
+    start = time.perf_counter()
+    if runner_based:
+        runner.cancel()
+    else:
+        stop_thread(thread)
+        thread.join()
+    cancelled = time.perf_counter()
+    time.sleep(2 * period)
+    if runner_based:
+        runner.stop()
+    # Step start times against the ideal schedule from the first step
+    before = [t for t in steps if t < start]
+    drift = before[-1] - before[0] - period * (len(before) - 1)
+    late_steps = len([t for t in steps if t > cancelled])
+    return drift, cancelled - start, late_steps
+
+def benchmark_MotionTask():
+    print("Rotation, 15 ms steps with a 2 ms motor write, cancelled after 0.6 s, median of 5:")
+    for name, runner_based in (("thread + sleep + stop_thread", False), ("MotionTaskRunner", True)):
+        runs = sorted(_motion_run(runner_based) for _ in range(5))
+        drift, cancel, late = runs[2]
+        print("  {:<30} accumulated drift {:7.2f} ms  cancel took {:7.2f} ms (worst {:7.2f} ms)  steps after cancel {}".format(
+            name, drift * 1000, cancel * 1000, max(run[1] for run in runs) * 1000, max(run[2] for run in runs)))
+
+def _control_periods(fixed_rate, frequency=5, duration=2.0, step_time=0.003):
+    # Step start times of a car mode, and the CPU used by the loop while in manual mode
+    import threading
+    starts = []
+    def step():
+        starts.append(time.monotonic())
+        time.sleep(step_time)  # Sensor read and motor write
+    if fixed_rate:
+        from scheduler import FixedRateLoop
+        loop = FixedRateLoop('benchmark.car')
+        loop.start()
+        loop.set_step(step, frequency, 'mode')
+        time.sleep(duration)
+        loop.set_step(None)
+        cpu = time.process_time()
+        time.sleep(duration)
+        cpu = time.process_time() - cpu
+        loop.stop()
+    else:
+        # What threading_car_task did: spin every 10 ms, the mode gates itself on time.time()
+        state = {'mode': True, 'running': True, 'record_time': time.time()}
+        def car_task():
+            while state['running']:
+                if state['mode'] and time.time() - state['record_time'] > 1.0 / frequency:
+                    state['record_time'] = time.time()
+                    step()
+                time.sleep(0.01)
+        thread = threading.Thread(target=car_task, daemon=True)
+        thread.start()
+        time.sleep(duration)
+        state['mode'] = False
+        cpu = time.process_time()
+        time.sleep(duration)
+        cpu = time.process_time() - cpu
+        state['running'] = False
+        thread.join()
+    periods = [b - a for a, b in zip(starts, starts[1:])]
+    return periods, cpu / duration * 100
+
+def benchmark_ControlLoop():
+    for frequency in (5, 50):
+        print("Car mode at {} Hz, 3 ms step, 2 s:".format(frequency))
+        for name, fixed_rate in (("10 ms spin + time.time gate", False), ("FixedRateLoop", True)):
+            periods, idle_cpu = _control_periods(fixed_rate, frequency)
+            jitter = sorted(abs(period - 1.0 / frequency) * 1000 for period in periods)
+            print("  {:<28} {:5.1f} steps/s  period jitter p50 {:6.2f} ms  p99 {:6.2f} ms  max {:6.2f} ms  idle CPU {:5.2f}%".format(
+                name, len(periods) / sum(periods), jitter[len(jitter) // 2], jitter[int(len(jitter) * 0.99)], jitter[-1], idle_cpu))
+
+class _SimulatedBus:
+    # Counts I2C transactions and models their time on the wire: start, address, register, data bytes (9 bits each), stop
+    # An ADS7830 behind write_byte/read_byte reads 40 * (channel + 1)
+    def __init__(self, clock=100000, overhead=0.00005):
+        self.clock = clock          # Bus clock in Hz; the Raspberry Pi default is 100 kHz
+        self.overhead = overhead    # Driver and syscall cost of one transaction
+        self.transactions = 0
+        self.bus_time = 0.0
+        self.registers = {}
+        self.adc_channel = 0
+    def transfer(self, data_bytes):
+        self.transactions += 1
+        self.bus_time += self.overhead + ((2 + data_bytes) * 9 + 2) / self.clock
+    def write_byte_data(self, address, register, value):
+        self.transfer(1)
+        self.registers[register] = value
+    def write_i2c_block_data(self, address, register, data):
+        self.transfer(len(data))
+        for offset, value in enumerate(data):
+            self.registers[register + offset] = value
+    def read_byte_data(self, address, register):
+        self.transfer(2)
+        return self.registers.get(register, 0)
+    def write_byte(self, address, value):
+        self.transfer(1)
+        self.adc_channel = ((value >> 4) & 0x01) << 1 | (value >> 6) & 0x01  # Undo the ADS7830 channel encoding
+    def read_byte(self, address):
+        self.transfer(1)
+        return 40 * (self.adc_channel + 1)
+    def transaction(self):
+        return contextlib.nullcontext()  # Separate handles per device: nothing keeps the others off the bus
+    def close(self):
+        pass
+
+def _simulated_car(bus, cached=True):
+    # An Ordinary_Car driving a simulated bus; uncached, every requested channel is written
+    from pca9685 import PCA9685
+    from motor import Ordinary_Car
+    from stats import registry
+    car = Ordinary_Car.__new__(Ordinary_Car)
+    car.pwm = PCA9685(0x40, bus=bus)
+    car.write_time = registry.histogram('benchmark.motor.write')
+    bus.transactions, bus.bus_time = 0, 0.0  # Leave out the MODE1 setup write
+    if not cached:
+        set_pwm_many = car.pwm.set_pwm_many
+        car.pwm.set_pwm_many = lambda settings: set_pwm_many(settings, force=True)
+    return car
+
+def _legacy_motor_model(bus, duties):
+    # What set_motor_model did: four write_byte_data per channel, eight channels
+    for channel, duty in duties.items():
+        for register, value in enumerate((0, 0, duty & 0xFF, duty >> 8)):
+            bus.write_byte_data(0x40, 0x06 + 4 * channel + register, value)
+
+def benchmark_PCA9685():
+    import random
+    random.seed(7)
+    commands = [[random.randint(-4095, 4095) for _ in range(4)] for _ in range(1000)]
+    for clock in (100000, 400000):
+        print("Motor update over a simulated {} kHz bus, 50 us per transaction, {} updates:".format(clock // 1000, len(commands)))
+        legacy_bus, bus = _SimulatedBus(clock), _SimulatedBus(clock)
+        car = _simulated_car(bus, cached=False)  # Block writes alone; ShadowRegisters measures the cache
+        start = time.perf_counter()
+        for duties in commands:
+            channel_duties = car.wheel_pwm(duties[0], 0, 1)
+            channel_duties.update(car.wheel_pwm(duties[1], 3, 2))
+            channel_duties.update(car.wheel_pwm(duties[2], 6, 7))
+            channel_duties.update(car.wheel_pwm(duties[3], 4, 5))
+            _legacy_motor_model(legacy_bus, channel_duties)
+        legacy_cpu = time.perf_counter() - start
+        start = time.perf_counter()
+        for duties in commands:
+            car.set_motor_model(*duties)
+        cpu = time.perf_counter() - start
+        assert legacy_bus.registers == {register: value for register, value in bus.registers.items() if register != 0x00}
+        for name, simulated, python_time in (("byte writes", legacy_bus, legacy_cpu), ("auto-increment block", bus, cpu)):
+            print("  {:<22} {:5.1f} transactions/update  bus time {:6.3f} ms/update  Python {:6.1f} us/update".format(
+                name, simulated.transactions / len(commands), simulated.bus_time / len(commands) * 1000, python_time / len(commands) * 1e6))
+
+def benchmark_ShadowRegisters():
+    import random
+    random.seed(8)
+    # Steady driving: the client repeats the held joystick position every 50 ms, and the car stops often
+    commands = []
+    while len(commands) < 2000:
+        duties = random.choice(([0, 0, 0, 0], [1200] * 4, [-1200] * 4, [random.randint(-4095, 4095) for _ in range(4)]))
+        commands += [duties] * random.randint(1, 20)
+    print("Steady driving over a simulated 100 kHz bus, {} motor updates:".format(len(commands)))
+    for name, cached in (("every channel written", False), ("shadow registers", True)):
+        bus = _SimulatedBus()
+        car = _simulated_car(bus, cached)
+        hits, misses = car.pwm.shadow_hits.get(), car.pwm.shadow_misses.get()
+        for duties in commands:
+            car.set_motor_model(*duties)
+        hits, misses = car.pwm.shadow_hits.get() - hits, car.pwm.shadow_misses.get() - misses
+        print("  {:<22} {:5.2f} transactions/update  bus time {:6.3f} ms/update  channel hit rate {:5.1%}".format(
+            name, bus.transactions / len(commands), bus.bus_time / len(commands) * 1000, hits / (hits + misses)))
+
+class _ThreadedBus(_SimulatedBus):
+    # A simulated bus whose transactions take their wire time
+    def __init__(self, clock=100000, overhead=0.00005):
+        super().__init__(clock, overhead)
+        self.wire = threading.Lock()  # The kernel driver runs one transaction at a time, but nothing longer
+    def transfer(self, data_bytes):
+        with self.wire:
+            start = self.bus_time
+            super().transfer(data_bytes)
+            time.sleep(self.bus_time - start)
+
+def _simulated_adc(bus, retries=8):
+    # An ADC on a simulated bus, without the parameter file
+    from adc import ADC
+    from stats import registry
+    adc = ADC.__new__(ADC)
+    adc.I2C_ADDRESS, adc.ADS7830_COMMAND, adc.adc_voltage_coefficient, adc.pcb_version, adc.i2c_bus = 0x48, 0x84, 3.3, 1, bus
+    adc.retries, adc.noise, adc.unstable = retries, registry.counter('benchmark.adc.noise'), registry.counter('benchmark.adc.unstable')
+    return adc
+
+def _i2c_run(shared, duration=1.0):
+    # Two motor writers (commands and a car mode), a servo sweep and two ADC readers (sampler and a car mode) at once
+    import random
+    from i2c_bus import I2CBus
+    from motor import Ordinary_Car
+    from pca9685 import PCA9685
+    from stats import registry
+    raw = _ThreadedBus()
+    bus = I2CBus(bus=raw) if shared else raw
+    motor_pwm = PCA9685(0x40, bus=bus)
+    servo_pwm = motor_pwm if shared else PCA9685(0x40, bus=bus)
+    car = Ordinary_Car.__new__(Ordinary_Car)
+    car.pwm = motor_pwm
+    car.write_time = registry.histogram('benchmark.motor.write')
+    adc = _simulated_adc(bus)
+    raw.transactions, raw.bus_time = 0, 0.0
+    combined = motor_pwm.combined.get()
+    stop = time.monotonic() + duration
+    latencies, reads, corrupt = [], [0], [0]
+    def drive(seed):
+        generator = random.Random(seed)
+        while time.monotonic() < stop:
+            start = time.perf_counter()
+            car.set_motor_model(*[generator.choice((0, 1500, -1500, 3000)) for _ in range(4)])
+            latencies.append(time.perf_counter() - start)
+            time.sleep(0.002)
+    def sweep():
+        angle = 0
+        while time.monotonic() < stop:
+            angle = (angle + 10) % 180
+            servo_pwm.set_servo_pulse_many({8: 500 + angle * 11, 9: 2500 - angle * 11})
+            time.sleep(0.005)
+    def sample(channels):
+        while time.monotonic() < stop:
+            for channel in channels:
+                voltage = adc.read_adc(channel)
+                reads[0] += 1
+                if voltage != round(40 * (channel + 1) / 255.0 * 3.3, 2):
+                    corrupt[0] += 1
+            time.sleep(0.001)
+    threads = [threading.Thread(target=drive, args=(1,)), threading.Thread(target=drive, args=(2,)),
+               threading.Thread(target=sweep), threading.Thread(target=sample, args=((0, 1),)),
+               threading.Thread(target=sample, args=((2,),))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    return {'updates': len(latencies), 'reads': reads[0], 'corrupt': corrupt[0], 'transactions': raw.transactions,
+            'combined': motor_pwm.combined.get() - combined, 'p99': latencies[int(len(latencies) * 0.99)] * 1000,
+            'devices': bus.get_stats() if shared else None}
+
+def benchmark_I2CBus():
+    print("Motors from two threads, a servo sweep and two ADC readers on one simulated 100 kHz bus for 1 s:")
+    for name, shared in (("separate handles", False), ("shared I2CBus", True)):
+        result = _i2c_run(shared)
+        print("  {:<17} ADC reads {:5d}  corrupt {:4d}  motor updates {:4d}  combined {:3d}  transactions {:5d}  update p99 {:6.3f} ms".format(
+            name, result['reads'], result['corrupt'], result['updates'], result['combined'], result['transactions'], result['p99']))
+        if result['devices']:
+            for address, device in result['devices'].items():
+                print("    {} {:5d} transactions  {:7.3f} ms busy  {:5.1%} of bus time".format(
+                    address, device['transactions'], device['busy_ms'], device['share']))
+
+class _NoisyBus(_SimulatedBus):
+    # An ADS7830 whose bytes are each off by up to `spread` codes with probability `noise`, like a flickering photoresistor
+    def __init__(self, noise, spread=3, seed=5):
+        import random
+        super().__init__()
+        self.noise, self.spread = noise, spread
+        self.random = random.Random(seed)
+    def read_byte(self, address):
+        value = super().read_byte(address)
+        if self.random.random() < self.noise:
+            value += self.random.randint(-self.spread, self.spread)
+        return value
+
+def _legacy_read_adc(adc, channel):
+    # What read_adc did: retry read pairs until two agree, however long that takes
+    adc.i2c_bus.write_byte(adc.I2C_ADDRESS, adc.ADS7830_COMMAND | ((((channel << 2) | (channel >> 1)) & 0x07) << 4))
+    while True:
+        value1, value2 = adc.i2c_bus.read_byte(adc.I2C_ADDRESS), adc.i2c_bus.read_byte(adc.I2C_ADDRESS)
+        if value1 == value2:
+            return round(value1 / 255.0 * adc.adc_voltage_coefficient, 2)
+
+def benchmark_ADC():
+    from adc import ADCSampler
+    print("ADC read time on a simulated 100 kHz bus, 3000 reads per noise level (bus ms p50/p99/max):")
+    for noise in (0.2, 0.6, 0.9):
+        for name, legacy in (("unbounded retries", True), ("8 read pairs", False)):
+            bus = _NoisyBus(noise)
+            adc = _simulated_adc(bus)
+            noisy, unstable = adc.noise.get(), adc.unstable.get()
+            times = []
+            for i in range(3000):
+                start = bus.bus_time
+                if legacy:
+                    _legacy_read_adc(adc, i % 3)
+                else:
+                    adc.read_adc(i % 3)
+                times.append(bus.bus_time - start)
+            times.sort()
+            print("  noise {:.0%} {:<18} {:6.3f} {:6.3f} {:7.3f}  noisy pairs {:5d}  out of retries {:4d}".format(
+                noise, name, times[1500] * 1000, times[2969] * 1000, times[-1] * 1000,
+                adc.noise.get() - noisy, adc.unstable.get() - unstable))
+    bus = _NoisyBus(0.9)
+    sampler = ADCSampler(_simulated_adc(bus), (0, 1, 2), rate=60)
+    for _ in range(3000):
+        sampler.step()
+    true = round(40 / 255.0 * 3.3, 2)
+    errors = {'latest': [], 'median of 5': [], 'EMA': []}
+    for _ in range(3000):
+        sampler.step()
+        errors['latest'].append(abs(sampler.latest(0) - true))
+        errors['median of 5'].append(abs(sampler.median(0) - true))
+        errors['EMA'].append(abs(sampler.ema(0) - true))
+    print("Channel 0 error at noise 90%, mean/max in volts:")
+    for name, error in errors.items():
+        print("  {:<12} {:.4f} {:.4f}".format(name, sum(error) / len(error), max(error)))
+    for name, read in (("read_adc", lambda: sampler.adc.read_adc(0)), ("latest", lambda: sampler.latest(0)),
+                       ("median of 5", lambda: sampler.median(0)), ("EMA", lambda: sampler.ema(0))):
+        start, bus_time = time.perf_counter(), bus.bus_time
+        for _ in range(3000):
+            read()
+        print("  {:<12} Python {:6.2f} us/read  bus {:6.3f} ms/read".format(
+            name, (time.perf_counter() - start) / 3000 * 1e6, (bus.bus_time - bus_time) / 3000 * 1000))
+
+class _SimulatedSonic:
+    # An ultrasonic sensor on a servo facing a scene of distances by angle; turning takes `travel` seconds
+    # Like gpiozero's DistanceSensor it pings on its own thread every 60 ms and readers get the newest ping
+    def __init__(self, scene, spike=0.15, travel=0.1, seed=3):
+        import random
+        self.scene, self.spike, self.travel = scene, spike, travel
+        self.random = random.Random(seed)
+        self.angle, self.previous, self.moved = 90, 90, 0.0
+        self.echo = None
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+    def turn(self, angle):
+        self.previous, self.angle, self.moved = self.facing(), angle, time.monotonic()
+    def facing(self):
+        return self.angle if time.monotonic() - self.moved >= self.travel else self.previous
+    def run(self):
+        while self.running:
+            time.sleep(0.06)
+            triggered = time.monotonic()
+            distance = self.scene[self.facing()]
+            if self.random.random() < self.spike:
+                distance = self.random.choice((3.0, 300.0))  # A stray echo, or none back in range
+            time.sleep(2 * distance / 34300)  # Round trip at the speed of sound
+            self.echo = (distance, triggered)
+    def get_distance(self):
+        return None if self.echo is None else self.echo[0]
+    def get_echo(self):
+        return self.echo
+    def close(self):
+        self.running = False
+        self.thread.join()
+
+def _ranging_run(ranged, steps=20, frequency=5):
+    # Sweep the sensor 30-90-150-90 like mode_ultrasonic; count readings more than 10% off the distance at their angle
+    from ultrasonic import RangingService
+    scene = {30: 40.0, 90: 120.0, 150: 25.0}
+    sonic = _SimulatedSonic(scene)
+    ranger = RangingService(sonic)
+    if ranged:
+        ranger.start()
+    angles, latencies, wrong, missing = [30, 90, 150, 90], [], 0, 0
+    for step in range(steps):
+        angle = angles[step % 4]
+        start = time.perf_counter()
+        if ranged:
+            sample = ranger.latest(angle)       # Measured since the last step turned the servo here
+            distance = None if sample is None else sample.distance
+        else:
+            sonic.turn(angle)                   # What mode_ultrasonic did: turn, then read the distance at once
+            distance = sonic.get_distance()
+        latencies.append(time.perf_counter() - start)
+        if distance is None:
+            missing += 1
+        elif abs(distance - scene[angle]) > 0.1 * scene[angle]:
+            wrong += 1
+        if ranged:
+            next_angle = angles[(step + 1) % 4]
+            sonic.turn(next_angle)
+            ranger.aim(next_angle)
+        time.sleep(1.0 / frequency)
+    ranger.stop()
+    sonic.close()
+    return max(latencies), sum(latencies) / len(latencies), wrong, missing, ranger.get_stats()
+
+def benchmark_Ranging():
+    print("Ultrasonic sweep at 5 steps/s, 15% stray echoes, servo takes 100 ms to turn, 20 steps:")
+    for name, ranged in (("ping after turning", False), ("ranging service", True)):
+        worst, mean, wrong, missing, stats = _ranging_run(ranged)
+        print("  {:<19} read mean {:7.3f} ms  max {:7.3f} ms  wrong {:2d}  missing {:2d}".format(name, mean * 1000, worst * 1000, wrong, missing))
+    print("  ranging service: {} pings, {} spikes left out by the median, {} taken while turning ignored".format(stats['pings'], stats['spikes'], stats['unsettled']))
+
+class _MotorRecorder:
+    # Stands in for Ordinary_Car: records when each set of duties was written
+    def __init__(self):
+        self.updates = []
+    def set_motor_model(self, *duties):
+        self.updates.append((time.perf_counter(), duties))
+
+def _infrared_duties(value):
+    # The duties mode_infrared writes for a line value
+    import types
+    from car import Car
+    from infrared import LineState
+    probe = Car.__new__(Car)
+    probe.infrared = types.SimpleNamespace(get_state=lambda: LineState(value, 0.0, 0))
+    probe.motor = _MotorRecorder()
+    probe.mode_infrared()
+    return probe.motor.updates[-1][1]
+
+def _line_following_run(event_driven, edges=24, frequency=5):
+    # Move the line under the sensors on simulated pins; time each edge until the motors get the duties for it
+    import random
+    from gpiozero.pins.mock import MockFactory
+    from car import Car
+    from infrared import Infrared
+    from scheduler import FixedRateLoop
+    factory = MockFactory()
+    car = Car.__new__(Car)
+    car.infrared = Infrared(pin_factory=factory)
+    car.motor = _MotorRecorder()
+    loop = FixedRateLoop('benchmark.line')
+    if event_driven:
+        car.infrared.enable_events()
+        car.infrared.on_change = lambda state: loop.wake('infrared')
+    pins = {channel: factory.pin(pin) for channel, pin in car.infrared.IR_PINS.items()}
+    def drive(value):
+        for channel, pin in pins.items():
+            pin.drive_high() if (value >> (3 - channel)) & 1 else pin.drive_low()
+    # Each value differs from the one before in one sensor, and each gets different duties
+    values = [2, 6, 4, 6, 2, 3, 1, 3]
+    drive(values[0])
+    time.sleep(0.2)
+    loop.start()
+    loop.set_step(car.mode_infrared, frequency, 'infrared')
+    generator = random.Random(6)
+    time.sleep(0.3)
+    edges_at = []
+    for i in range(1, edges + 1):
+        value = values[i % len(values)]
+        edges_at.append((time.perf_counter(), _infrared_duties(value)))
+        drive(value)
+        time.sleep(generator.uniform(0.25, 0.45))
+    loop.stop()
+    stats = loop.get_stats()
+    car.infrared.close()
+    latencies = []
+    for edge, duties in edges_at:
+        latencies.append(min(at for at, written in car.motor.updates if at >= edge and written == duties) - edge)
+    latencies.sort()
+    return latencies, len(car.motor.updates), stats['wakeups']
+
+def benchmark_InfraredEvents():
+    print("Edge to motor update on simulated pins, 5 steps/s line following, 24 edges:")
+    for name, event_driven in (("polled", False), ("edge events", True)):
+        latencies, updates, wakeups = _line_following_run(event_driven)
+        print("  {:<12} p50 {:7.2f} ms  p90 {:7.2f} ms  max {:7.2f} ms  motor updates {:3d}  wakeups {:2d}".format(
+            name, latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.9)] * 1000, latencies[-1] * 1000, updates, wakeups))
+
+# Main program logic follows:
+if __name__ == '__main__':
+    print ('Program is starting ... ')
+    import sys
+    if len(sys.argv)<2:
+        print ("Parameter error: Please assign the benchmark")
+        exit()
+    if sys.argv[1] == 'TCPServer':
+        benchmark_TCPServer()
+    elif sys.argv[1] == 'Protocol':
+        benchmark_Protocol()
+    elif sys.argv[1] == 'VideoSend':
+        benchmark_VideoSend()
+    elif sys.argv[1] == 'Dispatch':
+        benchmark_Dispatch()
+    elif sys.argv[1] == 'CommandPipeline':
+        benchmark_CommandPipeline()
+    elif sys.argv[1] == 'Coalescing':
+        benchmark_Coalescing()
+    elif sys.argv[1] == 'Parse':
+        benchmark_Parse()
+    elif sys.argv[1] == 'Kinematics':
+        benchmark_Kinematics()
+    elif sys.argv[1] == 'MotionTask':
+        benchmark_MotionTask()
+    elif sys.argv[1] == 'ControlLoop':
+        benchmark_ControlLoop()
+    elif sys.argv[1] == 'PCA9685':
+        benchmark_PCA9685()
+    elif sys.argv[1] == 'ShadowRegisters':
+        benchmark_ShadowRegisters()
+    elif sys.argv[1] == 'I2CBus':
+        benchmark_I2CBus()
+    elif sys.argv[1] == 'ADC':
+        benchmark_ADC()
+    elif sys.argv[1] == 'Ranging':
+        benchmark_Ranging()
+    elif sys.argv[1] == 'InfraredEvents':
+        benchmark_InfraredEvents()
@@ -1,47 +1,79 @@
-from ultrasonic import Ultrasonic
+from ultrasonic import Ultrasonic, RangingService
 from motor import Ordinary_Car
 from servo import Servo
 from infrared import Infrared
-from adc import ADC
+from adc import ADC, ADCSampler
+from kinematics import MecanumDrive, OrdinaryDrive
+from scheduler import FixedRateLoop
 import time
-import math
 
 class Car:
     def __init__(self):
         self.servo = None
         self.sonic = None
+        self.ranger = None
         self.motor = None
         self.infrared = None
         self.adc = None
-        self.car_record_time = time.time()
+        self.adc_sampler = None
         self.car_sonic_servo_angle = 30
         self.car_sonic_servo_dir = 1
         self.car_sonic_distance = [30, 30, 30]
+        self.mecanum = MecanumDrive()       # Joystick and rotation setpoints for the mecanum wheels
+        self.ordinary = OrdinaryDrive(0.8)  # Direct wheel duties from the client, scaled down
+        self.mode_frequency = {'light': 5, 'infrared': 5, 'ultrasonic': 5}  # Steps per second of each autonomous mode
+        self.adc_rate = 60  # ADC reads per second, taken in turn by the two photoresistors and the battery
         self.time_compensate = 3 #Depend on your own car,If you want to get the best out of the rotation mode, change the value by experimenting.
         self.start()
     def start(self):  
         if self.servo is None:
             self.servo = Servo()
         if self.sonic is None:
-            self.sonic = Ultrasonic()
+            self.sonic = Ultrasonic(queue_len=1)  # The ranger filters per servo angle instead
+        if self.ranger is None:
+            self.ranger = RangingService(self.sonic)
         if self.motor is None:
             self.motor = Ordinary_Car()
         if self.infrared is None:
             self.infrared = Infrared()
         if self.adc is None:
             self.adc = ADC() 
+        if self.adc_sampler is None:
+            self.adc_sampler = ADCSampler(self.adc, (0, 1, 2), self.adc_rate)
+        self.infrared.enable_events()  # Edges update the line state as they happen
+        self.adc_sampler.start()
+        self.ranger.start()
+
+    def read_light(self):
+        # Median of the newest photoresistor samples, so one noisy read cannot swing the car; None if stale
+        left, right = self.adc_sampler.median(0), self.adc_sampler.median(1)
+        return None if left is None or right is None else (left, right)
+
+    def read_line(self):
+        value = self.infrared.get_state().value
+        return ((value >> 2) & 1, (value >> 1) & 1, value & 1)
+
+    def read_power(self):
+        # The battery changes slowly, so its average is steadier than any single sample; None if stale
+        voltage = self.adc_sampler.ema(2)
+        return None if voltage is None else round(voltage * (3 if self.adc.pcb_version == 1 else 2), 2)
 
     def close(self):
+        self.adc_sampler.stop()
+        self.ranger.stop()
         self.motor.set_motor_model(0,0,0,0)
         self.sonic.close()
         self.motor.close()
         self.infrared.close()
         self.adc.close_i2c()
+        self.servo.close()
         self.servo = None
         self.sonic = None
+        self.ranger = None
         self.motor = None
         self.infrared = None
         self.adc = None
+        self.adc_sampler = None
 
     def run_motor_ultrasonic(self, distance):
         if (distance[0] < 30 and distance[1] < 30 and distance[2] <30) or distance[1] < 30 :
@@ -67,82 +99,95 @@ class Car:
             self.motor.set_motor_model(600,600,600,600)
 
     def mode_ultrasonic(self):
-        if (time.time() - self.car_record_time) > 0.2:
-            self.car_record_time = time.time()
-            self.servo.set_servo_pwm('0', self.car_sonic_servo_angle)
+        # The servo was turned at the end of the last step; the ranger has been measuring there since
+        sample = self.ranger.latest(self.car_sonic_servo_angle)
+        if sample is not None:
             if self.car_sonic_servo_angle == 30:
-                self.car_sonic_distance[0] = self.sonic.get_distance()
+                self.car_sonic_distance[0] = sample.distance
             elif self.car_sonic_servo_angle == 90:
-                self.car_sonic_distance[1] = self.sonic.get_distance()
+                self.car_sonic_distance[1] = sample.distance
             elif self.car_sonic_servo_angle == 150:
-                self.car_sonic_distance[2] = self.sonic.get_distance()
-            #print("L:{}, M:{}, R:{}".format(self.car_sonic_distance[0], self.car_sonic_distance[1], self.car_sonic_distance[2]))
-            self.run_motor_ultrasonic(self.car_sonic_distance)
-            if self.car_sonic_servo_angle <= 30:
-                self.car_sonic_servo_dir = 1
-            elif self.car_sonic_servo_angle >= 150:
-                self.car_sonic_servo_dir = 0
-            if self.car_sonic_servo_dir == 1:
-                self.car_sonic_servo_angle += 60
-            elif self.car_sonic_servo_dir == 0:
-                self.car_sonic_servo_angle -= 60
+                self.car_sonic_distance[2] = sample.distance
+        #print("L:{}, M:{}, R:{}".format(self.car_sonic_distance[0], self.car_sonic_distance[1], self.car_sonic_distance[2]))
+        self.run_motor_ultrasonic(self.car_sonic_distance)
+        if self.car_sonic_servo_angle <= 30:
+            self.car_sonic_servo_dir = 1
+        elif self.car_sonic_servo_angle >= 150:
+            self.car_sonic_servo_dir = 0
+        if self.car_sonic_servo_dir == 1:
+            self.car_sonic_servo_angle += 60
+        elif self.car_sonic_servo_dir == 0:
+            self.car_sonic_servo_angle -= 60
+        self.servo.set_servo_pwm('0', self.car_sonic_servo_angle)
+        self.ranger.aim(self.car_sonic_servo_angle)
 
     def mode_infrared(self):
-        if (time.time() - self.car_record_time) > 0.2:
-            self.car_record_time = time.time()
-            infrared_value = self.infrared.read_all_infrared()
-            #print("infrared_value: " + str(infrared_value))
-            if infrared_value == 2:
-                self.motor.set_motor_model(800,800,800,800)
-            elif infrared_value == 4:
-                self.motor.set_motor_model(-1500,-1500,2500,2500)
-            elif infrared_value == 6:
-                self.motor.set_motor_model(-2000,-2000,4000,4000)
-            elif infrared_value == 1:
-                self.motor.set_motor_model(2500,2500,-1500,-1500)
-            elif infrared_value == 3:
-                self.motor.set_motor_model(4000,4000,-2000,-2000)
-            elif infrared_value == 7:
-                self.motor.set_motor_model(0,0,0,0)
+        infrared_value = self.infrared.get_state().value
+        #print("infrared_value: " + str(infrared_value))
+        if infrared_value == 2:
+            self.motor.set_motor_model(800,800,800,800)
+        elif infrared_value == 4:
+            self.motor.set_motor_model(-1500,-1500,2500,2500)
+        elif infrared_value == 6:
+            self.motor.set_motor_model(-2000,-2000,4000,4000)
+        elif infrared_value == 1:
+            self.motor.set_motor_model(2500,2500,-1500,-1500)
+        elif infrared_value == 3:
+            self.motor.set_motor_model(4000,4000,-2000,-2000)
+        elif infrared_value == 7:
+            self.motor.set_motor_model(0,0,0,0)
 
     def mode_light(self):
-        if (time.time() - self.car_record_time) > 0.2:
-            self.car_record_time = time.time()
+        self.motor.set_motor_model(0,0,0,0)
+        light = self.read_light()
+        if light is None:
+            return
+        L, R = light
+        #print("L: {}, R: {}".format(L, R))
+        if L < 2.99 and R < 2.99 :
+            self.motor.set_motor_model(600,600,600,600)
+        elif abs(L-R)<0.15:
             self.motor.set_motor_model(0,0,0,0)
-            L = self.adc.read_adc(0)
-            R = self.adc.read_adc(1)
-            #print("L: {}, R: {}".format(L, R))
-            if L < 2.99 and R < 2.99 :
-                self.motor.set_motor_model(600,600,600,600)
-            elif abs(L-R)<0.15:
-                self.motor.set_motor_model(0,0,0,0)
-            elif L > 3 or R > 3:
-                if L > R :
-                    self.motor.set_motor_model(-1200,-1200,1400,1400)
-                elif R > L :
-                    self.motor.set_motor_model(1400,1400,-1200,-1200)
+        elif L > 3 or R > 3:
+            if L > R :
+                self.motor.set_motor_model(-1200,-1200,1400,1400)
+            elif R > L :
+                self.motor.set_motor_model(1400,1400,-1200,-1200)
 
-    def mode_rotate(self, n):
+    def rotate_steps(self, n):
+        """Steps of a rotation for a MotionTaskRunner: each sets the wheels and yields the seconds to the next."""
         angle = n
-        bat_compensate = 7.5 / (self.adc.read_adc(2) * (3 if self.adc.pcb_version == 1 else 2))
+        power = self.read_power()
+        bat_compensate = 7.5 / power if power else 1.0
+        period = 5*self.time_compensate*bat_compensate/1000
         while True:
-            W = 2000
-            VY = int(2000 * math.cos(math.radians(angle)))
-            VX = -int(2000 * math.sin(math.radians(angle)))
-            FR = VY - VX + W
-            FL = VY + VX - W
-            BL = VY - VX - W
-            BR = VY + VX + W
-            print("rotating")
-            self.motor.set_motor_model(FL, BL, FR, BR)
-            time.sleep(5*self.time_compensate*bat_compensate/1000)
+            self.motor.set_motor_model(*self.mecanum.heading(angle, 2000, 2000))
+            yield period
             angle -= 5
 
+    def mode_rotate(self, n):
+        deadline = time.monotonic()
+        print("rotating")
+        for period in self.rotate_steps(n):
+            deadline += period
+            time.sleep(max(0, deadline - time.monotonic()))
+
+def run_car_mode(car, mode):
+    # Step one autonomous mode at its configured rate until interrupted
+    loop = FixedRateLoop('car')
+    loop.start()
+    loop.set_step(getattr(car, 'mode_' + mode), car.mode_frequency[mode], mode)
+    try:
+        while True:
+            time.sleep(1)
+    finally:
+        loop.stop()
+        print(loop.get_stats())
+
 def test_car_sonic():
     car = Car()
     try:
-        while True:
-            car.mode_ultrasonic()
+        run_car_mode(car, 'ultrasonic')
     except KeyboardInterrupt:
         car.close()
         print("\nEnd of program")
@@ -150,8 +195,7 @@ def test_car_sonic():
 def test_car_infrared():
     car = Car()
     try:
-        while True:
-            car.mode_infrared()
+        run_car_mode(car, 'infrared')
     except KeyboardInterrupt:
         car.close()
         print("\nEnd of program")
@@ -160,8 +204,7 @@ def test_car_light():
     car = Car()
     try:
         print("Program is starting...")
-        while True:
-            car.mode_light()
+        run_car_mode(car, 'light')
     except KeyboardInterrupt:
         car.close()
         print("\nEnd of program")
@@ -11,4 +11,6 @@ class Command:
         self.CMD_LIGHT      = "CMD_LIGHT"
         self.CMD_POWER      = "CMD_POWER" 
         self.CMD_MODE       = "CMD_MODE"
-        self.CMD_LINE       = "CMD_LINE"
\ No newline at end of file
+        self.CMD_LINE       = "CMD_LINE"
+        self.CMD_SUBSCRIBE  = "CMD_SUBSCRIBE"
+        self.CMD_STATS      = "CMD_STATS"
\ No newline at end of file
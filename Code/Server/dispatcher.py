@@ -0,0 +1,107 @@
+import time
+from stats import registry
+
+class Argument:
+    def __init__(self, name: str, minimum=None, maximum=None, default=None, kind=int, required=True):
+        """One declared argument of a command: its type, the range it is clamped to and, if optional, its default."""
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.required = required  # Optional arguments may be left out and take the default
+        self.default = default
+        self.kind = kind          # Conversion applied to the received value, e.g. int or str
+
+    def convert(self, value):
+        """Convert and clamp a received value; raises ValueError or TypeError if it has the wrong type."""
+        value = self.kind(value)
+        if self.minimum is not None and value < self.minimum:
+            return self.minimum
+        if self.maximum is not None and value > self.maximum:
+            return self.maximum
+        return value
+
+class CommandHandler:
+    def __init__(self, command: str, function, arguments=()):
+        """A command's handler, its argument schema and its timing histogram."""
+        self.command = command
+        self.function = function  # Called as function(client_address, *arguments)
+        self.arguments = tuple(arguments)
+        self.required = sum(1 for argument in self.arguments if argument.required)
+        if any(argument.required for argument in self.arguments[self.required:]):
+            raise ValueError(f"{command}: required arguments must come before optional ones")
+        # Built once at registration, so validation only walks these: (kind, minimum, maximum) per argument, and the defaults
+        self.specs = tuple((argument.kind, argument.minimum, argument.maximum) for argument in self.arguments)
+        self.defaults = tuple(argument.default for argument in self.arguments)
+        self.time = registry.histogram('dispatch.' + command)
+
+    def validate(self, parameters):
+        """Convert and clamp the parameters to this schema; returns the argument values, or None if they do not fit."""
+        count = len(parameters)
+        if count < self.required:
+            return None
+        values = []
+        try:
+            # Extra parameters are ignored, as they always have been; commands without arguments take none
+            for (kind, minimum, maximum), parameter in zip(self.specs, parameters):
+                value = kind(parameter)
+                if minimum is not None and value < minimum:
+                    value = minimum
+                elif maximum is not None and value > maximum:
+                    value = maximum
+                values.append(value)
+        except (ValueError, TypeError):
+            return None
+        if count < len(self.specs):
+            values.extend(self.defaults[count:])
+        return values
+
+class Dispatcher:
+    def __init__(self):
+        """Map command tokens to handlers; the arguments are checked before any handler runs."""
+        self.handlers = {}                                    # command -> CommandHandler
+        self.unknown = registry.counter('dispatch.unknown')   # Commands without a handler
+        self.rejected = registry.counter('dispatch.rejected') # Commands whose arguments did not fit the schema
+        self.failed = registry.counter('dispatch.failed')     # Handlers that raised
+
+    def register(self, command: str, function, arguments=()) -> CommandHandler:
+        """Add or replace the handler of a command."""
+        handler = CommandHandler(command, function, arguments)
+        self.handlers[command] = handler
+        return handler
+
+    def dispatch(self, client_address: tuple, command: str, parameters) -> bool:
+        """Validate a command's parameters and run its handler; returns False if it was not run or failed."""
+        handler = self.handlers.get(command)
+        if handler is None:
+            self.unknown.increment()
+            print(f"Unknown command: {command}")
+            return False
+        values = handler.validate(parameters)
+        if values is None:
+            self.rejected.increment()
+            print(f"Rejected {command}: expected {', '.join(argument.name for argument in handler.arguments)}, got {list(parameters)}")
+            return False
+        start = time.perf_counter()
+        try:
+            handler.function(client_address, *values)
+            return True
+        except Exception as e:
+            self.failed.increment()
+            print(f"Error handling {command}: {e}")
+            return False
+        finally:
+            handler.time.record(time.perf_counter() - start)
+
+    def get_commands(self) -> list:
+        """Get the registered command tokens."""
+        return list(self.handlers)
+
+if __name__ == '__main__':
+    print('Program is starting ... ')
+    dispatcher = Dispatcher()
+    dispatcher.register("CMD_SERVO", lambda client_address, channel, angle: print("servo", channel, angle),
+                        [Argument('channel', 0, 7), Argument('angle', 0, 180)])
+    dispatcher.dispatch(None, "CMD_SERVO", [0, 200])
+    dispatcher.dispatch(None, "CMD_SERVO", [1])
+    dispatcher.dispatch(None, "CMD_JUMP", [])
+    print(registry.snapshot())
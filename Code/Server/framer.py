@@ -0,0 +1,33 @@
+import codecs
+
+class LineFramer:
+    def __init__(self, delimiter: str = '\n', max_line_length: int = 4096):
+        """Split one connection's byte stream into complete newline-terminated messages."""
+        self.delimiter = delimiter                  # Character terminating every message
+        self.max_line_length = max_line_length      # Longest partial message kept while waiting for the delimiter
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')  # Keeps split multibyte characters between reads
+        self.buffer = ''                            # Partial message carried over to the next read
+
+    def feed(self, data: bytes) -> list:
+        """Add received bytes and return the complete messages they finish, in order."""
+        text = self.buffer + self.decoder.decode(data)
+        if self.delimiter not in text:
+            if len(text) > self.max_line_length:
+                print(f"Discarding {len(text)} characters without a message delimiter")
+                text = ''
+            self.buffer = text
+            return []
+        lines = text.split(self.delimiter)
+        self.buffer = lines.pop()                   # The text after the last delimiter is incomplete
+        return [line for line in (line.strip() for line in lines) if line]
+
+    def reset(self) -> None:
+        """Drop any partial message and decoder state."""
+        self.decoder.reset()
+        self.buffer = ''
+
+if __name__ == '__main__':
+    print('Program is starting ... ')
+    framer = LineFramer()
+    for chunk in (b'CMD_MOTOR#0#0', b'#0#0\nCMD_SERVO#0#9', b'0\nCMD_LED#0#255#0#0\n\xe2\x82', b'\xac\n'):
+        print(chunk, '->', framer.feed(chunk))
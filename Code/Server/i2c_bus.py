@@ -0,0 +1,92 @@
+import threading
+import time
+import smbus
+from stats import registry
+
+class I2CBus:
+    def __init__(self, number: int = 1, bus=None):
+        """One handle on an I2C bus shared by every device on it; each transaction holds the bus lock."""
+        self.number = number
+        self.bus = bus if bus is not None else smbus.SMBus(number)
+        self.lock = threading.RLock()  # Held across multi-step sequences with transaction()
+        self.users = 0                 # Holders from get_bus(); the handle is closed when the last one closes it
+        self.devices = {}              # address -> (transactions counter, busy microseconds counter)
+        self.wait_time = registry.histogram(f'i2c.{number}.wait')  # Time spent waiting for the bus
+
+    def device_stats(self, address: int) -> tuple:
+        stats = self.devices.get(address)
+        if stats is None:
+            name = f'i2c.{self.number}.0x{address:02x}'
+            stats = self.devices[address] = (registry.counter(name + '.transactions'), registry.counter(name + '.busy_us'))
+        return stats
+
+    def transaction(self):
+        """Hold the bus for a sequence that must not be interleaved: with bus.transaction(): ..."""
+        return self.lock
+
+    def call(self, address: int, method, *args):
+        start = time.perf_counter()
+        with self.lock:
+            acquired = time.perf_counter()
+            try:
+                return method(address, *args)
+            finally:
+                transactions, busy = self.device_stats(address)
+                transactions.increment()
+                busy.increment(int((time.perf_counter() - acquired) * 1e6))
+                self.wait_time.record(acquired - start)
+
+    def write_byte(self, address: int, value: int) -> None:
+        self.call(address, self.bus.write_byte, value)
+
+    def read_byte(self, address: int) -> int:
+        return self.call(address, self.bus.read_byte)
+
+    def write_byte_data(self, address: int, register: int, value: int) -> None:
+        self.call(address, self.bus.write_byte_data, register, value)
+
+    def read_byte_data(self, address: int, register: int) -> int:
+        return self.call(address, self.bus.read_byte_data, register)
+
+    def write_i2c_block_data(self, address: int, register: int, data: list) -> None:
+        self.call(address, self.bus.write_i2c_block_data, register, data)
+
+    def close(self) -> None:
+        """Release one holder; the handle is closed when none are left."""
+        with _buses_lock:
+            self.users -= 1
+            if self.users > 0:
+                return
+            if _buses.get(self.number) is self:
+                del _buses[self.number]
+        self.bus.close()
+
+    def get_stats(self) -> dict:
+        """Get the transactions and busy milliseconds of every device, with its share of the bus time."""
+        busy_total = sum(busy.get() for transactions, busy in self.devices.values()) or 1
+        return {f'0x{address:02x}': {'transactions': transactions.get(), 'busy_ms': round(busy.get() / 1000, 3),
+                                     'share': round(busy.get() / busy_total, 3)}
+                for address, (transactions, busy) in list(self.devices.items())}
+
+_buses = {}                    # bus number -> I2CBus
+_buses_lock = threading.Lock()
+
+def get_bus(number: int = 1) -> I2CBus:
+    """Get the process-wide handle of an I2C bus; every caller must close() it once when done."""
+    with _buses_lock:
+        bus = _buses.get(number)
+        if bus is None:
+            bus = _buses[number] = I2CBus(number)
+        bus.users += 1
+        return bus
+
+if __name__ == '__main__':
+    print('Program is starting ... ')
+    bus = get_bus(1)
+    for device in range(0x03, 0x78):
+        try:
+            bus.read_byte(device)
+            print(f"Device found at address: 0x{device:02X}")
+        except OSError:
+            pass
+    bus.close()
@@ -1,10 +1,16 @@
 # Import the LineSensor class from gpiozero for reading infrared sensors
 from gpiozero import LineSensor
+from collections import namedtuple
+from stats import registry
+import threading
 import time
 
+# The three sensors as one 3-bit value (channel 1 is the high bit), the monotonic time it last changed and a change count
+LineState = namedtuple('LineState', ['value', 'timestamp', 'sequence'])
+
 # Define the Infrared class to manage infrared sensors
 class Infrared:
-    def __init__(self):
+    def __init__(self, pin_factory=None):
         # Define the GPIO pins for each infrared sensor
         self.IR_PINS = {
             1: 14,
@@ -12,7 +18,13 @@ class Infrared:
             3: 23
         }
         # Initialize LineSensor objects for each infrared sensor
-        self.sensors = {channel: LineSensor(pin) for channel, pin in self.IR_PINS.items()}
+        self.sensors = {channel: LineSensor(pin, pin_factory=pin_factory) for channel, pin in self.IR_PINS.items()}
+        # Event mode: the edge callbacks keep the state current and wake whoever waits for a change
+        self.events = False
+        self.state = LineState(0, 0.0, 0)  # Replaced whole, so readers never see a half update
+        self.condition = threading.Condition()
+        self.on_change = None               # Called with the new LineState after each change, e.g. to wake a control loop
+        self.edges = registry.counter('infrared.edges')
 
     def read_one_infrared(self, channel: int) -> int:
         """Read the value of a single infrared sensor."""
@@ -25,8 +37,56 @@ class Infrared:
         """Combine the values of all three infrared sensors into a single integer."""
         return (self.read_one_infrared(1) << 2) | (self.read_one_infrared(2) << 1) | self.read_one_infrared(3)
 
+    def enable_events(self) -> None:
+        """Keep the state up to date from the sensors' edge callbacks instead of reading the pins on demand."""
+        for channel, sensor in self.sensors.items():
+            # gpiozero's line is the sensor's inactive state: value 0, as read_one_infrared reports it
+            sensor.when_line = lambda channel=channel: self.on_edge(channel, 0)
+            sensor.when_no_line = lambda channel=channel: self.on_edge(channel, 1)
+        with self.condition:
+            # Read after the callbacks are in place, so no edge falls in between
+            self.events = True
+            self.state = LineState(self.read_all_infrared(), time.monotonic(), self.state.sequence + 1)
+            self.condition.notify_all()
+
+    def disable_events(self) -> None:
+        """Go back to reading the pins on demand."""
+        with self.condition:
+            self.events = False
+        # Outside the lock: gpiozero may be waiting for a callback that is waiting for it
+        for sensor in self.sensors.values():
+            sensor.when_line = None
+            sensor.when_no_line = None
+
+    def on_edge(self, channel: int, value: int) -> None:
+        bit = 1 << (3 - channel)
+        with self.condition:
+            state = self.state
+            new_value = state.value | bit if value else state.value & ~bit
+            if new_value == state.value:
+                return
+            state = self.state = LineState(new_value, time.monotonic(), state.sequence + 1)
+            self.condition.notify_all()
+        self.edges.increment()
+        on_change = self.on_change
+        if on_change is not None:
+            on_change(state)
+
+    def get_state(self) -> LineState:
+        """Get the LineState: kept current by the edge callbacks in event mode, read from the pins otherwise."""
+        if self.events:
+            return self.state
+        return LineState(self.read_all_infrared(), time.monotonic(), self.state.sequence)
+
+    def wait_for_change(self, sequence: int, timeout: float = None) -> LineState:
+        """Wait until the state has changed since the given sequence number and return it; on timeout, return it unchanged."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.state.sequence != sequence, timeout)
+            return self.state
+
     def close(self) -> None:
         """Close each LineSensor object to release GPIO resources."""
+        self.disable_events()
         for sensor in self.sensors.values():
             sensor.close()
 
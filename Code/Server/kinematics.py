@@ -0,0 +1,104 @@
+import math
+try:
+    import numpy
+except ImportError:
+    numpy = None  # Batches are solved one setpoint at a time without it
+
+MAX_DUTY = 4095  # Largest duty the PCA9685 motor channels take
+
+# sin/cos of every integer degree; drive angles arrive from the clients as integers
+SIN_TABLE = tuple(math.sin(math.radians(degree)) for degree in range(360))
+COS_TABLE = tuple(math.cos(math.radians(degree)) for degree in range(360))
+if numpy is not None:
+    SIN_ARRAY = numpy.array(SIN_TABLE)
+    COS_ARRAY = numpy.array(COS_TABLE)
+
+def sin_cos(angle) -> tuple:
+    """Get (sin, cos) of an angle in degrees, from the tables when it is a whole number of degrees."""
+    if angle.__class__ is int:
+        angle %= 360
+        return SIN_TABLE[angle], COS_TABLE[angle]
+    radians = math.radians(angle)
+    return math.sin(radians), math.cos(radians)
+
+def saturate(duties, limit: int = MAX_DUTY) -> tuple:
+    """Scale all wheel duties down together when one exceeds the limit, so the direction of motion is kept."""
+    peak = max(max(duties), -min(duties))
+    if peak > limit:
+        ratio = limit / peak
+        return tuple([round(duty * ratio) for duty in duties])
+    return tuple([round(duty) for duty in duties])
+
+class MecanumDrive:
+    def __init__(self, limit: int = MAX_DUTY):
+        """Mix translation and rotation into FL/BL/FR/BR duties for the mecanum wheels."""
+        self.limit = limit
+
+    def solve(self, vx: float, vy: float, w: float) -> tuple:
+        """Get (FL, BL, FR, BR) for a sideways speed vx, forward speed vy and rotation w."""
+        return saturate((vy + vx - w, vy - vx - w, vy - vx + w, vy + vx + w), self.limit)
+
+    def heading(self, angle, speed: float, w: float = 0) -> tuple:
+        """Get the duties for moving at speed towards angle (degrees, 0 is forward) while turning at w."""
+        sin, cos = sin_cos(angle)
+        return self.solve(-speed * sin, speed * cos, w)
+
+    def joystick(self, angle1, speed1: float, angle2, speed2: float) -> tuple:
+        """Get the duties for the two client joysticks: the left one translates, the right one rotates."""
+        sin1, cos1 = sin_cos(angle1)
+        sin2 = sin_cos(angle2)[0]
+        return self.solve(-speed1 * sin1, speed1 * cos1, speed2 * sin2)
+
+    def solve_many(self, setpoints) -> list:
+        """Get the duties for a batch of (angle1, speed1, angle2, speed2) joystick setpoints, e.g. a recorded trajectory."""
+        if numpy is None:
+            return [self.joystick(*setpoint) for setpoint in setpoints]
+        setpoints = numpy.asarray(setpoints, dtype=float).reshape(-1, 4)
+        angle1, speed1, angle2, speed2 = setpoints.T
+        if numpy.array_equal(angle1, numpy.round(angle1)) and numpy.array_equal(angle2, numpy.round(angle2)):
+            sin1 = SIN_ARRAY[angle1.astype(int) % 360]
+            cos1 = COS_ARRAY[angle1.astype(int) % 360]
+            sin2 = SIN_ARRAY[angle2.astype(int) % 360]
+        else:
+            sin1, cos1, sin2 = numpy.sin(numpy.radians(angle1)), numpy.cos(numpy.radians(angle1)), numpy.sin(numpy.radians(angle2))
+        vx, vy, w = -speed1 * sin1, speed1 * cos1, speed2 * sin2
+        duties = numpy.stack((vy + vx - w, vy - vx - w, vy - vx + w, vy + vx + w), axis=1)
+        peak = numpy.abs(duties).max(axis=1, keepdims=True)
+        duties *= numpy.where(peak > self.limit, self.limit / numpy.maximum(peak, 1), 1.0)
+        return [tuple(row) for row in numpy.rint(duties).astype(int).tolist()]
+
+class OrdinaryDrive:
+    def __init__(self, scale: float = 1.0, limit: int = MAX_DUTY):
+        """Scale and saturate FL/BL/FR/BR duties for the ordinary wheels, or mix them from a differential command."""
+        self.scale = scale  # Applied to every duty received, e.g. 0.8 to keep the client's full range gentle
+        self.limit = limit
+
+    def wheels(self, fl: float, bl: float, fr: float, br: float) -> tuple:
+        """Get the duties for four requested wheel duties."""
+        scale = self.scale
+        return saturate((round(fl * scale), round(bl * scale), round(fr * scale), round(br * scale)), self.limit)
+
+    def solve(self, vy: float, w: float) -> tuple:
+        """Get (FL, BL, FR, BR) for a forward speed vy and rotation w (positive turns left)."""
+        left, right = (vy - w) * self.scale, (vy + w) * self.scale
+        return saturate((left, left, right, right), self.limit)
+
+    def solve_many(self, setpoints) -> list:
+        """Get the duties for a batch of (FL, BL, FR, BR) setpoints."""
+        if numpy is None:
+            return [self.wheels(*setpoint) for setpoint in setpoints]
+        duties = numpy.rint(numpy.asarray(setpoints, dtype=float).reshape(-1, 4) * self.scale)
+        peak = numpy.abs(duties).max(axis=1, keepdims=True)
+        duties *= numpy.where(peak > self.limit, self.limit / numpy.maximum(peak, 1), 1.0)
+        return [tuple(row) for row in numpy.rint(duties).astype(int).tolist()]
+
+if __name__ == '__main__':
+    print('Program is starting ... ')
+    mecanum = MecanumDrive()
+    print("Forward:        {}".format(mecanum.joystick(0, 2000, 0, 0)))
+    print("Right:          {}".format(mecanum.joystick(-90, 2000, 0, 0)))
+    print("Turn in place:  {}".format(mecanum.joystick(0, 0, 90, 2000)))
+    print("Diagonal, full: {}".format(mecanum.joystick(45, 4095, 90, 4095)))  # Saturated, same direction
+    print("Batch:          {}".format(mecanum.solve_many([(0, 2000, 0, 0), (90, 2000, 0, 0)])))
+    ordinary = OrdinaryDrive(0.8)
+    print("Ordinary:       {}".format(ordinary.wheels(4095, 4095, -4095, -4095)))
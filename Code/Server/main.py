@@ -1,23 +1,24 @@
 import sys
 import argparse
-import struct
 import time
 import signal
-import math
 from PyQt5.QtWidgets import QMainWindow, QApplication
 from PyQt5.QtCore import QTimer
 from server_ui import Ui_server_ui
 from server import Server
 import threading
 import multiprocessing
-from message import Message_Parse
+from message import Message_Parse, parse_command
 from command import Command
 from led import Led
 from camera import Camera
 from car import Car
 from buzzer import Buzzer
-from Thread import stop_thread
-from threading import Thread
+from stats import registry
+from dispatcher import Dispatcher, Argument
+from pipeline import CommandPipeline, CommandQueue, PRIORITY, MOTION
+from telemetry import TelemetryScheduler, SENSOR_SONIC, SENSOR_LIGHT, SENSOR_LINE, SENSOR_POWER
+from scheduler import MotionTaskRunner, FixedRateLoop
 
 class mywindow(QMainWindow, Ui_server_ui):
     def __init__(self):
@@ -44,29 +45,45 @@ class mywindow(QMainWindow, Ui_server_ui):
         self.car = Car()
         self.buzzer = Buzzer()
         self.camera = Camera(stream_size=(400, 300))
-        self.queue_cmd = multiprocessing.Queue()
-        self.cmd_parse = Message_Parse()
         self.queue_led = multiprocessing.Queue()
         self.led_parse = Message_Parse()
+        # Subscribed sensors are read and pushed by one scheduler thread, only when the value has changed
+        self.telemetry = TelemetryScheduler(lambda message, client_address: self.tcp_server.send_data_to_command_client(message, client_address),
+                                            lambda: self.tcp_server.get_command_server_client_addresses())
+        self.telemetry.register_sensor(SENSOR_SONIC, self.read_sonic_data, self.format_sonic_data)
+        self.telemetry.register_sensor(SENSOR_LIGHT, self.read_light_data, self.format_light_data)
+        self.telemetry.register_sensor(SENSOR_LINE, self.read_line_data, self.format_line_data)
+        self.telemetry.register_sensor(SENSOR_POWER, self.read_power_data, self.format_power_data)
+        self.commands = registry.counter('commands')
+        self.parse_time = registry.histogram('parse')
+        registry.gauge('queue_led', self.queue_led.qsize)
 
-        self.cmd_thread = None
         self.video_thread = None
-        self.car_thread = None
         self.led_process = None
         self.action_process = None
         self.cmd_thread_is_running = False
         self.video_thread_is_running = False
-        self.car_thread_is_running = False
         self.led_process_is_running = False
         self.action_process_is_running = False
         self.car_mode = 1
-        self.rotation_flag = False
+        # Autonomous modes step at their configured rate on monotonic deadlines; manual mode leaves the loop idle
+        self.car_loop = FixedRateLoop('car')
+        self.car_mode_steps = {2: ('light', self.car_light_step), 3: ('infrared', self.car.mode_infrared),
+                               4: ('ultrasonic', self.car_ultrasonic_step)}
+        self.car.infrared.on_change = lambda state: self.car_loop.wake('infrared')  # Line following reacts to edges at once
+        self.motion = MotionTaskRunner()  # Runs CMD_CAR_ROTATE and other timed maneuvers; any new drive command cancels them
         self.send_sonic_data_time = time.time()
         self.send_light_data_time = time.time()
         self.send_line_data_time = time.time()
         self.led_mode = 0
+        self.dispatcher = Dispatcher()
+        self.register_commands()
+        # Framer -> bounded in-process queue -> parse -> coalesce -> dispatcher, on one thread that blocks while idle
+        # Stops take a priority lane past everything queued, and discard the motion setpoints queued before them
+        self.cmd_pipeline = CommandPipeline(self.dispatcher.dispatch, None, self.setpoint_key, self.classify_command)
 
     def stop_car(self):
+        self.motion.stop()
         self.led.colorBlink(0)
         self.camera.stop_stream()
         self.camera.close()
@@ -76,217 +93,216 @@ class mywindow(QMainWindow, Ui_server_ui):
         if self.label.text() == "Server Off":
             self.label.setText("Server On")
             self.Button_Server.setText("Off")
+            self.tcp_server.set_command_queue(CommandQueue(256, self.parse_command, self.classify_command))
             self.tcp_server.start_tcp_servers()
+            self.tcp_server.start_udp_server()
             self.set_threading_cmd_receive(True)
             self.set_threading_video_send(True)
             self.set_threading_car_task(True)
             self.set_process_led_running(True)
+            self.motion.start()
+            self.telemetry.start()
         elif self.label.text() == 'Server On':
             self.label.setText("Server Off")
             self.Button_Server.setText("On")
             self.tcp_server.stop_tcp_servers()
+            self.tcp_server.stop_udp_server()
             self.set_threading_cmd_receive(False)
             self.set_threading_video_send(False)
             self.set_threading_car_task(False)
             self.set_process_led_running(False)
+            self.motion.stop()
+            self.telemetry.stop()
             self.tcp_server = Server()
 
+    # Sensor readers return the samplers' newest snapshots without touching the hardware, or None if they are stale
+    def read_sonic_data(self):
+        sample = self.car.ranger.latest()
+        return None if sample is None else (sample.distance,)
+
+    def format_sonic_data(self, value):
+        return self.command.CMD_MODE + "#3#{:.2f}".format(*value) + "\n"
+
+    def read_light_data(self):
+        return self.car.read_light()
+
+    def format_light_data(self, value):
+        return self.command.CMD_MODE + "#2#{:.2f}#{:.2f}".format(*value) + "\n"
+
+    def read_line_data(self):
+        return self.car.read_line()
+
+    def format_line_data(self, value):
+        return self.command.CMD_MODE + "#4#{:.2f}#{:.2f}#{:.2f}".format(*value) + "\n"
+
+    def read_power_data(self):
+        power = self.car.read_power()
+        return None if power is None else (power,)
+
+    def format_power_data(self, value):
+        return self.command.CMD_POWER + "#" + str(value[0]) + "\n"
+
     def send_sonic_data(self):
         if time.time() - self.send_sonic_data_time > 0.5:
             self.send_sonic_data_time = time.time()
-            if self.tcp_server.get_command_server_busy() == False:
-                distance = self.car.sonic.get_distance()
-                cmd = self.command.CMD_MODE + "#3#{:.2f}".format(distance) + "\n"
+            value = self.read_sonic_data()
+            if value is not None and self.tcp_server.get_command_server_busy() == False:
+                cmd = self.format_sonic_data(value)
                 self.tcp_server.send_data_to_command_client(cmd)
                 #print(cmd)
 
     def send_light_data(self):
         if time.time() - self.send_light_data_time > 0.3:
             self.send_light_data_time = time.time()
-            if self.tcp_server.get_command_server_busy() == False:
-                adc_light_1 = self.car.adc.read_adc(0)
-                adc_light_2 = self.car.adc.read_adc(1)
-                cmd = self.command.CMD_MODE + "#2#{:.2f}#{:.2f}".format(adc_light_1, adc_light_2) + "\n" 
+            value = self.read_light_data()
+            if value is not None and self.tcp_server.get_command_server_busy() == False:
+                cmd = self.format_light_data(value)
                 self.tcp_server.send_data_to_command_client(cmd)
                 #print(cmd)
     def send_line_data(self):
         if time.time() - self.send_line_data_time > 0.3:
             self.send_line_data_time = time.time()
-            if self.tcp_server.get_command_server_busy() == False:
-                ir_value_1 = self.car.infrared.read_one_infrared(1)
-                ir_value_2 = self.car.infrared.read_one_infrared(2)
-                ir_value_3 = self.car.infrared.read_one_infrared(3)
-                cmd = self.command.CMD_MODE + "#4#{:.2f}#{:.2f}#{:.2f}".format(ir_value_1, ir_value_2, ir_value_3) + "\n"
+            value = self.read_line_data()
+            if value is not None and self.tcp_server.get_command_server_busy() == False:
+                cmd = self.format_line_data(value)
                 self.tcp_server.send_data_to_command_client(cmd)
                 #print(cmd)
     def send_power_data(self):
-        if self.tcp_server.get_command_server_busy() == False:
-            power = self.car.adc.read_adc(2) * (3 if self.car.adc.pcb_version == 1 else 2)
-            cmd = self.command.CMD_POWER + "#" + str(power) + "\n"
+        value = self.read_power_data()
+        if value is not None and self.tcp_server.get_command_server_busy() == False:
+            cmd = self.format_power_data(value)
             self.tcp_server.send_data_to_command_client(cmd)
             #print(cmd)
 
     def set_threading_cmd_receive(self, state, close_time=0.3):
-        if self.cmd_thread is None:
-            buf_state = False
-        else:
-            buf_state = self.cmd_thread.is_alive()
-        if state != buf_state:
+        if state != self.cmd_pipeline.is_running():
             if state:
                 self.cmd_thread_is_running = True
-                self.cmd_thread = threading.Thread(target=self.threading_cmd_receive)
-                self.cmd_thread.start()
+                self.cmd_pipeline.start(self.tcp_server.read_data_from_command_server())
             else:
                 self.cmd_thread_is_running = False
-                if self.cmd_thread is not None:
-                    self.cmd_thread.join(close_time)
-                    self.cmd_thread = None
-
-    def threading_cmd_receive(self):
-        while self.cmd_thread_is_running:
-            cmd_queue = self.tcp_server.read_data_from_command_server()
-            if cmd_queue.qsize() > 0:
-                client_address, all_message = cmd_queue.get()
-                main_message = all_message.strip()
-                if "\n" in main_message:
-                    for msg in main_message.split("\n"):
-                        self.queue_cmd.put(msg)
-                else:
-                    self.queue_cmd.put(main_message)
-            while not self.queue_cmd.empty():
-                msg = self.queue_cmd.get()
-                self.cmd_parse.clear_parameters()
-                self.cmd_parse.parse(msg)
-                print("{}".format(self.cmd_parse.input_string))
-                if self.cmd_parse.command_string == self.command.CMD_LED:
-                    self.queue_led.put(msg)
-                elif self.cmd_parse.command_string == self.command.CMD_LED_MOD:
-                    self.queue_led.put(msg)
-                else:
-                    if self.cmd_parse.command_string == self.command.CMD_SONIC:
-                        self.send_sonic_data()
-                    elif self.cmd_parse.command_string == self.command.CMD_LIGHT:
-                        self.send_light_data()
-                    elif self.cmd_parse.command_string == self.command.CMD_LINE:
-                        self.send_line_data()
-                    elif self.cmd_parse.command_string == self.command.CMD_POWER:
-                        self.send_power_data()
-                    elif self.cmd_parse.command_string == self.command.CMD_BUZZER:
-                        self.buzzer.set_state(self.cmd_parse.int_parameter[0])
-                    elif self.cmd_parse.command_string == self.command.CMD_SERVO:
-                        try:
-                            print(len(self.cmd_parse.int_parameter))
-                            data1 = str(self.cmd_parse.int_parameter[0])
-                            data2 = int(self.cmd_parse.int_parameter[1])
-                            print(data1, data2)
-                            if data1 == None or data2 == None:
-                                continue
-                            self.car.servo.set_servo_pwm(data1, data2)
-                        except Exception as e:
-                            print(e)
-                    elif self.cmd_parse.command_string == self.command.CMD_MOTOR:
-                        self.car_mode = 1
-                        try:
-                            duty = [int(self.cmd_parse.int_parameter[i]) for i in range(4)]
-                            if duty[0] == None or duty[1]== None or duty[2] == None or duty[3] == None:
-                                continue
-                            scale_factor = 0.8
-                            scaled_duty = [int(round(d * scale_factor)) for d in duty]
-                            self.car.motor.set_motor_model(scaled_duty[0], scaled_duty[1], scaled_duty[2], scaled_duty[3])
-                        except:
-                            pass
-                    elif self.cmd_parse.command_string == self.command.CMD_M_MOTOR:
-                        self.car_mode = 1
-                        duty = [int(self.cmd_parse.int_parameter[i]) for i in range(4)]
-                        LX = -int((duty[1] * math.sin(math.radians(duty[0]))))
-                        LY = int(duty[1] * math.cos(math.radians(duty[0])))
-                        RX = int(duty[3] * math.sin(math.radians(duty[2])))
-                        RY = int(duty[3] * math.cos(math.radians(duty[2])))
-                        FR = LY - LX + RX
-                        FL = LY + LX - RX
-                        BL = LY - LX - RX
-                        BR = LY + LX + RX
-                        if duty[0] == None or duty[1]== None or duty[2] == None or duty[3] == None:
-                            continue
-                        self.car.motor.set_motor_model(FL, BL, FR, BR)
-                    elif self.cmd_parse.command_string == self.command.CMD_CAR_ROTATE:
-                        try:
-                            self.car_mode = 1
-                            duty = [int(self.cmd_parse.int_parameter[i]) for i in range(4)]
-                            if duty[3] == 0:
-                                try:
-                                    stop_thread(Rotate_Mode)
-                                    self.rotation_flag = False
-                                except:
-                                    pass
-                                LX = -int((duty[1] * math.sin(math.radians(duty[0]))))
-                                LY = int(duty[1] * math.cos(math.radians(duty[0])))
-                                RX = int(duty[3] * math.sin(math.radians(duty[2])))
-                                RY = int(duty[3] * math.cos(math.radians(duty[2])))
-                                FR = LY - LX + RX
-                                FL = LY + LX - RX
-                                BL = LY - LX - RX
-                                BR = LY + LX + RX
-                                if duty[0] == None or duty[1]== None or duty[2] == None:
-                                    continue
-                                self.car.motor.set_motor_model(FL, BL, FR, BR)
-                            elif self.rotation_flag == False:
-                                try:
-                                    stop_thread(self.Rotate_Mode)
-                                except:
-                                    pass
-                                self.rotation_flag = True
-                                Rotate_Mode = Thread(target=self.car.mode_rotate, args=(duty[2],))
-                                Rotate_Mode.start()
-                        except Exception as e:
-                            print(e)
-                    elif self.cmd_parse.command_string == self.command.CMD_MODE:
-                        if self.cmd_parse.int_parameter[0] == 0:
-                            self.car_mode = 1
-                            self.car.motor.set_motor_model(0, 0, 0, 0)
-                            print("Car Mode: Manual Car")
-                        elif self.cmd_parse.int_parameter[0] == 1:
-                            self.car_mode = 2
-                            print("Car Mode: Light Car")
-                        elif self.cmd_parse.int_parameter[0] == 2:
-                            self.car_mode = 3
-                            print("Car Mode: Infrared Car")
-                        elif self.cmd_parse.int_parameter[0] == 3:
-                            self.car_mode = 4
-                            print("Car Mode: Ultrasonic Car")
-                    
-            if self.queue_cmd.empty():
-                time.sleep(0.001)
+                self.cmd_pipeline.stop(close_time)
+
+    def register_commands(self):
+        # Every command the server accepts, with the arguments it takes; anything else is rejected before a handler runs
+        speed = lambda name: Argument(name, -4095, 4095)
+        angle = lambda name: Argument(name, -360, 360)
+        colour = lambda name: Argument(name, 0, 255)
+        self.dispatcher.register(self.command.CMD_LED, self.on_led, [colour('index'), colour('red'), colour('green'), colour('blue')])
+        self.dispatcher.register(self.command.CMD_LED_MOD, self.on_led_mod, [Argument('mode', 0, 5)])
+        self.dispatcher.register(self.command.CMD_SONIC, lambda client_address: self.send_sonic_data())
+        self.dispatcher.register(self.command.CMD_LIGHT, lambda client_address: self.send_light_data())
+        self.dispatcher.register(self.command.CMD_LINE, lambda client_address: self.send_line_data())
+        self.dispatcher.register(self.command.CMD_POWER, lambda client_address: self.send_power_data())
+        self.dispatcher.register(self.command.CMD_STATS, self.on_stats)
+        # CMD_SUBSCRIBE#<sensor>#<period ms, 0 to stop>#<deadband in hundredths>
+        self.dispatcher.register(self.command.CMD_SUBSCRIBE, self.telemetry.subscribe,
+                                 [Argument('sensor', 0, 3), Argument('period_ms', 0, 60000), Argument('deadband', 0, 100000, default=0, required=False)])
+        self.dispatcher.register(self.command.CMD_BUZZER, lambda client_address, state: self.buzzer.set_state(state), [Argument('state', 0, 1)])
+        self.dispatcher.register(self.command.CMD_SERVO, self.on_servo, [Argument('channel', 0, 7), Argument('angle', 0, 180)])
+        self.dispatcher.register(self.command.CMD_MOTOR, self.on_motor, [speed('duty1'), speed('duty2'), speed('duty3'), speed('duty4')])
+        self.dispatcher.register(self.command.CMD_M_MOTOR, self.on_m_motor, [angle('angle1'), speed('speed1'), angle('angle2'), speed('speed2')])
+        self.dispatcher.register(self.command.CMD_CAR_ROTATE, self.on_car_rotate, [angle('angle1'), speed('speed1'), angle('angle2'), speed('speed2')])
+        self.dispatcher.register(self.command.CMD_MODE, self.on_mode, [Argument('mode', 0, 3)])
+
+    def on_led(self, client_address, index, red, green, blue):
+        # LED commands are handled by the LED process
+        self.queue_led.put((self.command.CMD_LED, [index, red, green, blue]))
+
+    def on_led_mod(self, client_address, mode):
+        self.queue_led.put((self.command.CMD_LED_MOD, [mode]))
+
+    def on_stats(self, client_address):
+        self.tcp_server.send_data_to_command_client(registry.format_snapshot(self.command.CMD_STATS), client_address)
+
+    def on_servo(self, client_address, channel, angle):
+        self.car.servo.set_servo_pwm(str(channel), angle)
+        if channel == 0:
+            self.car.ranger.aim(angle)  # Echoes are tagged with where the sensor points
+
+    def on_motor(self, client_address, duty1, duty2, duty3, duty4):
+        self.set_car_mode(1)
+        self.motion.cancel()
+        self.car.motor.set_motor_model(*self.car.ordinary.wheels(duty1, duty2, duty3, duty4))
+
+    def set_mecanum_motor(self, angle1, speed1, angle2, speed2):
+        self.car.motor.set_motor_model(*self.car.mecanum.joystick(angle1, speed1, angle2, speed2))
+
+    def on_m_motor(self, client_address, angle1, speed1, angle2, speed2):
+        self.set_car_mode(1)
+        self.motion.cancel()
+        self.set_mecanum_motor(angle1, speed1, angle2, speed2)
+
+    def on_car_rotate(self, client_address, angle1, speed1, angle2, speed2):
+        self.set_car_mode(1)
+        if speed2 == 0:
+            self.motion.cancel()
+            self.set_mecanum_motor(angle1, speed1, angle2, speed2)
+        elif self.motion.get_task_name() != 'rotate':
+            self.motion.start_task(self.car.rotate_steps(angle2), 'rotate')
+
+    def on_mode(self, client_address, mode):
+        self.motion.cancel()
+        if mode == 0:
+            self.set_car_mode(1)
+            self.car.motor.set_motor_model(0, 0, 0, 0)
+            print("Car Mode: Manual Car")
+        elif mode == 1:
+            self.set_car_mode(2)
+            print("Car Mode: Light Car")
+        elif mode == 2:
+            self.set_car_mode(3)
+            print("Car Mode: Infrared Car")
+        elif mode == 3:
+            self.set_car_mode(4)
+            print("Car Mode: Ultrasonic Car")
+
+    def parse_command(self, msg):
+        # Runs on the network threads as commands are queued; parse_command keeps no shared state
+        start = time.perf_counter()
+        parsed = parse_command(msg)
+        self.parse_time.record(time.perf_counter() - start)
+        self.commands.increment()
+        return parsed
+
+    def classify_command(self, command, parameters):
+        # Zero-velocity drive commands and manual mode are stops; other drive commands and the autonomous
+        # modes are motion, so a stop discards any queued before it instead of running ahead of them
+        if command in (self.command.CMD_MOTOR, self.command.CMD_M_MOTOR, self.command.CMD_CAR_ROTATE):
+            speeds = parameters if command == self.command.CMD_MOTOR else parameters[1::2]
+            return PRIORITY if len(parameters) >= 4 and not any(speeds) else MOTION
+        if command == self.command.CMD_MODE and parameters:
+            return PRIORITY if parameters[0] == 0 else MOTION
+        return None
+
+    def setpoint_key(self, command, parameters):
+        # Queued setpoints for the same actuator are coalesced, only the newest one is applied
+        if command in (self.command.CMD_MOTOR, self.command.CMD_M_MOTOR, self.command.CMD_CAR_ROTATE):
+            return 'motor'
+        if command == self.command.CMD_SERVO and parameters:
+            return ('servo', parameters[0])
+        return None
+
+    def set_car_mode(self, car_mode):
+        # Waits for a mode step in progress, so a manual command is never overwritten by it
+        self.car_mode = car_mode
+        name, step = self.car_mode_steps.get(car_mode, (None, None))
+        self.car_loop.set_step(step, self.car.mode_frequency.get(name, 0), name)
+
+    def car_light_step(self):
+        self.car.mode_light()
+        self.send_light_data()
+
+    def car_ultrasonic_step(self):
+        self.car.mode_ultrasonic()
+        self.send_sonic_data()
 
     def set_threading_car_task(self, state, close_time=0.3):
-        if self.car_thread is None:
-            buf_state = False
+        if state:
+            self.car_loop.start()
+            self.set_car_mode(self.car_mode)
         else:
-            buf_state = self.car_thread.is_alive()
-        if state != buf_state:
-            if state:
-                self.car_thread_is_running = True
-                self.car_thread = threading.Thread(target=self.threading_car_task)
-                self.car_thread.start()
-            else:
-                self.car_thread_is_running = False
-                if self.car_thread is not None:
-                    self.car_thread.join(close_time)
-                    self.car_thread = None
-
-    def threading_car_task(self):
-        while self.car_thread_is_running:
-            if self.car_mode == 1:
-                pass
-            elif self.car_mode == 2:
-                self.car.mode_light()
-                self.send_light_data()
-            elif self.car_mode == 3:
-                self.car.mode_infrared()
-            elif self.car_mode == 4:
-                self.car.mode_ultrasonic()
-                self.send_sonic_data()
-            time.sleep(0.01)
+            self.car_loop.stop(close_time)
 
 
     def set_threading_video_send(self, state, close_time=0.3):
@@ -311,11 +327,9 @@ class mywindow(QMainWindow, Ui_server_ui):
                 self.camera.start_stream()
                 while self.tcp_server.is_video_server_connected():
                     frame = self.camera.get_frame()
-                    lenFrame = len(frame)
-                    lengthBin = struct.pack('<I', lenFrame)
                     try:
-                        self.tcp_server.send_data_to_video_client(lengthBin)
-                        self.tcp_server.send_data_to_video_client(frame)
+                        # Every viewer gets the newest frame; capture never waits for a slow one
+                        self.tcp_server.send_video_frame(frame)
                     except:
                         break
                 self.camera.stop_stream()
@@ -399,16 +413,14 @@ class mywindow(QMainWindow, Ui_server_ui):
         self.set_threading_video_send(False)
         self.set_threading_car_task(False)
         self.set_process_led_running(False)
+        self.telemetry.stop()
         if self.tcp_server:
             self.tcp_server.stop_tcp_servers()
+            self.tcp_server.stop_udp_server()
             self.tcp_server = None
         self.stop_car()
-        if self.cmd_thread and self.cmd_thread.is_alive():
-            self.cmd_thread.join(0.1)
         if self.video_thread and self.video_thread.is_alive():
             self.video_thread.join(0.1)
-        if self.car_thread and self.car_thread.is_alive():
-            self.car_thread.join(0.1)
         if self.led_process and self.led_process.is_alive():
             self.led_process.terminate()
             self.led_process.join(0.1)
@@ -430,11 +442,14 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Freenove 4WD Smart Car Server')
     parser.add_argument('-t', '--terminal', action='store_true', help='Run in terminal mode (no GUI)')
     parser.add_argument('-n', '--no-gui', action='store_true', help='Run in terminal mode (no GUI)')
+    parser.add_argument('-s', '--stats-interval', type=float, default=0, help='Log server statistics every N seconds (0 disables)')
     
     args = parser.parse_args()
     
     # Check if either flag is set
     headless_mode = args.terminal or args.no_gui
+    if args.stats_interval > 0:
+        registry.start_logging(args.stats_interval)
     if headless_mode:
         # Run in headless mode - only start server functionality
         app = QApplication(sys.argv)
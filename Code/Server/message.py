@@ -1,4 +1,67 @@
 import queue
+from collections import namedtuple
+
+# Immutable result of parse_command: the command token and its integer parameters
+ParsedMessage = namedtuple('ParsedMessage', ['command', 'parameters'])
+
+# Mode names the client buttons send, with the values they stand for
+WORD_PARAMETERS = {'one': 0, 'two': 1, 'three': 3, 'four': 2}
+_new_parsed = tuple.__new__  # Builds a ParsedMessage without the keyword handling of its constructor
+
+def parse_parameter(x: str) -> int:
+    """Convert one parameter the way Message_Parse does: numbers are rounded, known words mapped, anything else is 0."""
+    try:
+        return int(x)
+    except ValueError:
+        try:
+            return round(float(x))
+        except (ValueError, OverflowError):
+            return WORD_PARAMETERS.get(x, 0)
+
+def parse_command(msg) -> ParsedMessage:
+    """
+    Parse one message into a ParsedMessage without touching any shared parser state.
+    Parameters:
+    msg (str | tuple): A 'CMD_XXX#a#b...' line, or a (command, parameters) tuple decoded from a binary frame.
+    Returns:
+    ParsedMessage: The command and a tuple of integer parameters, or None for an empty message.
+    """
+    if msg.__class__ is tuple:
+        return _new_parsed(ParsedMessage, (msg[0], tuple(msg[1])))
+    command, separator, rest = msg.strip().partition('#')
+    if not command:
+        return None
+    if not rest:
+        return _new_parsed(ParsedMessage, (command, ()))
+    fields = rest.rstrip('#').split('#')
+    try:
+        # Fast path: drive, servo and LED commands carry plain integers, converted in one pass
+        values = tuple(map(int, fields))
+    except ValueError:
+        values = tuple(map(parse_parameter, [x for x in fields if x]))
+    return _new_parsed(ParsedMessage, (command, values))
+
+def parse_buffer(buffer) -> list:
+    """Parse every complete line of a received buffer (str or bytes) into a list of ParsedMessage."""
+    if isinstance(buffer, (bytes, bytearray, memoryview)):
+        buffer = bytes(buffer).decode('utf-8', errors='replace')
+    messages = []
+    append = messages.append
+    # parse_command inlined for text lines: one call per buffer instead of one per line
+    for line in buffer.split('\n'):
+        command, separator, rest = line.strip().partition('#')
+        if not command:
+            continue
+        if not rest:
+            append(_new_parsed(ParsedMessage, (command, ())))
+            continue
+        fields = rest.rstrip('#').split('#')
+        try:
+            values = tuple(map(int, fields))
+        except ValueError:
+            values = tuple(map(parse_parameter, [x for x in fields if x]))
+        append(_new_parsed(ParsedMessage, (command, values)))
+    return messages
 
 class Message_Parse:
     def __init__(self):
@@ -19,12 +82,18 @@ class Message_Parse:
         """
         Parse the input message and extract command and parameters.
         Parameters:
-        msg (str): The input message to parse.
+        msg (str | tuple): The input message to parse, or a (command, parameters) tuple decoded from a binary frame.
         Returns:
         bool: True if parsing is successful, False otherwise.
         """
         try:
             self.clear_parameters()                              # Clear any existing parameters
+            if isinstance(msg, tuple):
+                # Binary frames are already split and converted, only the fields need filling in
+                self.input_string = msg
+                self.command_string, self.int_parameter = msg[0], list(msg[1])
+                self.string_parameter = [self.command_string] + [str(x) for x in self.int_parameter]
+                return True
             self.input_string = msg.strip()                      # Remove leading and trailing whitespace from the input message
             self.string_parameter = self.input_string.split("#")  # Split the input string by '#' to get parameters
             self.command_string = self.string_parameter[0]        # The first element is the command string
@@ -77,4 +146,7 @@ if __name__ == '__main__':
             else:
                 print("msg.input_string: {}".format(msg_parse.input_string))          # Print the raw input string
 
+    print("parse_command: {}".format(parse_command("CMD_MODE#one")))      # Word parameters map to their values
+    print("parse_buffer: {}".format(parse_buffer(b"CMD_MOTOR#0#0#0#0\nCMD_SERVO#0#90.4\n")))  # Several lines in one call
+
     print("Test end")  # Indicate the end of the test
\ No newline at end of file
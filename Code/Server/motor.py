@@ -1,10 +1,12 @@
 import time
-from pca9685 import PCA9685
+from pca9685 import get_pca9685
+from stats import registry
 
 class Ordinary_Car:
     def __init__(self):
-        self.pwm = PCA9685(0x40, debug=True)
+        self.pwm = get_pca9685(0x40)  # Shared with the servos: one bus lock and shadow copy
         self.pwm.set_pwm_freq(50)
+        self.write_time = registry.histogram('motor.write')
     def duty_range(self, duty1, duty2, duty3, duty4):
         if duty1 > 4095:
             duty1 = 4095
@@ -23,52 +25,32 @@ class Ordinary_Car:
         elif duty4 < -4095:
             duty4 = -4095
         return duty1,duty2,duty3,duty4
-    def left_upper_wheel(self,duty):
+    def wheel_pwm(self, duty, reverse_channel, forward_channel):
+        # The two channel duties driving one wheel; a duty of 0 brakes with both channels full on
         if duty>0:
-            self.pwm.set_motor_pwm(0,0)
-            self.pwm.set_motor_pwm(1,duty)
+            return {reverse_channel: 0, forward_channel: duty}
         elif duty<0:
-            self.pwm.set_motor_pwm(1,0)
-            self.pwm.set_motor_pwm(0,abs(duty))
+            return {forward_channel: 0, reverse_channel: abs(duty)}
         else:
-            self.pwm.set_motor_pwm(0,4095)
-            self.pwm.set_motor_pwm(1,4095)
+            return {reverse_channel: 4095, forward_channel: 4095}
+    def left_upper_wheel(self,duty):
+        self.pwm.set_motor_pwm_many(self.wheel_pwm(duty,0,1))
     def left_lower_wheel(self,duty):
-        if duty>0:
-            self.pwm.set_motor_pwm(3,0)
-            self.pwm.set_motor_pwm(2,duty)
-        elif duty<0:
-            self.pwm.set_motor_pwm(2,0)
-            self.pwm.set_motor_pwm(3,abs(duty))
-        else:
-            self.pwm.set_motor_pwm(2,4095)
-            self.pwm.set_motor_pwm(3,4095)
+        self.pwm.set_motor_pwm_many(self.wheel_pwm(duty,3,2))
     def right_upper_wheel(self,duty):
-        if duty>0:
-            self.pwm.set_motor_pwm(6,0)
-            self.pwm.set_motor_pwm(7,duty)
-        elif duty<0:
-            self.pwm.set_motor_pwm(7,0)
-            self.pwm.set_motor_pwm(6,abs(duty))
-        else:
-            self.pwm.set_motor_pwm(6,4095)
-            self.pwm.set_motor_pwm(7,4095)
+        self.pwm.set_motor_pwm_many(self.wheel_pwm(duty,6,7))
     def right_lower_wheel(self,duty):
-        if duty>0:
-            self.pwm.set_motor_pwm(4,0)
-            self.pwm.set_motor_pwm(5,duty)
-        elif duty<0:
-            self.pwm.set_motor_pwm(5,0)
-            self.pwm.set_motor_pwm(4,abs(duty))
-        else:
-            self.pwm.set_motor_pwm(4,4095)
-            self.pwm.set_motor_pwm(5,4095)
+        self.pwm.set_motor_pwm_many(self.wheel_pwm(duty,4,5))
     def set_motor_model(self, duty1, duty2, duty3, duty4):
         duty1,duty2,duty3,duty4=self.duty_range(duty1,duty2,duty3,duty4)
-        self.left_upper_wheel(duty1)
-        self.left_lower_wheel(duty2)
-        self.right_upper_wheel(duty3)
-        self.right_lower_wheel(duty4)
+        start = time.perf_counter()
+        # Channels 0-7 are consecutive, so all four wheels go out in one auto-increment block write
+        duties = self.wheel_pwm(duty1,0,1)
+        duties.update(self.wheel_pwm(duty2,3,2))
+        duties.update(self.wheel_pwm(duty3,6,7))
+        duties.update(self.wheel_pwm(duty4,4,5))
+        self.pwm.set_motor_pwm_many(duties)
+        self.write_time.record(time.perf_counter() - start)
 
     def close(self):
         self.set_motor_model(0,0,0,0)
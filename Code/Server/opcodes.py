@@ -0,0 +1,19 @@
+# Opcode, command and number of int16 arguments of each binary command.
+# The one definition of the binary command set: protocol.py builds the server's frame layouts from it,
+# and Code/Client/Protocol.py and webapp/server/main.py load this file by path, so it imports nothing.
+OPCODES = {
+    0x01: ("CMD_MOTOR", 4),
+    0x02: ("CMD_M_MOTOR", 4),
+    0x03: ("CMD_CAR_ROTATE", 4),
+    0x04: ("CMD_SERVO", 2),
+    0x05: ("CMD_LED", 4),
+    0x06: ("CMD_LED_MOD", 1),
+    0x07: ("CMD_BUZZER", 1),
+    0x08: ("CMD_MODE", 1),
+    0x09: ("CMD_SONIC", 1),
+    0x0A: ("CMD_LIGHT", 1),
+    0x0B: ("CMD_LINE", 1),
+    0x0C: ("CMD_POWER", 0),
+    0x0D: ("CMD_SUBSCRIBE", 3),
+    0x0E: ("CMD_STATS", 0),
+}
@@ -2,12 +2,20 @@
 
 import time
 import math
-import smbus
+import threading
+from i2c_bus import get_bus, I2CBus
+from stats import registry
 
 # ============================================================================
 # Raspi PCA9685 16-Channel PWM Servo Driver
 # ============================================================================
 
+class PendingWrite:
+    def __init__(self):
+        """Channel updates queued by callers waiting for the bus, written together by whichever of them gets it first."""
+        self.settings = {}  # channel -> (on, off)
+        self.error = None   # OSError of the write that carried them, re-raised to every caller that queued into it
+
 class PCA9685:
     # Registers/etc.
     __SUBADR1            = 0x02
@@ -23,58 +31,186 @@ class PCA9685:
     __ALLLED_ON_H        = 0xFB
     __ALLLED_OFF_L       = 0xFC
     __ALLLED_OFF_H       = 0xFD
+    __MODE1_AI           = 0x20  # Register auto-increment: one block write fills consecutive registers
+    __BLOCK_CHANNELS     = 8     # An SMBus block write carries at most 32 bytes, i.e. 8 channels of 4 registers
 
-    def __init__(self, address: int = 0x40, debug: bool = False):
-        self.bus = smbus.SMBus(1)
+    def __init__(self, address: int = 0x40, debug: bool = False, bus=None):
+        self.bus = bus if bus is not None else get_bus(1)
+        # Held across multi-step sequences and block runs; on a shared bus it is the bus lock itself
+        self.lock = self.bus.transaction() if isinstance(self.bus, I2CBus) else threading.RLock()
         self.address = address
         self.debug = debug
-        self.write(self.__MODE1, 0x00)
+        self.users = 1         # Holders from get_pca9685(); the bus is released when the last one closes it
+        self.frequency = None  # Last PWM frequency set
+        self.pending = PendingWrite()  # Updates queued by callers waiting for the bus
+        self.pending_lock = threading.Lock()
+        self.combined = registry.counter('pca9685.combined')  # Updates carried to the chip by another caller's write
+        self.shadow = {}  # channel -> (on, off) last written; channels not in it are unknown and always written
+        self.shadow_hits = registry.counter('pca9685.shadow_hits')      # Channel writes skipped because nothing changed
+        self.shadow_misses = registry.counter('pca9685.shadow_misses')  # Channel writes sent to the bus
+        self.bus_errors = registry.counter('pca9685.bus_errors')
+        self.write(self.__MODE1, self.__MODE1_AI)
     
     def write(self, reg: int, value: int) -> None:
         """Writes an 8-bit value to the specified register/address."""
-        self.bus.write_byte_data(self.address, reg, value)
+        with self.lock:
+            self.bus.write_byte_data(self.address, reg, value)
       
     def read(self, reg: int) -> int:
         """Read an unsigned byte from the I2C device."""
-        result = self.bus.read_byte_data(self.address, reg)
-        return result
+        with self.lock:
+            return self.bus.read_byte_data(self.address, reg)
     
     def set_pwm_freq(self, freq: float) -> None:
-        """Sets the PWM frequency."""
+        """Sets the PWM frequency; nothing is done if it is already set, as setting it sleeps the chip."""
+        if freq == self.frequency:
+            return
         prescaleval = 25000000.0    # 25MHz
         prescaleval /= 4096.0       # 12-bit
         prescaleval /= float(freq)
         prescaleval -= 1.0
         prescale = math.floor(prescaleval + 0.5)
 
-        oldmode = self.read(self.__MODE1)
-        newmode = (oldmode & 0x7F) | 0x10        # sleep
-        self.write(self.__MODE1, newmode)        # go to sleep
-        self.write(self.__PRESCALE, int(math.floor(prescale)))
-        self.write(self.__MODE1, oldmode)
-        time.sleep(0.005)
-        self.write(self.__MODE1, oldmode | 0x80)
-
-
-    def set_pwm(self, channel: int, on: int, off: int) -> None:
-        """Sets a single PWM channel."""
-        self.write(self.__LED0_ON_L + 4 * channel, on & 0xFF)
-        self.write(self.__LED0_ON_H + 4 * channel, on >> 8)
-        self.write(self.__LED0_OFF_L + 4 * channel, off & 0xFF)
-        self.write(self.__LED0_OFF_H + 4 * channel, off >> 8)
+        with self.lock:
+            oldmode = self.read(self.__MODE1)
+            newmode = (oldmode & 0x7F) | 0x10        # sleep
+            self.write(self.__MODE1, newmode)        # go to sleep
+            self.write(self.__PRESCALE, int(math.floor(prescale)))
+            self.write(self.__MODE1, oldmode)
+            time.sleep(0.005)
+            self.write(self.__MODE1, oldmode | 0x80)
+            self.frequency = freq
+
+
+    def write_block(self, channels: list, settings: dict) -> None:
+        """Write consecutive channels in one block and record them in the shadow copy; a failed write forgets them."""
+        data = []
+        for channel in channels:
+            on, off = settings[channel]
+            data += [on & 0xFF, on >> 8, off & 0xFF, off >> 8]
+        try:
+            self.bus.write_i2c_block_data(self.address, self.__LED0_ON_L + 4 * channels[0], data)
+        except OSError:
+            # The chip may hold old or partly written values now; write these channels again next time
+            self.bus_errors.increment()
+            for channel in channels:
+                self.shadow.pop(channel, None)
+            raise
+        self.shadow_misses.increment(len(channels))
+        for channel in channels:
+            self.shadow[channel] = settings[channel]
+
+    def set_pwm(self, channel: int, on: int, off: int, force: bool = False) -> None:
+        """Sets a single PWM channel; nothing is sent if it already has these values."""
+        self.set_pwm_many({channel: (on, off)}, force)
+
+    def set_pwm_many(self, settings: dict, force: bool = False) -> None:
+        """Sets several PWM channels from {channel: (on, off)}, one block write per run of consecutive changed channels.
+
+        Updates queued by callers waiting for the bus are written together by whichever of them gets it first."""
+        if force:
+            with self.lock:
+                self.write_runs(settings)
+            return
+        with self.pending_lock:
+            pending = self.pending
+            pending.settings.update(settings)
+        with self.lock:
+            with self.pending_lock:
+                taken = pending is self.pending
+                if taken:
+                    self.pending = PendingWrite()
+            if not taken:
+                # Written while this caller waited for the bus; its outcome is this caller's too
+                self.combined.increment()
+                if pending.error is not None:
+                    raise pending.error
+                return
+            settings = pending.settings
+            changed = {channel: value for channel, value in settings.items() if self.shadow.get(channel) != value}
+            if len(changed) < len(settings):
+                self.shadow_hits.increment(len(settings) - len(changed))
+            try:
+                self.write_runs(changed)
+            except OSError as e:
+                pending.error = e
+                raise
+
+    def write_runs(self, settings: dict) -> None:
+        """Write {channel: (on, off)} as one block per run of at most 8 consecutive channels."""
+        channels = sorted(settings)
+        start = 0
+        while start < len(channels):
+            end = start + 1
+            while end < len(channels) and end - start < self.__BLOCK_CHANNELS and channels[end] == channels[end - 1] + 1:
+                end += 1
+            self.write_block(channels[start:end], settings)
+            start = end
+
+    def set_all_pwm(self, on: int, off: int) -> None:
+        """Sets all 16 channels at once through the ALL_LED registers."""
+        with self.lock:
+            self.shadow.clear()  # Unknown if the write fails
+            self.bus.write_i2c_block_data(self.address, self.__ALLLED_ON_L, [on & 0xFF, on >> 8, off & 0xFF, off >> 8])
+            self.shadow_misses.increment(16)
+            self.shadow = {channel: (on, off) for channel in range(16)}
+
+    def invalidate(self) -> None:
+        """Forget the shadow copy, e.g. after the chip was reset; every channel is written on its next update."""
+        self.shadow.clear()
+
+    def resync(self) -> None:
+        """Write every shadowed channel again, e.g. after a bus error may have left the chip out of step."""
+        with self.lock:
+            self.set_pwm_many(dict(self.shadow), force=True)
+
+    def get_cache_stats(self) -> dict:
+        """Get the shadow hits and misses, the hit rate, the bus bytes the hits saved and the combined updates."""
+        hits, misses = self.shadow_hits.get(), self.shadow_misses.get()
+        return {'hits': hits, 'misses': misses, 'hit_rate': round(hits / (hits + misses), 3) if hits + misses else 0.0,
+                'bytes_saved': hits * 4, 'bus_errors': self.bus_errors.get(), 'combined': self.combined.get()}
+
     def set_motor_pwm(self, channel: int, duty: int) -> None:
         """Sets the PWM duty cycle for a motor."""
         self.set_pwm(channel, 0, duty)
 
+    def set_motor_pwm_many(self, duties: dict) -> None:
+        """Sets the PWM duty cycles of several motor channels from {channel: duty}."""
+        self.set_pwm_many({channel: (0, duty) for channel, duty in duties.items()})
+
     def set_servo_pulse(self, channel: int, pulse: float) -> None:
         """Sets the Servo Pulse, The PWM frequency must be 50HZ."""
         pulse = pulse * 4096 / 20000        # PWM frequency is 50HZ, the period is 20000us
         self.set_pwm(channel, 0, int(pulse))
 
+    def set_servo_pulse_many(self, pulses: dict) -> None:
+        """Sets the pulses of several servo channels from {channel: pulse in us}."""
+        self.set_pwm_many({channel: (0, int(pulse * 4096 / 20000)) for channel, pulse in pulses.items()})
+
     def close(self) -> None:
-        """Close the I2C bus."""
+        """Release one holder; the I2C bus is released when none are left."""
+        with _devices_lock:
+            self.users -= 1
+            if self.users > 0:
+                return
+            for key, device in list(_devices.items()):
+                if device is self:
+                    del _devices[key]
         self.bus.close()
 
+_devices = {}                  # (bus number, address) -> PCA9685
+_devices_lock = threading.Lock()
+
+def get_pca9685(address: int = 0x40, bus_number: int = 1) -> PCA9685:
+    """Get the process-wide driver of a PCA9685, so motors and servos share its lock and shadow copy; close() it once when done."""
+    with _devices_lock:
+        device = _devices.get((bus_number, address))
+        if device is None:
+            device = _devices[(bus_number, address)] = PCA9685(address, bus=get_bus(bus_number))
+        else:
+            device.users += 1
+        return device
+
 
 if __name__=='__main__':
     pass
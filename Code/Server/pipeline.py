@@ -0,0 +1,266 @@
+import collections
+import queue
+import threading
+import time
+from stats import registry
+
+# Lanes returned by a classify(command, parameters) function
+PRIORITY = 'priority'  # Stops and other safety commands: run before anything already queued
+MOTION = 'motion'      # Motion setpoints and mode changes: discarded when a newer stop arrives
+
+class ParsedBatch(tuple):
+    """A (client_address, [(command, parameters)]) batch already parsed and without stops, e.g. what a full queue handed back."""
+
+class BatchFull(queue.Full):
+    def __init__(self, remainder: ParsedBatch):
+        """The normal lane had no room: the batch's stops were queued, remainder holds the commands that were not."""
+        super().__init__(remainder)
+        self.remainder = remainder
+
+class CommandQueue:
+    def __init__(self, maxsize: int = 0, parse=None, classify=None):
+        """Bounded command queue with a priority lane that stop commands take past everything queued."""
+        self.maxsize = maxsize          # Most batches in the normal lane, 0 for no limit
+        self.parse = parse              # Turns a received message into (command, parameters), or None to skip it
+        self.classify = classify        # Returns PRIORITY, MOTION or None for a parsed command
+        self.normal = collections.deque()    # (client_address, [(command, parameters)]) batches in arrival order
+        self.priority = collections.deque()  # Single-command batches that jump the queue
+        self.mutex = threading.Lock()
+        self.not_empty = threading.Condition(self.mutex)
+        self.not_full = threading.Condition(self.mutex)
+        self.purged = registry.counter('pipeline.purged')  # Motion setpoints discarded by a later stop
+
+    def put(self, batch, block: bool = True, timeout: float = None) -> None:
+        """
+        Queue a (client_address, [messages]) batch; stops in it go to the priority lane at once, the rest waits for room.
+        Without room and without waiting, raises BatchFull with the commands that were not queued; putting that
+        remainder later queues only them, so the stops are neither parsed nor applied twice.
+        """
+        if not isinstance(batch, tuple):
+            # A sentinel such as CommandPipeline.STOP
+            with self.mutex:
+                self.priority.append(batch)
+                self.not_empty.notify()
+            return
+        if batch.__class__ is ParsedBatch:
+            client_address, commands = batch
+            stops = []
+        else:
+            client_address, commands, stops = self.split(batch)
+        with self.mutex:
+            if stops:
+                # A stop never waits for room: it is queued, and the motion queued before it dropped, right away
+                self.purge_motion()
+                self.priority.extend((client_address, [stop]) for stop in stops)
+                self.not_empty.notify()
+            if not commands:
+                return
+            if self.maxsize > 0:
+                deadline = None if timeout is None else time.monotonic() + timeout
+                while len(self.normal) >= self.maxsize:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if not block or (remaining is not None and remaining <= 0):
+                        raise BatchFull(ParsedBatch((client_address, commands)))
+                    self.not_full.wait(remaining)
+            self.normal.append((client_address, commands))
+            self.not_empty.notify()
+
+    def split(self, batch) -> tuple:
+        """Parse a batch into (client_address, commands, stops), dropping the motion that comes before a stop in it."""
+        client_address, messages = batch
+        commands = []
+        stops = []
+        for message in messages:
+            parsed = self.parse(message) if self.parse is not None else message
+            if parsed is None:
+                continue
+            if self.classify is not None and self.classify(*parsed) == PRIORITY:
+                # Motion requested before the stop, in this batch or already queued, must not run after it
+                purged = len(commands)
+                commands = [command for command in commands if self.classify(*command) != MOTION]
+                self.purged.increment(purged - len(commands))
+                stops.append(parsed)
+            else:
+                commands.append(parsed)
+        return client_address, commands, stops
+
+    def put_nowait(self, batch) -> None:
+        self.put(batch, False)
+
+    def purge_motion(self) -> None:
+        """Drop the queued motion setpoints; called with the mutex held."""
+        if self.classify is None:
+            return
+        kept = collections.deque()
+        for client_address, commands in self.normal:
+            remaining = [command for command in commands if self.classify(*command) != MOTION]
+            self.purged.increment(len(commands) - len(remaining))
+            if remaining:
+                kept.append((client_address, remaining))
+        self.normal = kept
+        self.not_full.notify_all()
+
+    def get(self, block: bool = True, timeout: float = None):
+        """Take the next batch, priority lane first."""
+        with self.not_empty:
+            if not block:
+                if not self.priority and not self.normal:
+                    raise queue.Empty
+            elif not self.not_empty.wait_for(lambda: self.priority or self.normal, timeout):
+                raise queue.Empty
+            if self.priority:
+                return self.priority.popleft()
+            batch = self.normal.popleft()
+            self.not_full.notify()
+            return batch
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def has_priority(self) -> bool:
+        """Check whether a stop is waiting."""
+        return bool(self.priority)
+
+    def qsize(self) -> int:
+        return len(self.priority) + len(self.normal)
+
+    def empty(self) -> bool:
+        return not self.priority and not self.normal
+
+class CommandPipeline:
+    STOP = object()    # Sentinel put on the source queue to wake the worker for shutdown
+    MAX_DRAIN = 256    # Most batches taken from the queue before running commands
+
+    def __init__(self, handler, parse=None, key=None, classify=None):
+        """Run every received command through a handler on one worker thread that sleeps until a batch arrives."""
+        self.handler = handler   # Called with (client_address, command, parameters) for every command that is kept
+        self.parse = parse       # Turns a received message into (command, parameters), None if the source queue already parsed it
+        self.key = key           # Returns the actuator a (command, parameters) setpoint drives, or None for ordered commands
+        self.classify = classify # Returns PRIORITY, MOTION or None for a parsed command
+        self.source = None       # Bounded queue of (client_address, [messages]) batches filled by the network framer
+        self.thread = None
+        self.running = False
+        self.processed = registry.counter('pipeline.processed')  # Commands handed to the handler
+        self.coalesced = registry.counter('pipeline.coalesced')  # Actuators whose queued setpoints were merged into one
+        self.dropped = registry.counter('pipeline.dropped')      # Setpoints discarded because a newer one was queued
+        self.purged = registry.counter('pipeline.purged')        # Motion setpoints discarded by a later stop
+        self.preempted = registry.counter('pipeline.preempted')  # Stops run ahead of commands already taken from the queue
+
+    def start(self, source) -> None:
+        """Start consuming batches from a server's message queue."""
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.source = source
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self, close_time: float = 0.3) -> None:
+        """Wake the worker and wait for it to finish the command it is on."""
+        self.running = False
+        if self.source is not None:
+            try:
+                self.source.put_nowait(self.STOP)
+            except queue.Full:
+                pass  # The worker is busy and sees running is False after the current command
+        if self.thread is not None:
+            self.thread.join(close_time)
+            self.thread = None
+
+    def is_running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def take_batches(self, block: bool = True) -> list:
+        """Take every batch already queued, blocking for the first one if asked to."""
+        batches = []
+        try:
+            if block:
+                batches.append(self.source.get())  # Blocks without polling; no CPU is used while idle
+            while len(batches) < self.MAX_DRAIN:
+                batches.append(self.source.get_nowait())
+        except queue.Empty:
+            pass
+        return batches
+
+    def priority_waiting(self) -> bool:
+        """Check whether the source has a stop queued; plain queues have no priority lane."""
+        has_priority = getattr(self.source, 'has_priority', None)
+        return has_priority is not None and has_priority()
+
+    def coalesce(self, commands: list) -> list:
+        """Keep only the newest setpoint per actuator; ordered commands all stay, in arrival order."""
+        if self.key is None or len(commands) < 2:
+            return commands
+        actuators = [self.key(command, parameters) for client_address, command, parameters in commands]
+        newest = {}  # actuator -> index of its newest setpoint
+        counts = {}  # actuator -> number of queued setpoints
+        for index, actuator in enumerate(actuators):
+            if actuator is not None:
+                newest[actuator] = index
+                counts[actuator] = counts.get(actuator, 0) + 1
+        if len(newest) == sum(counts.values()):
+            return commands
+        self.coalesced.increment(sum(1 for count in counts.values() if count > 1))
+        kept = [entry for index, (entry, actuator) in enumerate(zip(commands, actuators))
+                if actuator is None or newest[actuator] == index]
+        self.dropped.increment(len(commands) - len(kept))
+        return kept
+
+    def schedule(self, pending: list, batches: list) -> list:
+        """Merge newly taken batches into the pending commands: stops first, then the rest in order, coalesced."""
+        stops = []
+        commands = []
+        for batch in batches:
+            if batch is self.STOP:
+                self.running = False
+                break
+            client_address, messages = batch
+            for message in messages:
+                parsed = self.parse(message) if self.parse is not None else message
+                if parsed is None:
+                    continue
+                if self.classify is not None and self.classify(*parsed) == PRIORITY:
+                    stops.append((client_address, parsed[0], parsed[1]))
+                else:
+                    commands.append((client_address, parsed[0], parsed[1]))
+        if stops and pending:
+            # Commands already taken wait behind the stop, and motion that was meant to run before it is dropped
+            kept = [entry for entry in pending if self.classify(entry[1], entry[2]) != MOTION]
+            self.purged.increment(len(pending) - len(kept))
+            self.preempted.increment(len(stops))
+            pending = kept
+        return self.coalesce(stops + pending + commands)
+
+    def run(self) -> None:
+        pending = collections.deque()
+        while self.running:
+            # Between commands, a queued stop is taken at once instead of after the rest of the backlog
+            if not pending or self.priority_waiting():
+                pending = collections.deque(self.schedule(list(pending), self.take_batches(block=not pending)))
+                continue
+            client_address, command, parameters = pending.popleft()
+            try:
+                self.handler(client_address, command, parameters)
+            except Exception as e:
+                print(f"Error handling {command} from {client_address}: {e}")
+            self.processed.increment()
+
+    def get_stats(self) -> dict:
+        """Get the processed, coalesced, dropped, purged and preempted counters."""
+        return {'processed': self.processed.get(), 'coalesced': self.coalesced.get(), 'dropped': self.dropped.get(),
+                'purged': self.purged.get(), 'preempted': self.preempted.get()}
+
+if __name__ == '__main__':
+    import time
+    print('Program is starting ... ')
+    commands = queue.Queue(16)
+    pipeline = CommandPipeline(lambda client_address, command, parameters: print(client_address, command, parameters),
+                               lambda message: (message.split('#')[0], [int(x) for x in message.split('#')[1:]]),
+                               lambda command, parameters: ('servo', parameters[0]) if command == "CMD_SERVO" else None)
+    for angle in range(60, 100, 10):
+        commands.put((('127.0.0.1', 1), ["CMD_SERVO#0#{}".format(angle), "CMD_SERVO#1#{}".format(angle)]))
+    commands.put((('127.0.0.1', 1), ["CMD_LED_MOD#1"]))
+    pipeline.start(commands)
+    time.sleep(0.1)
+    pipeline.stop()
+    print(pipeline.get_stats())
@@ -0,0 +1,118 @@
+import struct
+from framer import LineFramer
+from opcodes import OPCODES  # Opcode -> (command, number of int16 arguments), shared with the client and the webapp
+
+# Handshake line a client sends on the command port to switch its connection to binary frames.
+# The server answers with the same line, optionally followed by '#<udp port>' when the UDP drive
+# channel is running, and every byte after the handshake is parsed as frames.
+PROTOCOL_HANDSHAKE = "CMD_PROTOCOL#1"
+PROTOCOL_ACK = (PROTOCOL_HANDSHAKE + "\n").encode('utf-8')
+PROTOCOL_TOKEN = PROTOCOL_HANDSHAKE.encode('utf-8')
+
+# Every frame starts with a 1-byte opcode and a 16-bit sequence number, followed by fixed int16 arguments
+HEADER = struct.Struct('<BH')
+TEXT_LENGTH = struct.Struct('<H')
+OP_TEXT = 0xFF  # Escape hatch: a length-prefixed UTF-8 text command
+
+# Precompiled layout of each frame, keyed by opcode and by command
+FRAME_STRUCTS = {opcode: struct.Struct('<BH' + 'h' * count) for opcode, (command, count) in OPCODES.items()}
+COMMAND_OPCODES = {command: opcode for opcode, (command, count) in OPCODES.items()}
+
+def encode_command(command: str, parameters, sequence: int = 0) -> bytes:
+    """Encode a command and its integer parameters as one binary frame."""
+    opcode = COMMAND_OPCODES[command]
+    return FRAME_STRUCTS[opcode].pack(opcode, sequence & 0xFFFF, *parameters)
+
+def encode_text(message: str, sequence: int = 0) -> bytes:
+    """Wrap a text command that has no binary layout in a text frame."""
+    payload = message.strip().encode('utf-8')
+    return HEADER.pack(OP_TEXT, sequence & 0xFFFF) + TEXT_LENGTH.pack(len(payload)) + payload
+
+class BinaryFramer:
+    def __init__(self):
+        """Split one connection's byte stream into binary command frames."""
+        self.buffer = bytearray()  # Bytes of an incomplete frame carried over to the next read
+        self.sequence = None       # Sequence number of the last decoded frame
+
+    def feed(self, data: bytes) -> list:
+        """Add received bytes and return the decoded commands, as (command, parameters) tuples or text."""
+        buffer = self.buffer
+        buffer += data
+        messages = []
+        offset = 0
+        end = len(buffer)
+        while end - offset >= HEADER.size:
+            opcode = buffer[offset]
+            frame = FRAME_STRUCTS.get(opcode)
+            if frame is not None:
+                if end - offset < frame.size:
+                    break
+                values = frame.unpack_from(buffer, offset)
+                self.sequence = values[1]
+                messages.append((OPCODES[opcode][0], list(values[2:])))
+                offset += frame.size
+            elif opcode == OP_TEXT:
+                if end - offset < HEADER.size + TEXT_LENGTH.size:
+                    break
+                length, = TEXT_LENGTH.unpack_from(buffer, offset + HEADER.size)
+                start = offset + HEADER.size + TEXT_LENGTH.size
+                if end - start < length:
+                    break
+                self.sequence = HEADER.unpack_from(buffer, offset)[1]
+                messages.append(bytes(buffer[start:start + length]).decode('utf-8', errors='replace'))
+                offset = start + length
+            else:
+                # The stream is out of step; there is no way to find the next frame boundary
+                print(f"Unknown opcode 0x{opcode:02X}, discarding {end - offset} bytes")
+                offset = end
+        del buffer[:offset]
+        return messages
+
+    def reset(self) -> None:
+        """Drop any partial frame."""
+        self.buffer.clear()
+
+class ProtocolFramer:
+    def __init__(self, ack: bytes = PROTOCOL_ACK):
+        """Frame text commands until the client negotiates binary frames."""
+        self.ack = ack              # Reply to the handshake, may advertise extra options such as the UDP port
+        self.framer = LineFramer()  # The framer currently decoding the stream
+        self.binary = False         # True once the handshake has been received
+        self.reply = None           # Bytes to send back to the client, set when the handshake is accepted
+
+    def feed(self, data: bytes) -> list:
+        """Add received bytes and return the complete messages they finish."""
+        if self.binary:
+            return self.framer.feed(data)
+        buffered = self.framer.buffer
+        if PROTOCOL_TOKEN not in data and not (buffered and PROTOCOL_HANDSHAKE.startswith(buffered)):
+            return self.framer.feed(data)
+        # A handshake may be in this read: frame line by line so the bytes after it are never decoded as text
+        messages = []
+        start = 0
+        while True:
+            end = data.find(b'\n', start)
+            if end < 0:
+                return messages + self.framer.feed(data[start:])
+            lines = self.framer.feed(data[start:end + 1])
+            start = end + 1
+            if lines and lines[-1] == PROTOCOL_HANDSHAKE:
+                return messages + lines[:-1] + self.switch_to_binary(data[start:])
+            messages += lines
+
+    def switch_to_binary(self, data: bytes) -> list:
+        """Acknowledge the handshake and decode the remaining bytes as binary frames."""
+        self.binary = True
+        self.reply = self.ack
+        self.framer = BinaryFramer()
+        return self.framer.feed(data) if data else []
+
+if __name__ == '__main__':
+    print('Program is starting ... ')
+    stream = b'CMD_POWER\n' + PROTOCOL_ACK + encode_command("CMD_M_MOTOR", (45, 1500, 0, 0), 1) + encode_text("CMD_MODE#one", 2)
+    for size in (1, 7, 20, len(stream)):
+        framer = ProtocolFramer()
+        messages = []
+        for position in range(0, len(stream), size):
+            messages += framer.feed(stream[position:position + size])
+        print(size, messages, framer.reply)
@@ -0,0 +1,184 @@
+import threading
+import time
+from stats import registry
+
+class MotionTaskRunner:
+    def __init__(self, name: str = 'motion'):
+        """Run one timed maneuver at a time on a single thread, stepping it on monotonic deadlines."""
+        self.task = None           # Generator: each next() performs one step and yields the seconds until the next one
+        self.task_name = None
+        self.deadline = 0.0        # Monotonic time the next step is due
+        self.stepping = False      # A step is running outside the lock
+        self.woken = False         # wake() asked for the next step to run now
+        self.condition = threading.Condition()
+        self.thread = None
+        self.running = False
+        self.steps = registry.counter(name + '.steps')          # Steps performed
+        self.overruns = registry.counter(name + '.overruns')    # Steps that ran past the next deadline; the schedule restarts from then
+        self.cancelled = registry.counter(name + '.cancelled')  # Tasks stopped before they finished
+        self.wakeups = registry.counter(name + '.wakeups')      # Steps run early by wake()
+        self.drift = registry.histogram(name + '.drift')        # How late each step started after its deadline
+        self.step_time = registry.histogram(name + '.step')     # How long each step ran
+
+    def start(self) -> None:
+        """Start the runner thread."""
+        if self.thread is None or not self.thread.is_alive():
+            self.running = True
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def stop(self, close_time: float = 0.3) -> None:
+        """Cancel the current task and stop the runner thread."""
+        self.cancel()
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join(close_time)
+            self.thread = None
+
+    def start_task(self, task, name: str = None) -> None:
+        """Replace the current task with a generator of steps; its first step runs at once."""
+        self.cancel()
+        with self.condition:
+            self.task = task
+            self.task_name = name
+            self.deadline = time.monotonic()
+            self.woken = False
+            self.condition.notify_all()
+
+    def cancel(self) -> bool:
+        """Stop the current task; a step in progress is finished first, so nothing runs after this returns."""
+        with self.condition:
+            task = self.task
+            if task is None:
+                return False
+            self.task = None
+            self.task_name = None
+            self.cancelled.increment()
+            self.condition.notify_all()
+            if threading.current_thread() is self.thread:
+                return True  # Cancelled from inside a step: the runner closes the task when the step returns
+            self.condition.wait_for(lambda: not self.stepping)
+        task.close()  # Runs the task's finally blocks
+        return True
+
+    def wake(self, name: str = None) -> bool:
+        """Run the next step now instead of at its deadline, e.g. when an input it reacts to changed; only for task name if given."""
+        with self.condition:
+            if self.task is None or (name is not None and name != self.task_name):
+                return False
+            self.woken = True
+            self.condition.notify_all()
+            return True
+
+    def get_task_name(self) -> str:
+        """Get the name of the running task, or None when idle."""
+        return self.task_name
+
+    def is_busy(self) -> bool:
+        return self.task is not None
+
+    def run(self) -> None:
+        with self.condition:
+            while self.running:
+                if self.task is None:
+                    self.condition.wait()
+                    continue
+                delay = self.deadline - time.monotonic()
+                if delay > 0 and not self.woken:
+                    self.condition.wait(delay)  # Woken early by cancel(), wake() or a new task
+                    continue
+                if self.woken:
+                    self.woken = False
+                    if delay > 0:
+                        # Run early; the schedule restarts from now
+                        self.wakeups.increment()
+                        self.deadline -= delay
+                        delay = 0
+                task = self.task
+                self.stepping = True
+                self.condition.release()
+                start = time.monotonic()
+                try:
+                    period = next(task)
+                except StopIteration:
+                    period = None
+                except Exception as e:
+                    print(f"Error in motion task {self.task_name}: {e}")
+                    period = None
+                finally:
+                    self.condition.acquire()
+                    self.stepping = False
+                    self.condition.notify_all()
+                now = time.monotonic()
+                self.steps.increment()
+                self.drift.record(-delay)
+                self.step_time.record(now - start)
+                if self.task is not task:
+                    task.close()  # Cancelled or replaced while the step ran
+                    continue
+                if period is None:
+                    self.task = None
+                    self.task_name = None
+                    continue
+                # Deadlines advance by the period, so step timing does not accumulate drift
+                self.deadline += period
+                if self.deadline < now:
+                    # Missed steps are not caught up on; the next one runs at once
+                    self.overruns.increment()
+                    self.deadline = now
+
+    def get_stats(self) -> dict:
+        """Get the task name, step, overrun, cancel and wakeup counts, and the step drift and duration in milliseconds."""
+        drift = self.drift.get()
+        step_time = self.step_time.get()
+        return {'task': self.task_name, 'steps': self.steps.get(), 'overruns': self.overruns.get(),
+                'cancelled': self.cancelled.get(), 'wakeups': self.wakeups.get(), 'drift_p50': drift['p50'], 'drift_p99': drift['p99'],
+                'drift_max': drift['max'], 'step_p99': step_time['p99'], 'step_max': step_time['max']}
+
+class FixedRateLoop(MotionTaskRunner):
+    def __init__(self, name: str = 'control'):
+        """Run one control step, e.g. a car mode, at a fixed frequency; idle without a step, without waking up."""
+        super().__init__(name)
+        self.frequency = 0  # Steps per second of the current step
+
+    def set_step(self, step, frequency: float = 0, name: str = None) -> None:
+        """Run step() frequency times per second, replacing the current step; None idles the loop."""
+        if step is None or frequency <= 0:
+            self.frequency = 0
+            self.cancel()
+            return
+        if name is not None and name == self.task_name and frequency == self.frequency:
+            return
+        self.frequency = frequency
+        self.start_task(self.repeat(step, 1.0 / frequency), name)
+
+    def repeat(self, step, period: float):
+        while True:
+            step()
+            yield period
+
+    def get_stats(self) -> dict:
+        """Get the runner stats plus the frequency and the headroom left between the p99 step and the period."""
+        stats = super().get_stats()
+        stats['frequency'] = self.frequency
+        stats['headroom'] = round(1000.0 / self.frequency - stats['step_p99'], 3) if self.frequency else None
+        return stats
+
+if __name__ == '__main__':
+    print('Program is starting ... ')
+    def countdown(count, period):
+        try:
+            for i in range(count, 0, -1):
+                print(i)
+                yield period
+        finally:
+            print("countdown closed")
+    runner = MotionTaskRunner()
+    runner.start()
+    runner.start_task(countdown(10, 0.1), 'countdown')
+    time.sleep(0.55)
+    runner.cancel()
+    print(runner.get_stats())
+    runner.stop()
@@ -1,16 +1,26 @@
 import socket  # Import the socket module for network communication
 import fcntl   # Import the fcntl module for I/O control
 import struct  # Import the struct module for packing and unpacking data
-from tcp_server import TCPServer  # Import the TCPServer class from the tcp_server module
+import time    # Import the time module for timing frame hand-off
+import queue   # Import the queue module for the bounded command queue
+from tcp_server import TCPServer, OutboundQueue  # Import the TCPServer and OutboundQueue classes from the tcp_server module
+from udp_server import UDPControlServer  # Import the UDPControlServer class for the low-latency drive channel
+from protocol import PROTOCOL_HANDSHAKE  # Import the binary protocol handshake line
+from stats import registry  # Import the process-wide statistics registry
+
+FRAME_HEADER = struct.Struct('<I')  # Little-endian length prefixed to every video frame
 
 class Server:
     def __init__(self):
         """Initialize the TankServer class."""
         self.ip_address = self.get_interface_ip()  # Get the IP address of the network interface
-        self.command_server = TCPServer()          # Initialize the command server
-        self.video_server = TCPServer()            # Initialize the video server
+        self.command_server = TCPServer('command', 256)  # Initialize the command server with a bounded command queue
+        self.video_server = TCPServer('video')     # Initialize the video server
+        self.control_server = None                 # UDP drive channel, created by start_udp_server
         self.command_server_is_busy = False        # Flag to indicate whether the command server is busy
         self.video_server_is_busy = False          # Flag to indicate whether the video server is busy
+        self.video_frames = registry.counter('video.frames')    # Frames published to the viewers
+        self.video_send_time = registry.histogram('video.send')  # Time the capture thread spends handing off a frame
 
     def get_interface_ip(self) -> str:
         """Get the IP address of the wlan0 interface."""
@@ -26,11 +36,13 @@ class Server:
             print(f"Error getting IP address: {e}")
             return "127.0.0.1"  # Default to localhost if an error occurs
 
-    def start_tcp_servers(self, command_port: int = 5000, video_port: int = 8000, max_clients: int = 1, listen_count: int = 1) -> None:
+    def start_tcp_servers(self, command_port: int = 5000, video_port: int = 8000, max_clients: int = 1, listen_count: int = 1, video_max_clients: int = 4) -> None:
         """Start the TCP servers on specified ports."""
         try:
-            self.command_server.start(self.ip_address, command_port, max_clients, listen_count)  # Start the command server
-            self.video_server.start(self.ip_address, video_port, max_clients, listen_count)      # Start the video server
+            self.command_server.start(self.ip_address, command_port, max_clients, listen_count, OutboundQueue.NEVER_DROP)  # Start the command server, commands are never dropped
+            # Several viewers (desktop client, web bridge, recorder) may watch at once; each one has a
+            # one-frame mailbox, so a viewer that falls behind skips frames instead of stalling the others
+            self.video_server.start(self.ip_address, video_port, video_max_clients, max(listen_count, video_max_clients), OutboundQueue.LATEST)
         except Exception as e:
             print(f"Error starting TCP servers: {e}")
 
@@ -42,6 +54,45 @@ class Server:
         except Exception as e:
             print(f"Error stopping TCP servers: {e}")
 
+    def start_udp_server(self, control_port: int = 5001) -> None:
+        """Start the UDP drive channel; accepted setpoints join the command server's message queue."""
+        try:
+            self.control_server = UDPControlServer()
+            self.control_server.start(self.ip_address, control_port,
+                                      self.queue_udp_setpoints,
+                                      self.get_command_server_client_ips)  # Only clients connected to the command port may drive
+            # Advertise the port in the binary handshake reply so clients know the channel exists
+            self.command_server.protocol_ack = f"{PROTOCOL_HANDSHAKE}#{control_port}\n".encode('utf-8')
+            # TCP and UDP frames share the client's sequence numbers: a handshake starts them over, and a stop
+            # sent over TCP makes any older setpoint still in flight on UDP out of date
+            self.command_server.on_session = self.control_server.reset_client
+            self.command_server.on_sequence = self.control_server.note_sequence
+        except Exception as e:
+            print(f"Error starting UDP server: {e}")
+            self.control_server = None
+
+    def queue_udp_setpoints(self, client_address: tuple, messages: list) -> None:
+        """Add UDP setpoints to the command queue without ever blocking the UDP receiver."""
+        try:
+            self.command_server.message_queue.put_nowait((client_address, messages))
+        except queue.Full:
+            pass  # Latest-value-wins: the next datagram carries a newer setpoint
+
+    def stop_udp_server(self) -> None:
+        """Stop the UDP drive channel."""
+        try:
+            if self.control_server is not None:
+                self.command_server.on_session = None
+                self.command_server.on_sequence = None
+                self.control_server.close()
+                self.control_server = None
+        except Exception as e:
+            print(f"Error stopping UDP server: {e}")
+
+    def get_udp_server_stats(self) -> dict:
+        """Get the received, applied and discarded packet counters of the UDP drive channel."""
+        return self.control_server.get_stats() if self.control_server is not None else {}
+
     def set_command_server_busy(self, state: bool) -> None:
         """Set the busy state of the command server."""
         self.command_server_is_busy = state
@@ -82,6 +133,22 @@ class Server:
         finally:
             self.set_video_server_busy(False)
 
+    def send_video_frame(self, frame: bytes) -> None:
+        """Publish a length-prefixed frame to every viewer's mailbox without waiting for any of them."""
+        self.set_video_server_busy(True)
+        start = time.perf_counter()
+        try:
+            # Header and frame stay separate buffers and go out together in one sendmsg() call, the frame is never copied
+            self.video_server.send_to_all_client((FRAME_HEADER.pack(len(frame)), frame))
+            self.video_frames.increment()
+        finally:
+            self.video_send_time.record(time.perf_counter() - start)
+            self.set_video_server_busy(False)
+
+    def set_command_queue(self, command_queue) -> None:
+        """Put received commands on a different queue, e.g. a CommandQueue with a priority lane for stops."""
+        self.command_server.set_message_queue(command_queue)
+
     def read_data_from_command_server(self) -> 'queue.Queue':
         """Read data from the command server's message queue."""
         return self.command_server.message_queue
@@ -102,10 +169,26 @@ class Server:
         """Get the list of client IP addresses connected to the command server."""
         return self.command_server.get_client_ips()
 
+    def get_command_server_client_addresses(self) -> list:
+        """Get the list of (ip, port) addresses connected to the command server."""
+        return self.command_server.get_client_addresses()
+
     def get_video_server_client_ips(self) -> list:
         """Get the list of client IP addresses connected to the video server."""
         return self.video_server.get_client_ips()
 
+    def get_command_server_client_stats(self) -> dict:
+        """Get the outbound queue high-water marks and drop counters of the command server clients."""
+        return self.command_server.get_client_stats()
+
+    def get_stats(self) -> dict:
+        """Get a snapshot of the throughput, queue depth and latency statistics."""
+        return registry.snapshot()
+
+    def get_video_server_client_stats(self) -> dict:
+        """Get the frame rate, skipped-frame count and outbound queue counters of each video viewer."""
+        return self.video_server.get_client_stats()
+
 if __name__ == '__main__':
     print('Program is starting ... ')  # Print a message indicating the start of the program
     server = Server()              # Create an instance of the TankServer class
@@ -115,15 +198,17 @@ if __name__ == '__main__':
         while True:
             cmd_queue = server.read_data_from_command_server()  # Get the command server's message queue
             if cmd_queue.qsize() > 0:  # Check if there are messages in the queue
-                client_address, message = cmd_queue.get()  # Get a message from the queue
-                print(client_address, message)  # Print the client address and message
-                server.send_data_to_command_client(message, client_address)  # Send the message back to the client
+                client_address, messages = cmd_queue.get()  # Get a batch of complete messages from the queue
+                for message in messages:
+                    print(client_address, message)  # Print the client address and message
+                    server.send_data_to_command_client(message + "\n", client_address)  # Send the message back to the client
 
             video_queue = server.read_data_from_video_server()  # Get the video server's message queue
             if video_queue.qsize() > 0:  # Check if there are messages in the queue
-                client_address, message = video_queue.get()  # Get a message from the queue
-                print(client_address, message)  # Print the client address and message
-                server.send_data_to_video_client(message, client_address)  # Send the message back to the client
+                client_address, messages = video_queue.get()  # Get a batch of complete messages from the queue
+                for message in messages:
+                    print(client_address, message)  # Print the client address and message
+                    server.send_data_to_video_client(message + "\n", client_address)  # Send the message back to the client
 
     except KeyboardInterrupt:  # Catch keyboard interrupt
         print("Received interrupt signal, stopping server...")  # Print interrupt information
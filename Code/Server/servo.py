@@ -1,4 +1,6 @@
-from pca9685 import PCA9685
+import time
+from pca9685 import get_pca9685
+from stats import registry
 
 class Servo:
     def __init__(self):
@@ -14,17 +16,35 @@ class Servo:
             '6': 14,
             '7': 15
         }
-        self.pwm_servo = PCA9685(0x40, debug=True)
+        self.pwm_servo = get_pca9685(0x40)  # Shared with the motors: one bus lock and shadow copy
         self.pwm_servo.set_pwm_freq(self.pwm_frequency)
-        for channel in self.pwm_channel_map.values():
-            self.pwm_servo.set_servo_pulse(channel, self.initial_pulse)
+        self.write_time = registry.histogram('servo.write')
+        self.pwm_servo.set_servo_pulse_many({channel: self.initial_pulse for channel in self.pwm_channel_map.values()})
 
-    def set_servo_pwm(self, channel: str, angle: int, error: int = 10) -> None:
+    def angle_to_pulse(self, channel: str, angle: int, error: int = 10) -> int:
         angle = int(angle)
         if channel not in self.pwm_channel_map:
             raise ValueError(f"Invalid channel: {channel}. Valid channels are {list(self.pwm_channel_map.keys())}.")
-        pulse = 2500 - int((angle + error) / 0.09) if channel == '0' else 500 + int((angle + error) / 0.09)
+        return 2500 - int((angle + error) / 0.09) if channel == '0' else 500 + int((angle + error) / 0.09)
+
+    def set_servo_pwm(self, channel: str, angle: int, error: int = 10) -> None:
+        pulse = self.angle_to_pulse(channel, angle, error)
+        start = time.perf_counter()
         self.pwm_servo.set_servo_pulse(self.pwm_channel_map[channel], pulse)
+        self.write_time.record(time.perf_counter() - start)
+
+    def set_servo_pwm_many(self, angles: dict, error: int = 10) -> None:
+        """Set several servos from {channel: angle}; consecutive channels share one block write."""
+        pulses = {self.pwm_channel_map[channel]: self.angle_to_pulse(channel, angle, error) for channel, angle in angles.items()}
+        start = time.perf_counter()
+        self.pwm_servo.set_servo_pulse_many(pulses)
+        self.write_time.record(time.perf_counter() - start)
+
+    def close(self) -> None:
+        """Release this holder of the shared PCA9685."""
+        if self.pwm_servo is not None:
+            self.pwm_servo.close()
+            self.pwm_servo = None
 
 # Main program logic follows:
 if __name__ == '__main__':
@@ -0,0 +1,183 @@
+import collections
+import threading
+import time
+
+class Counter:
+    def __init__(self):
+        """A running total, e.g. messages or bytes processed."""
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def increment(self, amount: int = 1) -> None:
+        with self.lock:
+            self.value += amount
+
+    def get(self) -> int:
+        return self.value
+
+class Gauge:
+    def __init__(self, function=None):
+        """A current level, either set explicitly or read from a function at snapshot time."""
+        self.function = function  # e.g. a queue's qsize
+        self.value = 0
+
+    def set(self, value) -> None:
+        self.value = value
+
+    def get(self):
+        if self.function is None:
+            return self.value
+        try:
+            return self.function()
+        except Exception:
+            return None  # e.g. qsize() of a queue that has gone away or is not supported
+
+class Histogram:
+    def __init__(self, size: int = 1024):
+        """Durations of an operation; percentiles are taken over the newest samples."""
+        self.samples = collections.deque(maxlen=size)  # Newest durations in seconds
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, duration: float) -> None:
+        with self.lock:
+            self.samples.append(duration)
+            self.count += 1
+            self.total += duration
+            if duration > self.max:
+                self.max = duration
+
+    def percentile(self, fraction: float, ordered: list = None) -> float:
+        """Get a percentile (0.0 - 1.0) of the newest samples in seconds."""
+        if ordered is None:
+            with self.lock:
+                ordered = sorted(self.samples)
+        if not ordered:
+            return 0.0
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def get(self) -> dict:
+        """Get the sample count and the p50/p90/p99/max/mean durations in milliseconds."""
+        with self.lock:
+            ordered = sorted(self.samples)
+            count, total, maximum = self.count, self.total, self.max
+        return {'count': count,
+                'p50': round(self.percentile(0.50, ordered) * 1000, 3),
+                'p90': round(self.percentile(0.90, ordered) * 1000, 3),
+                'p99': round(self.percentile(0.99, ordered) * 1000, 3),
+                'max': round(maximum * 1000, 3),
+                'mean': round(total / count * 1000, 3) if count else 0.0}
+
+class Timer:
+    def __init__(self, histogram: Histogram):
+        """Context manager recording the duration of its block."""
+        self.histogram = histogram
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.record(time.perf_counter() - self.start)
+        return False
+
+class StatsRegistry:
+    def __init__(self):
+        """Named counters, gauges and histograms shared by every stage of the server."""
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.start_time = time.monotonic()
+        self.lock = threading.Lock()
+        self.log_thread = None
+        self.log_event = threading.Event()
+
+    def counter(self, name: str) -> Counter:
+        """Get or create a counter."""
+        with self.lock:
+            if name not in self.counters:
+                self.counters[name] = Counter()
+            return self.counters[name]
+
+    def gauge(self, name: str, function=None) -> Gauge:
+        """Get or create a gauge; passing a function (re)binds what it reads."""
+        with self.lock:
+            if name not in self.gauges:
+                self.gauges[name] = Gauge(function)
+            elif function is not None:
+                self.gauges[name].function = function
+            return self.gauges[name]
+
+    def histogram(self, name: str) -> Histogram:
+        """Get or create a latency histogram."""
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            return self.histograms[name]
+
+    def timer(self, name: str) -> Timer:
+        """Time a block into the named histogram: with registry.timer('dispatch'): ..."""
+        return Timer(self.histogram(name))
+
+    def snapshot(self) -> dict:
+        """Get the current value of every metric."""
+        with self.lock:
+            counters, gauges, histograms = dict(self.counters), dict(self.gauges), dict(self.histograms)
+        snapshot = {'uptime': round(time.monotonic() - self.start_time, 3)}
+        for name, counter in counters.items():
+            snapshot[name] = counter.get()
+        for name, gauge in gauges.items():
+            snapshot[name] = gauge.get()
+        for name, histogram in histograms.items():
+            for key, value in histogram.get().items():
+                snapshot[name + '.' + key] = value
+        return snapshot
+
+    def format_snapshot(self, command: str = "CMD_STATS") -> str:
+        """Format a snapshot as one 'CMD_STATS#name=value#...' line."""
+        return command + ''.join(f"#{name}={value}" for name, value in sorted(self.snapshot().items())) + "\n"
+
+    def start_logging(self, interval: float = 10.0, output=print) -> None:
+        """Log a snapshot, with per-second counter rates, every interval seconds."""
+        if self.log_thread is not None and self.log_thread.is_alive():
+            return
+        self.log_event.clear()
+        self.log_thread = threading.Thread(target=self.log_loop, args=(interval, output), daemon=True)
+        self.log_thread.start()
+
+    def stop_logging(self) -> None:
+        """Stop the periodic log."""
+        self.log_event.set()
+        if self.log_thread is not None:
+            self.log_thread.join(1)
+            self.log_thread = None
+
+    def log_loop(self, interval: float, output) -> None:
+        last = self.snapshot()
+        while not self.log_event.wait(interval):
+            current = self.snapshot()
+            with self.lock:
+                # Other threads register counters while this runs; iterate over a copy of the names
+                counter_names = list(self.counters)
+            elapsed = current['uptime'] - last['uptime']
+            rates = {name + '.rate': round((current[name] - last.get(name, 0)) / elapsed, 1)
+                     for name in counter_names if elapsed > 0 and name in current}
+            output("Stats: " + ' '.join(f"{name}={value}" for name, value in sorted({**current, **rates}.items())))
+            last = current
+
+registry = StatsRegistry()  # Process-wide registry used by the servers and main.py
+
+if __name__ == '__main__':
+    import random
+    print('Program is starting ... ')
+    registry.gauge('queue', lambda: random.randint(0, 5))
+    registry.start_logging(1.0)
+    for i in range(2000):
+        with registry.timer('work'):
+            time.sleep(random.random() / 1000)
+        registry.counter('messages').increment()
+    print(registry.format_snapshot())
+    registry.stop_logging()
@@ -1,121 +1,392 @@
 import socket
-import select
+import selectors
 import threading
 import fcntl
 import struct
 import queue
+import collections
+import time
+from protocol import ProtocolFramer, PROTOCOL_ACK
+
+# Scatter/gather sends are not available on every platform (e.g. Windows)
+HAS_SENDMSG = hasattr(socket.socket, 'sendmsg')
+MSG_MORE = getattr(socket, 'MSG_MORE', 0)
+from stats import registry
+
+class OutboundQueue:
+    # Policies for a client whose buffer is full
+    DROP_OLDEST = 'drop_oldest'  # Discard the oldest unsent messages, e.g. stale video frames
+    NEVER_DROP = 'never_drop'    # Keep every message; a client that overflows the buffer is disconnected
+    LATEST = 'latest'            # One-slot mailbox: a new message replaces the one waiting, e.g. per-viewer video frames
+    # Most buffers handed to one sendmsg() call
+    MAX_BUFFERS = 64
+
+    def __init__(self, policy=NEVER_DROP, max_bytes=262144):
+        # Bounded buffer of whole messages waiting to be written to one client
+        self.policy = policy
+        self.max_bytes = max_bytes
+        self.messages = collections.deque()  # (buffers, size) of each message, the first one may be partially sent
+        self.head_offset = 0                 # Bytes of the first message already written
+        self.queued_bytes = 0                # Unsent bytes currently buffered
+        self.high_water = 0                  # Largest number of unsent bytes seen
+        self.dropped = 0                     # Messages discarded by the drop-oldest policy
+        self.sent_bytes = 0                  # Bytes written to the socket
+        self.sent_messages = 0               # Messages written completely
+        self.sent_times = collections.deque(maxlen=30)  # Completion times of the latest messages, for the send rate
+
+    def __len__(self):
+        return len(self.messages)
+
+    def push(self, data):
+        # Queue a message, applying the overflow policy; returns False if the client must be disconnected
+        # A message is a bytes-like object or a tuple of them (e.g. header and frame) that is sent without joining;
+        # each is viewed as bytes, so sizes and partial writes are counted in bytes for any buffer (bytes, bytearray, memoryview, array)
+        parts = tuple(memoryview(part).cast('B') for part in data) if isinstance(data, tuple) else (memoryview(data).cast('B'),)
+        size = sum(len(part) for part in parts)
+        if self.policy == self.LATEST:
+            # Replace whatever is waiting; only a partially written message is kept
+            self.drop_waiting()
+        elif self.queued_bytes + size > self.max_bytes:
+            if self.policy == self.NEVER_DROP:
+                return False
+            self.drop_waiting(self.max_bytes - size)
+        self.messages.append((parts, size))
+        self.queued_bytes += size
+        if self.queued_bytes > self.high_water:
+            self.high_water = self.queued_bytes
+        return True
+
+    def drop_waiting(self, keep_bytes=0):
+        # Drop the oldest waiting messages until at most keep_bytes are queued
+        # Never drop a message that is partially written, it would corrupt the stream
+        first = 1 if self.head_offset else 0
+        while len(self.messages) > first and self.queued_bytes > keep_bytes:
+            parts, size = self.messages[first]
+            del self.messages[first]
+            self.queued_bytes -= size
+            self.dropped += 1
+
+    def pending_buffers(self):
+        # Unsent buffers of the queued messages, in order, without copying them
+        buffers = []
+        skip = self.head_offset
+        for parts, size in self.messages:
+            for part in parts:
+                if skip >= len(part):
+                    skip -= len(part)
+                    continue
+                buffers.append(part[skip:] if skip else part)
+                skip = 0
+                if len(buffers) == self.MAX_BUFFERS:
+                    return buffers, True
+        return buffers, False
+
+    def send(self, client_socket):
+        # Write queued messages until the socket would block; returns True once the queue is empty
+        while self.messages:
+            buffers, more = self.pending_buffers()
+            try:
+                if HAS_SENDMSG:
+                    # One gather syscall for header, frame and anything queued behind them;
+                    # MSG_MORE corks the tail when not everything fit in this call
+                    sent = client_socket.sendmsg(buffers, (), MSG_MORE if more else 0)
+                else:
+                    sent = client_socket.send(buffers[0]) if buffers else 0
+            except BlockingIOError:
+                return False
+            self.sent_bytes += sent
+            self.queued_bytes -= sent
+            sent += self.head_offset
+            while self.messages and sent >= self.messages[0][1]:
+                sent -= self.messages.popleft()[1]
+                self.sent_messages += 1
+                self.sent_times.append(time.monotonic())
+            self.head_offset = sent
+            if self.messages and self.head_offset:
+                return False
+        return True
+
+    def get_rate(self):
+        # Messages (e.g. frames) completed per second over the latest sends, 0 when idle
+        times = self.sent_times
+        if len(times) < 2 or time.monotonic() - times[-1] > 2.0:
+            return 0.0
+        return (len(times) - 1) / (times[-1] - times[0])
+
+    def get_stats(self):
+        # Snapshot of the buffer counters
+        return {'policy': self.policy, 'queued_bytes': self.queued_bytes, 'queued_messages': len(self.messages),
+                'high_water': self.high_water, 'dropped': self.dropped, 'sent_bytes': self.sent_bytes,
+                'sent_messages': self.sent_messages, 'rate': round(self.get_rate(), 1)}
 
 class TCPServer:
-    def __init__(self):
+    def __init__(self, name='tcp', max_queued=0):
+        # Name prefixed to this server's statistics, e.g. 'command' or 'video'
+        self.name = name
         # Initialize server and client sockets
         self.server_socket = None
         self.client_sockets = {}
-        # Message queue for incoming messages
-        self.message_queue = queue.Queue()
+        # Message queue for incoming messages, one (client_address, [messages]) batch per read;
+        # when bounded and full, reading stops and TCP flow control pushes back on the clients
+        self.message_queue = queue.Queue(max_queued)
+        # Streaming framer per client, carrying partial messages over between reads and negotiating binary frames
+        self.framers = {}
+        # Reply to a binary protocol handshake
+        self.protocol_ack = PROTOCOL_ACK
+        # Called with the client address when it completes the handshake, and with the newest sequence number of its binary frames
+        self.on_session = None
+        self.on_sequence = None
         # Maximum number of clients allowed
         self.max_clients = 1
         # Current number of active connections
         self.active_connections = 0
-        # Thread for accepting new connections
+        # Thread running the event loop (accepts, reads and writes)
         self.accept_thread = None
         # Event to signal the server to stop
         self.stop_event = threading.Event()
+        # Selector the sockets are registered with once, instead of rebuilding select() lists
+        self.selector = None
+        # Bounded outbound queue per client, drained by the event loop when the socket becomes writable
+        self.outbound_queues = {}
+        # Overflow policy and size limit of the outbound queues
+        self.send_policy = OutboundQueue.NEVER_DROP
+        self.max_pending_bytes = 262144
+        # Batch of each client whose messages did not fit in the bounded message queue; its reads pause until it is queued
+        self.held_batches = {}
+        # Seconds between attempts to queue the held batches
+        self.held_retry_interval = 0.01
+        # Lock protecting the client tables, the selector registrations and the outbound buffers
+        self.lock = threading.RLock()
         # Pipe for stopping the server
         self.stop_pipe_r, self.stop_pipe_w = socket.socketpair()
         self.stop_pipe_r.setblocking(0)
         self.stop_pipe_w.setblocking(0)
+        # Throughput counters and receive latency, shared with the process-wide stats registry
+        self.received_bytes = registry.counter(name + '.rx_bytes')
+        self.received_messages = registry.counter(name + '.rx_messages')
+        self.sent_bytes = registry.counter(name + '.tx_bytes')
+        self.sent_messages = registry.counter(name + '.tx_messages')
+        self.receive_time = registry.histogram(name + '.receive')
+        registry.gauge(name + '.queue', self.message_queue.qsize)
+        registry.gauge(name + '.clients', lambda: self.active_connections)
 
-    def start(self, ip, port, max_clients=1, listen_count=1):
+    def start(self, ip, port, max_clients=1, listen_count=1, send_policy=OutboundQueue.NEVER_DROP, max_pending_bytes=262144):
         # Set the maximum number of clients
         self.max_clients = max_clients
+        # Set how each client's outbound queue behaves when it is full
+        self.send_policy = send_policy
+        self.max_pending_bytes = max_pending_bytes
         # Create the server socket
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.server_socket.bind((ip, port))
         self.server_socket.listen(listen_count)
         self.server_socket.setblocking(0)
-        print(f"Server started, listening on {ip}:{port}")
+        # Register the listening socket and the stop pipe once; clients are added as they connect
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.server_socket, selectors.EVENT_READ, self.handle_accept)
+        self.selector.register(self.stop_pipe_r, selectors.EVENT_READ, self.handle_stop_pipe)
+        print(f"Server started, listening on {ip}:{self.server_socket.getsockname()[1]}")
 
-        # Start the thread for accepting connections
-        self.accept_thread = threading.Thread(target=self.accept_connections, daemon=True)
+        # Start the thread running the event loop
+        self.accept_thread = threading.Thread(target=self.event_loop, daemon=True)
         self.accept_thread.start()
 
-    def accept_connections(self):
-        # Accept new connections until the server is stopped
+    def event_loop(self):
+        # Dispatch socket events until the server is stopped
         while not self.stop_event.is_set():
-            # Use select to monitor the server socket and the stop pipe
-            readable, writable, exceptional = select.select([self.server_socket, self.stop_pipe_r] + list(self.client_sockets.keys()), [], [])
-            for s in readable:
-                if s == self.server_socket and self.active_connections < self.max_clients:
-                    # Accept a new connection if the maximum number of clients is not reached
-                    client_socket, client_address = s.accept()
-                    client_socket.setblocking(0)
-                    self.client_sockets[client_socket] = client_address
-                    self.active_connections += 1
-                    print(f"New connection from {client_address}, {self.active_connections} active connections.")
-                elif s == self.server_socket and self.active_connections >= self.max_clients:
-                    # Reject new connections if the maximum number of clients is reached
-                    client_socket, client_address = s.accept()
-                    client_socket.close()
-                    print(f"Rejected connection from {client_address}, max connections ({self.max_clients}) reached.")
-                elif s == self.stop_pipe_r:
-                    # Stop the server if the stop pipe is read
-                    self.stop_event.set()
+            # Wake up periodically only while some client's batch is waiting for room in the message queue
+            for key, mask in self.selector.select(self.held_retry_interval if self.held_batches else None):
+                # Each registration carries its own handler, so no per-socket branching is needed
+                key.data(key.fileobj, mask)
+                if self.stop_event.is_set():
                     break
-                else:
-                    try:
-                        # Receive data from the client
-                        data = s.recv(1024)
-                        if data:
-                            client_address = self.client_sockets[s]
-                            self.message_queue.put((client_address, data.decode('utf-8')))
-                        else:
-                            # Remove the client if no data is received
-                            client_address = self.client_sockets[s]
-                            print(client_address, "disconnected")
-                            self.remove_client(s)
-                    except OSError as e:
-                        if e.errno == 9 or e.errno == 32:
-                            # Handle broken pipe errors
-                            client_address = self.client_sockets[s]
-                            print(client_address, "disconnected")
-                            self.remove_client(s)
-                        else:
-                            print(f"Unexpected error: {e}")
-            for s in exceptional:
-                # Handle exceptional conditions
-                client_address = self.client_sockets[s]
-                print(client_address, "disconnected")
-                self.remove_client(s)
-        print("Closing accept_connections...")
+            if self.held_batches:
+                self.retry_held_batches()
+        print("Closing event_loop...")
+
+    def handle_accept(self, server_socket, mask):
+        # Accept one pending connection per event, rejecting it beyond the maximum number of clients;
+        # the listening socket stays readable while more are waiting, so a burst is accepted over a few loop turns
+        # and a lone connection costs no extra accept() failing with BlockingIOError
+        try:
+            client_socket, client_address = server_socket.accept()
+        except BlockingIOError:
+            return
+        with self.lock:
+            if self.active_connections < self.max_clients:
+                client_socket.setblocking(0)
+                self.client_sockets[client_socket] = client_address
+                self.outbound_queues[client_socket] = OutboundQueue(self.send_policy, self.max_pending_bytes)
+                self.framers[client_socket] = ProtocolFramer(self.protocol_ack)
+                self.selector.register(client_socket, selectors.EVENT_READ, self.handle_client)
+                self.active_connections += 1
+                print(f"New connection from {client_address}, {self.active_connections} active connections.")
+                return
+        client_socket.close()
+        print(f"Rejected connection from {client_address}, max connections ({self.max_clients}) reached.")
+
+    def handle_stop_pipe(self, pipe, mask):
+        # Stop the server if the stop pipe is read
+        pipe.recv(64)
+        self.stop_event.set()
+
+    def handle_client(self, client_socket, mask):
+        # Handle readable and writable events of a connected client
+        if mask & selectors.EVENT_WRITE:
+            self.flush_pending_output(client_socket)
+        if mask & selectors.EVENT_READ:
+            self.receive_from_client(client_socket)
+
+    def receive_from_client(self, client_socket):
+        # Receive data from the client and put it into the message queue
+        client_address = self.client_sockets.get(client_socket)
+        if client_address is None:
+            return
+        try:
+            data = client_socket.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            print(client_address, "disconnected", e)
+            self.remove_client(client_socket)
+            return
+        if data:
+            # Queue only complete messages; a partial one waits in the framer for the next read
+            start = time.perf_counter()
+            self.received_bytes.increment(len(data))
+            with self.lock:
+                # Another thread may have removed the client since the read
+                framer = self.framers.get(client_socket)
+            if framer is None:
+                return
+            messages = framer.feed(data)
+            if framer.reply is not None:
+                # Acknowledge a protocol handshake before any reply to the commands that follow it
+                try:
+                    self.send_to_socket(client_socket, framer.reply)
+                except OSError as e:
+                    print(f"Error sending data to {client_address}: {e}")
+                    self.remove_client(client_socket)
+                    return
+                framer.reply = None
+                if client_socket not in self.client_sockets:
+                    return  # Disconnected by send_to_socket, e.g. its output buffer overflowed
+                if self.on_session is not None:
+                    self.on_session(client_address)
+            if framer.binary and messages and self.on_sequence is not None:
+                self.on_sequence(client_address, framer.framer.sequence)
+            if messages:
+                self.queue_messages(client_socket, (client_address, messages))
+                self.received_messages.increment(len(messages))
+            self.receive_time.record(time.perf_counter() - start)
+        else:
+            # Remove the client if no data is received
+            print(client_address, "disconnected")
+            self.remove_client(client_socket)
+
+    def set_message_queue(self, message_queue):
+        # Replace the queue complete messages are put on, e.g. with a command queue that has a priority lane
+        self.message_queue = message_queue
+        registry.gauge(self.name + '.queue', message_queue.qsize)
+
+    def queue_messages(self, client_socket, batch):
+        # Hand a batch to the consumer without ever blocking the event loop; when a bounded queue is full the batch
+        # is held and only this client's reads pause, so TCP flow control pushes back on it while the others are served
+        try:
+            self.message_queue.put_nowait(batch)
+        except queue.Full as full:
+            with self.lock:
+                if client_socket in self.client_sockets:
+                    # A CommandQueue queues the stops at once and hands back only the commands it could not take
+                    self.held_batches[client_socket] = getattr(full, 'remainder', batch)
+                    self.update_events(client_socket)
+
+    def retry_held_batches(self):
+        # Queue the held batches in the order they were held, resuming the reads of each client whose batch fits
+        with self.lock:
+            for client_socket, batch in list(self.held_batches.items()):
+                try:
+                    self.message_queue.put_nowait(batch)
+                except queue.Full as full:
+                    self.held_batches[client_socket] = getattr(full, 'remainder', batch)
+                    return
+                del self.held_batches[client_socket]
+                self.update_events(client_socket)
+
+    def update_events(self, client_socket):
+        # Watch a client for reads unless its batch is held, and for writes while it has buffered output;
+        # called with the lock held
+        events = 0 if client_socket in self.held_batches else selectors.EVENT_READ
+        if self.outbound_queues.get(client_socket):
+            events |= selectors.EVENT_WRITE
+        try:
+            registered = self.selector.get_key(client_socket).events
+        except KeyError:
+            registered = 0
+        if events == registered:
+            return
+        if not events:
+            self.selector.unregister(client_socket)
+        elif not registered:
+            self.selector.register(client_socket, events, self.handle_client)
+        else:
+            self.selector.modify(client_socket, events, self.handle_client)
+
+    def flush_pending_output(self, client_socket):
+        # Write as much buffered output as the socket accepts, then stop watching for writability
+        with self.lock:
+            outbound = self.outbound_queues.get(client_socket)
+            if outbound is None:
+                return
+            try:
+                drained = outbound.send(client_socket)
+            except OSError as e:
+                print(f"Error sending data to {self.client_sockets[client_socket]}: {e}")
+                self.remove_client(client_socket)
+                return
+            if drained:
+                self.update_events(client_socket)
 
     def stop_pipe(self):
         # Send a byte to the stop pipe to signal the server to stop
         self.stop_pipe_w.send(b'\x00')
 
+    def send_to_socket(self, client_socket, data):
+        # Queue data without blocking; a socket that cannot take it all now is drained by the event loop
+        with self.lock:
+            outbound = self.outbound_queues.get(client_socket)
+            if outbound is None:
+                return
+            was_empty = not outbound
+            self.sent_bytes.increment(sum(memoryview(part).nbytes for part in data) if isinstance(data, tuple) else memoryview(data).nbytes)
+            self.sent_messages.increment()
+            if not outbound.push(data):
+                print(f"Output buffer of {self.client_sockets[client_socket]} exceeded {outbound.max_bytes} bytes, disconnecting.")
+                self.remove_client(client_socket)
+                return
+            if was_empty and not outbound.send(client_socket):
+                self.update_events(client_socket)
+
     def send_to_all_client(self, message):
         # Send a message to all connected clients
+        if isinstance(message, str):
+            message = message.encode('utf-8')
         for client_socket in list(self.client_sockets.keys()):
             try:
-                if isinstance(message, str):
-                    encoded_message = message.encode('utf-8')
-                else:
-                    encoded_message = message
-                client_socket.sendall(encoded_message)
+                self.send_to_socket(client_socket, message)
             except socket.error as e:
-                print(f"Error sending data to {self.client_sockets[client_socket]}: {e}")
+                print(f"Error sending data to {self.client_sockets.get(client_socket)}: {e}")
                 self.remove_client(client_socket)
 
     def send_to_client(self, client_address, message):
         # Send a message to a specific client
-        for client_socket, addr in self.client_sockets.items():
+        for client_socket, addr in list(self.client_sockets.items()):
             if addr == client_address:
                 try:
                     if isinstance(message, str):
-                        encoded_message = message.encode('utf-8')
-                    else:
-                        encoded_message = message
-                    client_socket.sendall(encoded_message)
+                        message = message.encode('utf-8')
+                    self.send_to_socket(client_socket, message)
                 except socket.error as e:
                     print(f"Error sending data to {client_address}: {e}")
                     self.remove_client(client_socket)
@@ -124,27 +395,47 @@ class TCPServer:
 
     def remove_client(self, client_socket):
         # Remove a client from the server
-        if client_socket in self.client_sockets:
-            del self.client_sockets[client_socket]
-            client_socket.close()
-            self.active_connections -= 1
+        with self.lock:
+            if client_socket in self.client_sockets:
+                del self.client_sockets[client_socket]
+                self.outbound_queues.pop(client_socket, None)
+                self.framers.pop(client_socket, None)
+                self.held_batches.pop(client_socket, None)
+                try:
+                    self.selector.unregister(client_socket)
+                except (KeyError, ValueError):
+                    pass
+                client_socket.close()
+                self.active_connections -= 1
 
     def close(self):
         # Close the server and all client connections
+        self.stop_event.set()
         self.stop_pipe()
         if self.accept_thread is not None:
             self.accept_thread.join()
+        with self.lock:
+            for s in list(self.client_sockets):
+                self.remove_client(s)
+            if self.selector is not None:
+                self.selector.close()
         if self.server_socket is not None:
             self.server_socket.close()
-        for s in list(self.client_sockets):
-            s.close()
-        self.client_sockets.clear()
         print("Server stopped.")
 
     def get_client_ips(self):
         # Get a list of IP addresses of connected clients
         return [addr[0] for addr in self.client_sockets.values()]
 
+    def get_client_addresses(self):
+        # Get a list of (ip, port) addresses of connected clients
+        return list(self.client_sockets.values())
+
+    def get_client_stats(self):
+        # Get the outbound queue counters of each connected client
+        with self.lock:
+            return {self.client_sockets[s]: outbound.get_stats() for s, outbound in self.outbound_queues.items()}
+
 def get_interface_ip():
     # Get the IP address of the specified network interface
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -159,11 +450,11 @@ if __name__ == "__main__":
     try:
         while True:
             # Process incoming messages
-            while not server.message_queue.empty():
-                client_address, message = server.message_queue.get()
+            client_address, messages = server.message_queue.get()
+            for message in messages:
                 print(f"Received message from {client_address}: {message}")
-                server.send_to_client(client_address, message)
+                server.send_to_client(client_address, message + "\n")
     except KeyboardInterrupt:
         print("Server interrupted by user.")
     finally:
-        server.close()
\ No newline at end of file
+        server.close()
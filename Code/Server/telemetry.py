@@ -0,0 +1,166 @@
+import heapq
+import threading
+import time
+from stats import registry
+
+# Sensor ids used by CMD_SUBSCRIBE#<sensor>#<period ms>#<deadband in hundredths>
+SENSOR_SONIC = 0
+SENSOR_LIGHT = 1
+SENSOR_LINE = 2
+SENSOR_POWER = 3
+
+class Subscription:
+    def __init__(self, client_address: tuple, sensor: int, period: float, deadband: float):
+        """One client's request for periodic updates of one sensor."""
+        self.client_address = client_address
+        self.sensor = sensor
+        self.period = period            # Seconds between checks of the sensor
+        self.deadband = deadband        # Smallest change that is pushed
+        self.next_due = time.monotonic()
+        self.last_value = None          # Last value pushed to the client
+
+    def changed(self, value: tuple) -> bool:
+        """Check whether a reading differs from the last pushed one by more than the deadband."""
+        if self.last_value is None:
+            return True
+        return any(abs(new - old) > self.deadband for new, old in zip(value, self.last_value))
+
+class TelemetryScheduler:
+    def __init__(self, send, connected_clients=None):
+        """Push subscribed sensor readings to clients from a single scheduling thread."""
+        self.send = send                          # Called with (message, client_address)
+        self.connected_clients = connected_clients  # Callable returning the addresses still connected
+        self.sensors = {}                         # sensor id -> (reader returning a tuple, formatter returning the message)
+        self.subscriptions = {}                   # (client_address, sensor) -> Subscription
+        self.schedule = []                        # Heap of (next_due, sequence, subscription)
+        self.sequence = 0                         # Tie breaker for subscriptions due at the same time
+        self.condition = threading.Condition()
+        self.thread = None
+        self.running = False
+        self.reads = registry.counter('telemetry.reads')            # Sensor reads performed
+        self.pushes = registry.counter('telemetry.pushes')          # Updates sent to clients
+        self.suppressed = registry.counter('telemetry.suppressed')  # Due updates skipped because the value stayed inside the deadband
+        registry.gauge('telemetry.subscriptions', lambda: len(self.subscriptions))
+
+    def register_sensor(self, sensor: int, reader, formatter) -> None:
+        """Make a sensor available for subscriptions."""
+        self.sensors[sensor] = (reader, formatter)
+
+    def subscribe(self, client_address: tuple, sensor: int, period_ms: int, deadband_hundredths: int = 0) -> bool:
+        """Add, change or (with a period of 0) remove a subscription."""
+        if sensor not in self.sensors:
+            print(f"Unknown telemetry sensor: {sensor}")
+            return False
+        with self.condition:
+            old = self.subscriptions.pop((client_address, sensor), None)
+            if old is not None:
+                old.period = None                 # Entries of a replaced subscription are skipped by the scheduler
+            if period_ms > 0:
+                subscription = Subscription(client_address, sensor, max(period_ms, 20) / 1000.0, max(deadband_hundredths, 0) / 100.0)
+                self.subscriptions[(client_address, sensor)] = subscription
+                self.push_schedule(subscription)
+            self.condition.notify()
+        return True
+
+    def unsubscribe_client(self, client_address: tuple) -> None:
+        """Remove every subscription of a client."""
+        with self.condition:
+            for key in [key for key in self.subscriptions if key[0] == client_address]:
+                self.subscriptions.pop(key).period = None
+
+    def push_schedule(self, subscription: Subscription) -> None:
+        self.sequence += 1
+        heapq.heappush(self.schedule, (subscription.next_due, self.sequence, subscription))
+
+    def start(self) -> None:
+        """Start the scheduling thread."""
+        if self.thread is None or not self.thread.is_alive():
+            self.running = True
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def stop(self, close_time: float = 0.3) -> None:
+        """Stop the scheduling thread and drop all subscriptions."""
+        with self.condition:
+            self.running = False
+            self.subscriptions.clear()
+            self.schedule.clear()
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join(close_time)
+            self.thread = None
+
+    def take_due(self) -> list:
+        """Wait until at least one subscription is due and return all due subscriptions."""
+        with self.condition:
+            while self.running:
+                while self.schedule and self.schedule[0][2].period is None:
+                    heapq.heappop(self.schedule)  # Cancelled subscription
+                if not self.schedule:
+                    self.condition.wait()
+                    continue
+                delay = self.schedule[0][0] - time.monotonic()
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+                now = time.monotonic()
+                due = []
+                while self.schedule and self.schedule[0][0] <= now:
+                    subscription = heapq.heappop(self.schedule)[2]
+                    if subscription.period is None:
+                        continue
+                    due.append(subscription)
+                    # Keep the cadence, but never try to catch up on missed periods
+                    subscription.next_due += subscription.period
+                    if subscription.next_due < now:
+                        subscription.next_due = now + subscription.period
+                    self.push_schedule(subscription)
+                return due
+            return []
+
+    def run(self) -> None:
+        while self.running:
+            due = self.take_due()
+            if not due:
+                continue
+            connected = set(self.connected_clients()) if self.connected_clients is not None else None
+            readings = {}
+            for subscription in due:
+                if connected is not None and subscription.client_address not in connected:
+                    self.unsubscribe_client(subscription.client_address)
+                    continue
+                # Subscribers due in the same tick share one read of the sensor
+                if subscription.sensor not in readings:
+                    reader, formatter = self.sensors[subscription.sensor]
+                    try:
+                        reading = reader()  # None when there is no fresh value
+                        readings[subscription.sensor] = tuple(reading) if reading is not None else None
+                        self.reads.increment()
+                    except Exception as e:
+                        print(f"Error reading telemetry sensor {subscription.sensor}: {e}")
+                        readings[subscription.sensor] = None
+                value = readings[subscription.sensor]
+                if value is None:
+                    continue
+                if not subscription.changed(value):
+                    self.suppressed.increment()
+                    continue
+                subscription.last_value = value
+                self.pushes.increment()
+                self.send(self.sensors[subscription.sensor][1](value), subscription.client_address)
+
+    def get_stats(self) -> dict:
+        """Get the subscription and push counters."""
+        return {'subscriptions': len(self.subscriptions), 'reads': self.reads.get(), 'pushes': self.pushes.get(), 'suppressed': self.suppressed.get()}
+
+if __name__ == '__main__':
+    import random
+    print('Program is starting ... ')
+    scheduler = TelemetryScheduler(lambda message, client_address: print(client_address, message.strip()))
+    scheduler.register_sensor(SENSOR_SONIC, lambda: (round(random.choice((30.0, 30.2, 45.0)), 1),), lambda value: "CMD_MODE#3#{:.2f}\n".format(*value))
+    scheduler.start()
+    scheduler.subscribe(('127.0.0.1', 1), SENSOR_SONIC, 100, 50)
+    time.sleep(2)
+    scheduler.stop()
+    print(scheduler.get_stats())
+    print(registry.format_snapshot())
@@ -142,6 +142,508 @@ def test_Buzzer():
         buzzer.set_state(False)
     finally:
         print ("\nEnd of program")
+
+def test_Framer():
+    import random
+    import socket
+    import time
+    from framer import LineFramer
+    from tcp_server import TCPServer
+    random.seed(1)
+    commands = ["CMD_MOTOR#{}#{}#{}#{}".format(*(random.randint(-4095, 4095) for _ in range(4))) for _ in range(2000)]
+    commands += ["CMD_LED#0#255#0#0#15", "CMD_MODE#one", "CMD_SERVO#0#90", "CMD_LED#\u00e9\u20ac\U0001f697"]
+    random.shuffle(commands)
+    stream = "".join(command + "\n" for command in commands).encode('utf-8')
+    print ("Program is starting ...")
+    # Feed the framer the same stream cut at random points, including inside multibyte characters
+    for trial in range(200):
+        framer = LineFramer()
+        received = []
+        position = 0
+        while position < len(stream):
+            size = random.choice((1, 2, 3, random.randint(1, 64), random.randint(64, 4096)))
+            received.extend(framer.feed(stream[position:position + size]))
+            position += size
+        assert received == commands, "framer output differs on trial {}".format(trial)
+    print ("Framer: 200 randomly fragmented streams reassembled")
+    # Send fragmented and coalesced writes through a real TCPServer on the loopback interface
+    server = TCPServer()
+    server.start('127.0.0.1', 0)
+    client = socket.create_connection(('127.0.0.1', server.server_socket.getsockname()[1]))
+    client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    position = 0
+    while position < len(stream):
+        size = random.randint(1, 512)
+        client.sendall(stream[position:position + size])
+        position += size
+        if random.random() < 0.05:
+            time.sleep(0.001)
+    received = []
+    while len(received) < len(commands):
+        client_address, messages = server.message_queue.get(timeout=5)
+        received.extend(messages)
+    client.close()
+    server.close()
+    assert received == commands, "TCPServer delivered a broken command"
+    print ("TCPServer: {} commands delivered intact".format(len(commands)))
+    print ("\nEnd of program")
+
+def test_UdpControl():
+    import random
+    import socket
+    import time
+    from protocol import encode_command
+    from udp_server import UDPControlServer
+    random.seed(3)
+    applied = []
+    server = UDPControlServer()
+    server.start('127.0.0.1', 0, lambda client_address, messages: applied.extend(messages))
+    address = ('127.0.0.1', server.udp_socket.getsockname()[1])
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    print ("Program is starting ...")
+    # Lossy, reordering link: 20% of the packets are lost and the rest are shuffled in windows of up to 8
+    sequences = list(range(1, 2001))
+    delivered = [sequence for sequence in sequences if random.random() >= 0.2]
+    reordered = []
+    for start in range(0, len(delivered), 8):
+        window = delivered[start:start + 8]
+        random.shuffle(window)
+        reordered.extend(window)
+    for sequence in reordered:
+        client.sendto(encode_command("CMD_MOTOR", (sequence % 4096, 0, 0, 0), sequence), address)
+        if random.random() < 0.1:
+            time.sleep(0.001)
+    time.sleep(0.2)
+    stats = server.get_stats()
+    client.close()
+    server.close()
+    values = [parameters[0] for command, parameters in applied]
+    assert all(later > earlier for earlier, later in zip(values, values[1:])), "an older setpoint was applied after a newer one"
+    assert values[-1] == max(delivered) % 4096, "the newest setpoint was not applied last"
+    assert stats['received'] == len(reordered)
+    print ("Sent {}, lost {}, received {}".format(len(sequences), len(sequences) - len(delivered), stats['received']))
+    print ("Applied {}, superseded {}, out of order {}".format(stats['applied'], stats['superseded'], stats['out_of_order']))
+    # Sequence numbers start over only with a new session, never after silence, and a stop sent over TCP
+    # outdates every older setpoint still in flight on UDP
+    applied.clear()
+    server = UDPControlServer()
+    server.start('127.0.0.1', 0, lambda client_address, messages: applied.extend(messages))
+    address = ('127.0.0.1', server.udp_socket.getsockname()[1])
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    session = ('127.0.0.1', 50000)
+    def drive(speed, sequence):
+        client.sendto(encode_command("CMD_MOTOR", (speed, speed, speed, speed), sequence), address)
+        time.sleep(0.05)
+    drive(1000, 100)
+    drive(0, 101)                       # The stop
+    time.sleep(2.5)
+    drive(1000, 100)                    # A late duplicate of the drive packet
+    server.note_sequence(session, 103)  # A stop over TCP whose UDP copy was lost
+    drive(1000, 102)                    # A drive packet sent before it, delayed on the way
+    server.reset_client(session)        # The client reconnects and numbers from 1 again
+    drive(500, 1)
+    client.close()
+    server.close()
+    speeds = [parameters[0] for command, parameters in applied]
+    assert speeds == [1000, 0, 500], "applied {}".format(speeds)
+    print ("Late and outdated drive packets dropped, new session accepted: {}".format(speeds))
+    print ("\nEnd of program")
+
+def _parse_command(message):
+    fields = message.split('#')
+    return fields[0], [int(x) for x in fields[1:]]
+
+def _classify_command(command, parameters):
+    # The lanes main.py's classify_command gives each command
+    from pipeline import PRIORITY, MOTION
+    if command in ("CMD_MOTOR", "CMD_M_MOTOR", "CMD_CAR_ROTATE"):
+        speeds = parameters if command == "CMD_MOTOR" else parameters[1::2]
+        return PRIORITY if not any(speeds) else MOTION
+    if command == "CMD_MODE":
+        return PRIORITY if parameters[0] == 0 else MOTION
+    return None
+
+def test_ModeStop():
+    import queue
+    import time
+    from pipeline import CommandPipeline, CommandQueue
+    # Mode changes queued before a stop must not run after it; any stop leaves the car in manual mode (1)
+    cases = [["CMD_MODE#3", "CMD_MODE#0"], ["CMD_MODE#2", "CMD_MOTOR#0#0#0#0"], ["CMD_MODE#1", "CMD_LED#1#0#0#0", "CMD_MODE#0"]]
+    print ("Program is starting ...")
+    for separate in (False, True):
+        for messages in cases:
+            modes = []
+            def handler(client_address, command, parameters):
+                if command == "CMD_MODE":
+                    modes.append(1 if parameters[0] == 0 else parameters[0] + 1)
+                elif command == "CMD_MOTOR":
+                    modes.append(1)  # on_motor switches to manual
+            commands = CommandQueue(4, _parse_command, _classify_command)
+            batches = [[message] for message in messages] if separate else [messages]
+            for batch in batches:
+                commands.put((('127.0.0.1', 1), batch))
+            pipeline = CommandPipeline(handler, None, None, _classify_command)
+            pipeline.start(commands)
+            time.sleep(0.1)
+            pipeline.stop()
+            assert modes and modes[-1] == 1, "{} in {} left the car in mode {}".format(
+                messages, "separate batches" if separate else "one batch", modes[-1] if modes else None)
+            print ("{:<50} modes applied {}".format(" ".join(messages), modes))
+    # A client sending batches that each hold a stop still fills the normal lane only up to its bound
+    commands = CommandQueue(4, _parse_command, _classify_command)
+    for _ in range(4):
+        commands.put((('127.0.0.1', 1), ["CMD_LED#1#0#0#0", "CMD_MOTOR#0#0#0#0"]))
+    try:
+        commands.put((('127.0.0.1', 1), ["CMD_LED#1#0#0#0", "CMD_MOTOR#0#0#0#0"]), timeout=0.05)
+        assert False, "the normal lane grew past its bound"
+    except queue.Full:
+        pass
+    print ("Normal lane held at {} batches with stops in every batch".format(len(commands.normal)))
+    print ("\nEnd of program")
+
+def test_Backpressure():
+    import socket
+    import time
+    from tcp_server import TCPServer
+    print ("Program is starting ...")
+    # Nothing consumes the bounded queue at first: the flooding client's reads must pause, not the event loop
+    server = TCPServer('backpressure', 2)
+    server.start('127.0.0.1', 0, 3)
+    port = server.server_socket.getsockname()[1]
+    flooder = socket.create_connection(('127.0.0.1', port))
+    flooder.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    commands = ["CMD_MOTOR#{}#0#0#0".format(i) for i in range(200)]
+    for command in commands:
+        flooder.sendall((command + "\n").encode('utf-8'))
+        time.sleep(0.0005)
+    time.sleep(0.2)
+    assert server.message_queue.full() and server.held_batches, "the flooding client was never held back"
+    # The event loop still accepts, reads nothing more from the held client, and writes to everyone
+    viewer = socket.create_connection(('127.0.0.1', port))
+    viewer.settimeout(2)
+    deadline = time.monotonic() + 2
+    while len(server.get_client_addresses()) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(server.get_client_addresses()) == 2, "a connection was not accepted while the queue was full"
+    server.send_to_client(viewer.getsockname(), "CMD_POWER#8.4\n")
+    assert viewer.recv(64) == b"CMD_POWER#8.4\n", "a reply was not sent while the queue was full"
+    print ("Queue full: {} batch held, new connection accepted, reply sent".format(len(server.held_batches)))
+    # Once the consumer catches up every command arrives, in order
+    received = []
+    while len(received) < len(commands):
+        client_address, messages = server.message_queue.get(timeout=2)
+        received.extend(messages)
+    assert received == commands, "commands were lost or reordered under backpressure"
+    assert not server.held_batches, "a batch is still held after the queue drained"
+    print ("All {} commands delivered in order after the queue drained".format(len(received)))
+    flooder.close()
+    viewer.close()
+    server.close()
+    print ("\nEnd of program")
+
+def test_Ranging():
+    import threading
+    import time
+    from ultrasonic import RangingService
+    print ("Program is starting ...")
+    scene = {30: 40.0, 90: 120.0, 150: 25.0}
+    class Sonic:
+        # Pings on its own thread every 60 ms like gpiozero's DistanceSensor; the servo takes 100 ms to turn
+        def __init__(self):
+            self.angle, self.previous, self.moved = 90, 90, 0.0
+            self.echo = None
+            self.running = True
+            threading.Thread(target=self.run, daemon=True).start()
+        def turn(self, angle):
+            self.previous = self.angle if time.monotonic() - self.moved >= 0.1 else self.previous
+            self.angle, self.moved = angle, time.monotonic()
+        def run(self):
+            while self.running:
+                time.sleep(0.06)
+                triggered = time.monotonic()
+                facing = self.angle if triggered - self.moved >= 0.1 else self.previous
+                time.sleep(2 * scene[facing] / 34300)
+                self.echo = (scene[facing], triggered)
+        def get_echo(self):
+            return self.echo
+    sonic = Sonic()
+    ranger = RangingService(sonic)
+    ranger.start()
+    # Sweep faster than the servo settles on some steps; every result must come from a ping at its own angle
+    wrong = []
+    checked = 0
+    for step in range(24):
+        angle = (30, 90, 150, 90)[step % 4]
+        sonic.turn(angle)
+        ranger.aim(angle)
+        end = time.monotonic() + (0.08 if step % 3 == 0 else 0.25)
+        while time.monotonic() < end:
+            result = ranger.latest()
+            if result is not None:
+                checked += 1
+                if result.distance != scene[result.angle]:
+                    wrong.append(result)
+            time.sleep(0.005)
+    ranger.stop()
+    sonic.running = False
+    stats = ranger.get_stats()
+    print ("{} results checked, {} pings, {} taken while turning ignored".format(checked, stats['pings'], stats['unsettled']))
+    assert stats['unsettled'] > 0, "no ping was taken while the servo was turning"
+    assert not wrong, "ranges tagged with the wrong angle: {}".format(wrong[:3])
+    print ("\nEnd of program")
+
+def test_HeldRetry():
+    from pipeline import CommandQueue, BatchFull
+    print ("Program is starting ...")
+    parsed = []
+    def parse(message):
+        parsed.append(message)
+        return _parse_command(message)
+    # Capacity 1, the normal lane already full
+    commands = CommandQueue(1, parse, _classify_command)
+    commands.put((('127.0.0.1', 1), ["CMD_LED#0#0#0#0"]))
+    purged = commands.purged.get()
+    try:
+        commands.put_nowait((('127.0.0.1', 1), ["CMD_MOTOR#0#0#0#0", "CMD_LED#1#0#0#0"]))
+        assert False, "a full queue took the batch"
+    except BatchFull as full:
+        held = full.remainder
+    assert held[1] == [("CMD_LED", [1, 0, 0, 0])], "held {}".format(held)
+    # The stop went ahead at once; the consumer takes it and the old LED batch, then a newer drive setpoint arrives
+    assert commands.get_nowait()[1] == [("CMD_MOTOR", [0, 0, 0, 0])]
+    assert commands.get_nowait()[1] == [("CMD_LED", [0, 0, 0, 0])]
+    commands.put((('127.0.0.2', 1), ["CMD_MOTOR#1000#1000#1000#1000"]))
+    # Retrying the held part queues only what was not queued: no second stop, nothing purged, nothing parsed again
+    commands.get_nowait()
+    commands.put_nowait(held)
+    assert not commands.has_priority(), "the stop was queued twice"
+    assert commands.purged.get() == purged, "the retry purged the newer setpoint"
+    assert commands.get_nowait()[1] == [("CMD_LED", [1, 0, 0, 0])]
+    assert len(parsed) == 4, "{} messages parsed for 4 received".format(len(parsed))
+    print ("Full, then retried: stop applied once, newer setpoint kept, {} parses for 4 messages".format(len(parsed)))
+    print ("\nEnd of program")
+
+def test_AsyncServer():
+    import asyncio
+    import socket
+    from async_server import AsyncTCPServer, echo_messages
+    from protocol import PROTOCOL_HANDSHAKE, PROTOCOL_ACK, encode_command
+    print ("Program is starting ...")
+    async def run():
+        server = AsyncTCPServer('asynctest', 1)
+        await server.start('127.0.0.1', 0, max_clients=2)
+        port = server.server.sockets[0].getsockname()[1]
+        echo = asyncio.ensure_future(echo_messages(server, lambda message, client_address: server.send_to_client(client_address, message)))
+        loop = asyncio.get_running_loop()
+        def exchange():
+            # A text client and a binary client, framed by the same ProtocolFramer as TCPServer
+            text = socket.create_connection(('127.0.0.1', port))
+            text.sendall(b"CMD_LED#1#255#0#0\n")
+            text_reply = text.makefile('rb').readline()
+            binary = socket.create_connection(('127.0.0.1', port))
+            binary.sendall((PROTOCOL_HANDSHAKE + "\n").encode('utf-8') + encode_command("CMD_MOTOR", [1000, 1000, -1000, -1000], 1))
+            reader = binary.makefile('rb')
+            ack = reader.read(len(PROTOCOL_ACK))
+            binary_reply = reader.readline()
+            text.close()
+            binary.close()
+            return text_reply, ack, binary_reply
+        text_reply, ack, binary_reply = await loop.run_in_executor(None, exchange)
+        echo.cancel()
+        await server.close()
+        return text_reply, ack, binary_reply
+    text_reply, ack, binary_reply = asyncio.run(run())
+    assert text_reply == b"CMD_LED#1#255#0#0\n", text_reply
+    assert ack == PROTOCOL_ACK, ack
+    assert binary_reply == b"CMD_MOTOR#1000#1000#-1000#-1000\n", binary_reply
+    print ("Text echoed {!r}, handshake acknowledged, binary frame echoed {!r}".format(text_reply, binary_reply))
+    print ("\nEnd of program")
+
+def test_VideoFrames():
+    import socket
+    import struct
+    from tcp_server import OutboundQueue
+    print ("Program is starting ...")
+    # A small send buffer forces partial sendmsg() writes that end inside headers and frames alike
+    sender, viewer = socket.socketpair()
+    sender.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+    sender.setblocking(False)
+    outbound = OutboundQueue(OutboundQueue.NEVER_DROP, 1 << 24)
+    frames = [bytes([index % 251]) * (1000 + index * 977 % 20000) for index in range(200)]
+    for frame in frames:
+        outbound.push((struct.pack('<I', len(frame)), memoryview(frame)))
+    assert outbound.queued_bytes == sum(len(frame) + 4 for frame in frames)
+    received = bytearray()
+    while not outbound.send(sender):
+        received += viewer.recv(1 << 16)
+    sender.close()
+    while True:
+        data = viewer.recv(1 << 16)
+        if not data:
+            break
+        received += data
+    viewer.close()
+    offset = 0
+    for frame in frames:
+        length, = struct.unpack_from('<I', received, offset)
+        assert received[offset + 4:offset + 4 + length] == frame, "frame at byte {} corrupted".format(offset)
+        offset += 4 + length
+    assert offset == len(received) and outbound.sent_messages == len(frames) and outbound.queued_bytes == 0
+    print ("{} frames, {} bytes through partial sendmsg() writes, stream intact".format(len(frames), offset))
+    print ("\nEnd of program")
+
+def test_CombinedWriteError():
+    import threading
+    import time
+    from pca9685 import PCA9685
+    print ("Program is starting ...")
+    class FailingBus:
+        # Block writes take 5 ms, so callers queue behind the first one, and then fail
+        def __init__(self):
+            self.writes = 0
+        def write_byte_data(self, address, register, value):
+            pass
+        def write_i2c_block_data(self, address, register, data):
+            self.writes += 1
+            time.sleep(0.005)
+            raise OSError(121, "Remote I/O error")
+    bus = FailingBus()
+    pwm = PCA9685(0x40, bus=bus)
+    errors = {}
+    def update(channel):
+        try:
+            pwm.set_pwm(channel, 0, 1000 + channel)
+            errors[channel] = None
+        except OSError as e:
+            errors[channel] = e
+    threads = [threading.Thread(target=update, args=(channel,)) for channel in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    combined = pwm.combined.get()
+    assert combined > 0, "no update was carried by another caller's write"
+    assert all(isinstance(error, OSError) for error in errors.values()), errors
+    assert not pwm.shadow, "failed channels left in the shadow copy"
+    print ("{} callers, {} block writes, {} combined: every caller saw the OSError".format(len(errors), bus.writes, combined))
+    print ("\nEnd of program")
+
+def test_Opcodes():
+    import importlib.util
+    import os
+    from protocol import BinaryFramer, COMMAND_OPCODES, OPCODES
+    print ("Program is starting ...")
+    # The desktop client loads the server's opcodes.py; its tables and frames must match the server's
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Client', 'Protocol.py')
+    spec = importlib.util.spec_from_file_location('client_protocol', path)
+    client = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(client)
+    assert client.OPCODES == {command: (opcode, count) for opcode, (command, count) in OPCODES.items()}, client.OPCODES
+    framer = BinaryFramer()
+    for sequence, (command, opcode) in enumerate(sorted(COMMAND_OPCODES.items())):
+        parameters = [index * 100 - 150 for index in range(OPCODES[opcode][1])]
+        message = "#".join([command] + [str(x) for x in parameters])
+        decoded = framer.feed(client.encode(message, sequence))
+        assert decoded == [(command, parameters)], "{} decoded as {}".format(message, decoded)
+    print ("{} opcodes shared with the client, every command decoded as sent".format(len(OPCODES)))
+    print ("\nEnd of program")
+
+def test_HandshakeError():
+    import socket
+    import time
+    from tcp_server import TCPServer
+    from protocol import PROTOCOL_HANDSHAKE
+    print ("Program is starting ...")
+    server = TCPServer('handshaketest')
+    server.start('127.0.0.1', 0, 2)
+    port = server.server_socket.getsockname()[1]
+    send_to_socket = server.send_to_socket
+    def failing_send(client_socket, data):
+        # The reply to a handshake hits a connection reset
+        raise ConnectionResetError(104, "Connection reset by peer")
+    server.send_to_socket = failing_send
+    client = socket.create_connection(('127.0.0.1', port))
+    client.sendall((PROTOCOL_HANDSHAKE + "\n").encode('utf-8'))
+    deadline = time.monotonic() + 2
+    while server.client_sockets and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not server.client_sockets, "the client was not dropped"
+    # The event loop survived and still serves other clients
+    server.send_to_socket = send_to_socket
+    other = socket.create_connection(('127.0.0.1', port))
+    other.sendall(b"CMD_POWER\n")
+    client_address, messages = server.message_queue.get(timeout=2)
+    assert messages == ["CMD_POWER"], messages
+    client.close()
+    other.close()
+    server.close()
+    print ("Failed handshake reply dropped that client, the event loop kept serving: {}".format(messages))
+    print ("\nEnd of program")
+
+def test_StopLatency():
+    import bisect
+    import socket
+    import threading
+    import time
+    from pipeline import CommandPipeline, CommandQueue
+    from tcp_server import TCPServer
+    parse, classify = _parse_command, _classify_command
+    def key(command, parameters):
+        return 'motor' if command in ("CMD_MOTOR", "CMD_M_MOTOR", "CMD_CAR_ROTATE") else None
+    # Stand-in hardware: motor writes 2 ms, an ultrasonic query up to 10 ms, LED updates 0.2 ms
+    costs = {"CMD_MOTOR": 0.002, "CMD_M_MOTOR": 0.002, "CMD_SONIC": 0.010, "CMD_LED": 0.0002}
+    def run(priority):
+        stop_sent = []
+        stop_applied = []
+        def handler(client_address, command, parameters):
+            if command == "CMD_MOTOR" and not any(parameters):
+                stop_applied.append(time.perf_counter())
+            time.sleep(costs.get(command, 0))
+        server = TCPServer('stoptest', 256)
+        if priority:
+            server.set_message_queue(CommandQueue(256, parse, classify))
+            pipeline = CommandPipeline(handler, None, key, classify)
+        else:
+            pipeline = CommandPipeline(handler, parse, key)
+        server.start('127.0.0.1', 0)
+        pipeline.start(server.message_queue)
+        client = socket.create_connection(('127.0.0.1', server.server_socket.getsockname()[1]))
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # Flood: drive, LED animation and sensor polling far faster than the hardware takes them,
+        # with a stop every 150 ms after which the client stops sending motion for a while
+        end = time.perf_counter() + 3.0
+        frame = 0
+        while time.perf_counter() < end:
+            for _ in range(10):
+                frame += 1
+                client.sendall("CMD_M_MOTOR#{}#2000#0#0\nCMD_LED#1#{}#0#0\nCMD_SONIC#1\n".format(frame % 360, frame % 256).encode('utf-8'))
+                time.sleep(0.01)
+            stop_sent.append(time.perf_counter())
+            client.sendall(b"CMD_MOTOR#0#0#0#0\n")
+            for _ in range(5):
+                frame += 1
+                client.sendall("CMD_LED#1#{}#0#0\nCMD_SONIC#1\n".format(frame % 256).encode('utf-8'))
+                time.sleep(0.01)
+        time.sleep(1.0)
+        client.close()
+        pipeline.stop(0.1)
+        server.close()
+        # Time from each stop being sent until the motors were next stopped
+        latencies = []
+        for sent in stop_sent:
+            index = bisect.bisect_left(stop_applied, sent)
+            latencies.append(stop_applied[index] - sent if index < len(stop_applied) else float('inf'))
+        return latencies, len(stop_sent), len(stop_applied)
+    print ("Program is starting ...")
+    for name, priority in (("FIFO", False), ("priority lane", True)):
+        latencies, sent, applied = run(priority)
+        latencies.sort()
+        print ("{:<14} stops sent {}, applied {}, latency p50 {:.1f} ms, worst {:.1f} ms".format(
+            name, sent, applied, latencies[len(latencies) // 2] * 1000, latencies[-1] * 1000))
+    assert applied == sent, "a stop was lost"
+    # At worst a stop waits for the one command already running, the 10 ms sensor query
+    assert latencies[-1] < 0.030, "worst-case stop latency {:.1f} ms".format(latencies[-1] * 1000)
+    print ("\nEnd of program")
            
 # Main program logic follows:
 if __name__ == '__main__':
@@ -164,6 +666,30 @@ if __name__ == '__main__':
         test_Adc()  
     elif sys.argv[1] == 'Buzzer':   
         test_Buzzer()  
+    elif sys.argv[1] == 'Framer':
+        test_Framer()
+    elif sys.argv[1] == 'UdpControl':
+        test_UdpControl()
+    elif sys.argv[1] == 'StopLatency':
+        test_StopLatency()
+    elif sys.argv[1] == 'ModeStop':
+        test_ModeStop()
+    elif sys.argv[1] == 'AsyncServer':
+        test_AsyncServer()
+    elif sys.argv[1] == 'VideoFrames':
+        test_VideoFrames()
+    elif sys.argv[1] == 'CombinedWriteError':
+        test_CombinedWriteError()
+    elif sys.argv[1] == 'Opcodes':
+        test_Opcodes()
+    elif sys.argv[1] == 'HandshakeError':
+        test_HandshakeError()
+    elif sys.argv[1] == 'HeldRetry':
+        test_HeldRetry()
+    elif sys.argv[1] == 'Backpressure':
+        test_Backpressure()
+    elif sys.argv[1] == 'Ranging':
+        test_Ranging()
         
         
         
@@ -0,0 +1,130 @@
+import socket
+import selectors
+import threading
+import time
+from protocol import FRAME_STRUCTS, OPCODES, COMMAND_OPCODES
+
+class UDPControlServer:
+    # Latest-value-wins setpoints accepted on the UDP port; everything else stays on TCP
+    DRIVE_OPCODES = frozenset(COMMAND_OPCODES[command] for command in ("CMD_MOTOR", "CMD_M_MOTOR", "CMD_CAR_ROTATE"))
+
+    def __init__(self):
+        """Receive sequence-numbered drive setpoints and apply only the newest one per client."""
+        self.udp_socket = None
+        self.receive_thread = None
+        self.stop_event = threading.Event()
+        self.selector = None
+        self.handler = None              # Called with (client_address, [(command, parameters)]) for each accepted setpoint
+        self.allowed_clients = None      # Callable returning the IPs allowed to drive, e.g. the TCP command clients
+        self.last_sequence = {}          # Newest sequence number seen per client IP, over UDP or TCP; cleared by a new session
+        self.sequence_lock = threading.Lock()
+        self.stats = {'received': 0, 'applied': 0, 'superseded': 0, 'out_of_order': 0, 'rejected': 0, 'malformed': 0}
+        self.stop_pipe_r, self.stop_pipe_w = socket.socketpair()
+        self.stop_pipe_r.setblocking(0)
+        self.stop_pipe_w.setblocking(0)
+
+    def start(self, ip: str, port: int, handler, allowed_clients=None) -> None:
+        """Bind the UDP port and start receiving setpoints."""
+        self.handler = handler
+        self.allowed_clients = allowed_clients
+        self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.udp_socket.bind((ip, port))
+        self.udp_socket.setblocking(0)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.udp_socket, selectors.EVENT_READ)
+        self.selector.register(self.stop_pipe_r, selectors.EVENT_READ)
+        print(f"UDP control started, listening on {ip}:{self.udp_socket.getsockname()[1]}")
+        self.receive_thread = threading.Thread(target=self.receive_loop, daemon=True)
+        self.receive_thread.start()
+
+    def receive_loop(self) -> None:
+        """Wait for datagrams and apply the newest setpoint of each batch."""
+        while not self.stop_event.is_set():
+            for key, mask in self.selector.select():
+                if key.fileobj is self.stop_pipe_r:
+                    self.stop_event.set()
+                    break
+                self.apply_newest(self.read_pending())
+        print("Closing receive_loop...")
+
+    def read_pending(self) -> list:
+        """Read every datagram already waiting in the socket buffer."""
+        packets = []
+        while True:
+            try:
+                packets.append(self.udp_socket.recvfrom(64))
+            except BlockingIOError:
+                return packets
+            except OSError as e:
+                print(f"UDP receive error: {e}")
+                return packets
+
+    def is_newer(self, client_ip: str, sequence: int) -> bool:
+        """Check a sequence number against the newest one seen, with 16-bit wraparound."""
+        last = self.last_sequence.get(client_ip)
+        if last is None:
+            return True
+        return 0 < ((sequence - last) & 0xFFFF) < 0x8000
+
+    def reset_client(self, client_address: tuple) -> None:
+        """Start a client's sequence numbers over, when it opens a new session with the protocol handshake."""
+        with self.sequence_lock:
+            self.last_sequence.pop(client_address[0], None)
+
+    def note_sequence(self, client_address: tuple, sequence: int) -> None:
+        """Record the sequence number of a frame the client sent over TCP, so older setpoints on UDP are dropped."""
+        with self.sequence_lock:
+            if self.is_newer(client_address[0], sequence):
+                self.last_sequence[client_address[0]] = sequence
+
+    def apply_newest(self, packets: list) -> None:
+        """Drop malformed, unauthorized, out-of-order and superseded packets, then apply what is left."""
+        allowed = self.allowed_clients() if self.allowed_clients is not None else None
+        newest = {}
+        for data, client_address in packets:
+            self.stats['received'] += 1
+            client_ip = client_address[0]
+            if allowed is not None and client_ip not in allowed:
+                self.stats['rejected'] += 1
+                continue
+            if len(data) < 3 or data[0] not in self.DRIVE_OPCODES or len(data) != FRAME_STRUCTS[data[0]].size:
+                self.stats['malformed'] += 1
+                continue
+            values = FRAME_STRUCTS[data[0]].unpack(data)
+            with self.sequence_lock:
+                if not self.is_newer(client_ip, values[1]):
+                    self.stats['out_of_order'] += 1
+                    continue
+                self.last_sequence[client_ip] = values[1]
+            if client_ip in newest:
+                self.stats['superseded'] += 1
+            newest[client_ip] = (client_address, (OPCODES[values[0]][0], list(values[2:])))
+        for client_address, message in newest.values():
+            self.stats['applied'] += 1
+            self.handler(client_address, [message])
+
+    def close(self) -> None:
+        """Stop receiving and close the socket."""
+        self.stop_pipe_w.send(b'\x00')
+        if self.receive_thread is not None:
+            self.receive_thread.join()
+        if self.selector is not None:
+            self.selector.close()
+        if self.udp_socket is not None:
+            self.udp_socket.close()
+        print("UDP control stopped.")
+
+    def get_stats(self) -> dict:
+        """Get the packet counters."""
+        return dict(self.stats)
+
+if __name__ == '__main__':
+    print('Program is starting ... ')
+    server = UDPControlServer()
+    server.start('0.0.0.0', 5001, lambda client_address, messages: print(client_address, messages))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.close()
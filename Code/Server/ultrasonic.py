@@ -1,16 +1,38 @@
 from gpiozero import DistanceSensor, PWMSoftwareFallback, DistanceSensorNoEcho
+import collections
+import statistics
+import threading
 import warnings
 import time
+from scheduler import FixedRateLoop
+from stats import registry
+
+# One filtered ranging result: the distance in cm, the servo angle it was taken at and the monotonic time its newest ping was triggered
+Range = collections.namedtuple('Range', ['distance', 'angle', 'timestamp'])
+
+class TimedDistanceSensor(DistanceSensor):
+    # gpiozero pings on its own thread every sample_wait seconds and keeps only the distances;
+    # this also keeps the newest ping and the monotonic time it was triggered
+    def __init__(self, *args, **kwargs):
+        self.echo = None  # (value as a fraction of max_distance or None if no echo came back, trigger time)
+        super().__init__(*args, **kwargs)
+
+    def _read(self):
+        triggered = time.monotonic()
+        value = super()._read()
+        self.echo = (value, triggered)
+        return value
 
 class Ultrasonic:
-    def __init__(self, trigger_pin: int = 27, echo_pin: int = 22, max_distance: float = 3.0):
+    def __init__(self, trigger_pin: int = 27, echo_pin: int = 22, max_distance: float = 3.0, queue_len: int = 9):
         # Initialize the Ultrasonic class and set up the distance sensor.
         warnings.filterwarnings("ignore", category = DistanceSensorNoEcho)
         warnings.filterwarnings("ignore", category = PWMSoftwareFallback)  # Ignore PWM software fallback warnings
         self.trigger_pin = trigger_pin  # Set the trigger pin number
         self.echo_pin = echo_pin        # Set the echo pin number
         self.max_distance = max_distance  # Set the maximum distance
-        self.sensor = DistanceSensor(echo=self.echo_pin, trigger=self.trigger_pin, max_distance=self.max_distance)  # Initialize the distance sensor
+        self.queue_len = queue_len      # Echoes gpiozero averages; 1 leaves the filtering to the caller
+        self.sensor = TimedDistanceSensor(echo=self.echo_pin, trigger=self.trigger_pin, max_distance=self.max_distance, queue_len=self.queue_len)  # Initialize the distance sensor
 
     def __enter__(self):
         return self
@@ -32,10 +54,102 @@ class Ultrasonic:
             print(f"Warning: {e}")
             return None
 
+    def get_echo(self) -> tuple:
+        """
+        Get the newest single ping taken by gpiozero's background thread.
+
+        Returns:
+        tuple: (distance in centimeters or None if no echo came back, monotonic time the ping was triggered),
+        or None before the first ping.
+        """
+        echo = self.sensor.echo
+        if echo is None:
+            return None
+        value, triggered = echo
+        return (None if value is None else round(value * self.max_distance * 100, 1)), triggered
+
     def close(self):
         # Close the distance sensor.
         self.sensor.close()  # Close the sensor to release resources
 
+class RangingService:
+    def __init__(self, sonic: Ultrasonic, period: float = 0.06, window: int = 5, max_age: float = 1.0, settle: float = 0.1):
+        """Collect gpiozero's pings on a fixed cadence, and keep the median of the newest echoes at each servo angle."""
+        self.sonic = sonic
+        self.period = period            # Seconds between checks for a new ping; gpiozero pings about every 0.06 s
+        self.window = window            # Echoes kept per angle
+        self.max_age = max_age          # Older echoes are left out of the median, and older results are stale
+        self.settle = settle            # Seconds the servo takes to reach a new angle; pings triggered before then are ignored
+        self.angle = 90                 # The servos start centred
+        self.settled = 0.0              # Monotonic time the servo reaches self.angle
+        self.echoes = {}                # angle -> deque of (distance, timestamp)
+        self.ranges = {}                # angle -> newest Range
+        self.range = None               # Newest Range at any angle
+        self.triggered = 0.0            # Trigger time of the newest ping taken in
+        self.lock = threading.Lock()
+        self.loop = FixedRateLoop('sonic')
+        self.pings = registry.counter('sonic.pings')
+        self.no_echo = registry.counter('sonic.no_echo')
+        self.spikes = registry.counter('sonic.spikes')  # Echoes the median left out, more than 20% off it
+        self.unsettled = registry.counter('sonic.unsettled')  # Pings triggered while the servo was still turning
+
+    def start(self) -> None:
+        """Start pinging."""
+        self.loop.start()
+        self.loop.set_step(self.step, 1.0 / self.period, 'ranging')
+
+    def stop(self) -> None:
+        """Stop pinging; the last results stay readable but go stale."""
+        self.loop.stop()
+
+    def aim(self, angle: int) -> None:
+        """Tell the service the servo was just turned to angle; echoes are tagged with it once it has settled."""
+        with self.lock:
+            if angle != self.angle:
+                self.angle = angle
+                self.settled = time.monotonic() + self.settle
+
+    def step(self) -> None:
+        """Take in gpiozero's newest ping and update the filtered distance at the angle it was triggered at."""
+        echo = self.sonic.get_echo()
+        if echo is None or echo[1] <= self.triggered:
+            return  # No new ping since the last step
+        distance, triggered = echo
+        self.triggered = triggered
+        self.pings.increment()
+        with self.lock:
+            angle, settled = self.angle, self.settled
+            if triggered < settled:
+                self.unsettled.increment()
+                return  # Still turning: the echo came from somewhere in between
+            if distance is None:
+                self.no_echo.increment()
+                return
+            echoes = self.echoes.get(angle)
+            if echoes is None:
+                echoes = self.echoes[angle] = collections.deque(maxlen=self.window)
+            while echoes and triggered - echoes[0][1] > self.max_age:
+                echoes.popleft()
+            echoes.append((distance, triggered))
+            median = statistics.median(echo[0] for echo in echoes)
+            if abs(distance - median) > 0.2 * median:
+                self.spikes.increment()
+            self.range = self.ranges[angle] = Range(round(median, 1), angle, triggered)
+
+    def latest(self, angle: int = None, max_age: float = None) -> Range:
+        """Get the newest filtered Range at an angle (default: any), or None if it is older than max_age."""
+        result = self.range if angle is None else self.ranges.get(angle)
+        if result is None or time.monotonic() - result.timestamp > (max_age if max_age is not None else self.max_age):
+            return None
+        return result
+
+    def get_stats(self) -> dict:
+        """Get the ping, missing echo, spike and unsettled counts, the loop overruns and the age of each angle's result."""
+        now = time.monotonic()
+        return {'pings': self.pings.get(), 'no_echo': self.no_echo.get(), 'spikes': self.spikes.get(), 'unsettled': self.unsettled.get(),
+                'overruns': self.loop.get_stats()['overruns'],
+                'ages': {angle: round(now - result.timestamp, 3) for angle, result in list(self.ranges.items())}}
+
 if __name__ == '__main__':
     # Initialize the Ultrasonic instance with default pin numbers and max distance
     with Ultrasonic() as ultrasonic:
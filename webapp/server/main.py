@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import importlib.util
 import socket
 import struct
 import threading
@@ -16,6 +17,43 @@ from pydantic import BaseModel, Field
 
 CLIENT_DIR = Path(__file__).resolve().parents[1] / "client"
 
+# Binary command protocol, as in Code/Client/Protocol.py: after the handshake line is acknowledged,
+# every command is a 1-byte opcode, a 16-bit sequence number and fixed int16 arguments
+PROTOCOL_HANDSHAKE = "CMD_PROTOCOL#1"
+HEADER = struct.Struct("<BH")
+TEXT_LENGTH = struct.Struct("<H")
+OP_TEXT = 0xFF  # Length-prefixed text frame for commands without a binary layout
+
+
+def load_opcodes() -> dict:
+    """Load the binary command set from the car server's opcodes.py, the one definition of it."""
+    path = Path(__file__).resolve().parents[2] / "Code" / "Server" / "opcodes.py"
+    spec = importlib.util.spec_from_file_location("server_opcodes", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.OPCODES
+
+
+# Command -> (opcode, number of int16 arguments)
+OPCODES = {command: (opcode, count) for opcode, (command, count) in load_opcodes().items()}
+FRAME_STRUCTS = {command: struct.Struct("<BH" + "h" * count) for command, (opcode, count) in OPCODES.items()}
+MODE_WORDS = {"one": 0, "two": 1, "three": 3, "four": 2}
+
+
+def encode_frame(message: str, sequence: int) -> bytes:
+    fields = message.strip().split("#")
+    layout = OPCODES.get(fields[0])
+    values = None
+    if layout is not None:
+        try:
+            values = [MODE_WORDS[x] if x in MODE_WORDS else int(round(float(x))) for x in fields[1:] if x != ""]
+        except ValueError:
+            values = None
+    if values is None or len(values) != layout[1] or any(v < -32768 or v > 32767 for v in values):
+        payload = message.strip().encode("utf-8")
+        return HEADER.pack(OP_TEXT, sequence & 0xFFFF) + TEXT_LENGTH.pack(len(payload)) + payload
+    return FRAME_STRUCTS[fields[0]].pack(layout[0], sequence & 0xFFFF, *values)
+
 
 class ConnectRequest(BaseModel):
     ip: str = Field(..., description="Robot IP address")
@@ -59,7 +97,11 @@ class RobotBridge:
     video_thread: Optional[threading.Thread] = None
     power_thread: Optional[threading.Thread] = None
     lock: threading.Lock = field(default_factory=threading.Lock)
+    send_lock: threading.Lock = field(default_factory=threading.Lock)
     running: bool = False
+    binary: bool = False
+    sequence: int = 0
+    status_buffer: str = ""
 
     def connect(self, ip: str) -> None:
         self.disconnect()
@@ -74,6 +116,7 @@ class RobotBridge:
         try:
             self.command_socket.connect((ip, 5000))
             self.video_socket.connect((ip, 8000))
+            self._negotiate_protocol()
         except OSError:
             self.disconnect()
             raise
@@ -103,15 +146,46 @@ class RobotBridge:
             self.video_socket.close()
         self.command_socket = None
         self.video_socket = None
+        self.binary = False
         with self.lock:
             self.state.connected = False
             self.state.last_status = "Disconnected"
 
+    def _negotiate_protocol(self) -> None:
+        # Ask for binary command frames; a server that does not answer within a second keeps the text protocol
+        reply = b""
+        self.command_socket.settimeout(1)
+        try:
+            self.command_socket.sendall((PROTOCOL_HANDSHAKE + "\n").encode("utf-8"))
+            while b"\n" not in reply:
+                chunk = self.command_socket.recv(64)
+                if not chunk:
+                    break
+                reply += chunk
+        except socket.timeout:
+            pass
+        finally:
+            self.command_socket.settimeout(2)
+        line, _, rest = reply.partition(b"\n")
+        # The server may append '#<udp port>'; the bridge keeps every command on TCP
+        self.binary = "#".join(line.decode("utf-8", errors="ignore").strip().split("#")[:2]) == PROTOCOL_HANDSHAKE
+        self.sequence = 0
+        self.status_buffer = (rest if self.binary else reply).decode("utf-8", errors="ignore")
+
     def send_command(self, command: str) -> None:
         if not self.command_socket or not self.state.connected:
             raise RuntimeError("Command socket is not connected")
-        payload = command.encode("utf-8")
-        self.command_socket.sendall(payload)
+        with self.send_lock:
+            if self.binary:
+                frames = []
+                for line in command.split("\n"):
+                    if line.strip():
+                        self.sequence = (self.sequence + 1) & 0xFFFF
+                        frames.append(encode_frame(line, self.sequence))
+                payload = b"".join(frames)
+            else:
+                payload = command.encode("utf-8")
+            self.command_socket.sendall(payload)
         with self.lock:
             self.state.last_command = command.strip()
 
@@ -126,7 +200,7 @@ class RobotBridge:
                 continue
 
     def _command_loop(self) -> None:
-        buffer = ""
+        buffer = self.status_buffer  # Status lines that arrived with the handshake reply
         while self.running:
             if not self.command_socket:
                 break